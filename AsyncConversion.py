@@ -0,0 +1,216 @@
+'''
+AsyncConversion.py is the asyncio API of the converter, for programs that run an event loop such as an ingestion
+service. Its coroutines are the counterparts of the JDXConverter functions of the same names:
+    getJDX, getMetaDataForMoleculeFromOnline, getSpectrumForMoleculeFromOnline ( NIST Webbook lookups, through one
+    NISTWebbook.AsyncWebbookSession shared by every coroutine )
+    convertJDXFile, getSpectrumDataFromLocalJDXInParallel ( local JDX files, read and binned in an executor )
+Nothing is read or written on the event loop: JDX files are parsed on a pool of processes ( or in a thread ), and
+downloaded files, the Webbook cache and the output files are written in threads.
+convert runs the conversion of JDXConverter.convertMolecules with many molecules in flight at once, so the lookups
+and downloads of some molecules overlap the parsing of others. Its output files are the same as those of
+convertMolecules.
+Example:
+    outputFileNames = asyncio.run(AsyncConversion.convert(['Methanol', 'Ethanol'], database))
+'''
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import multiprocessing
+import os
+import time
+
+import Instrumentation
+import JCampSG
+import JDXConverter
+import NISTWebbook
+import StreamingConversion
+
+#Molecules converted at the same time by convert
+ConcurrentMolecules = 32
+
+@contextlib.asynccontextmanager
+async def openSession(session=None):
+    """
+    This function yields session, or if it is None a new AsyncWebbookSession with the domain, the cache and the rate limit of the default NISTWebbook session, closed on exit
+    """
+    if session is not None:
+        yield session
+        return
+    defaultSession = NISTWebbook.getDefaultSession()
+    async with NISTWebbook.AsyncWebbookSession(domain=defaultSession.domain, cache=defaultSession.cache, timeout=defaultSession.timeout) as session:
+        session.rateLimiter = defaultSession.rateLimiter #Both sessions talk to the same server, so they share its request budget
+        yield session
+
+async def runInExecutor(executor, function, *args):
+    """
+    This function runs function(*args) on executor ( a process pool, or None for the event loop's thread pool ) and waits for it without blocking the event loop
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(function, *args))
+
+def readSpectrum(filename, maximumAtomicUnit=None):
+    """
+    This function reads and bins a downloaded JDX file, as getSpectrumForMoleculeFromOnline does. It is the work done in the executor
+    """
+    return JDXConverter.createArray(JCampSG.JCAMP_reader(filename), maximumAtomicUnit=maximumAtomicUnit)
+
+async def getJDX(URL, molecule_name, session=None, outputdirectory="JDXFiles"):
+    """
+    This function is JDXConverter.getJDX as a coroutine: it downloads the JDX file at URL and writes it in a thread
+    INPUT: URL ( mass spectrum in JCAMP-DX format download URL ) | molecule_name ( the file is named after it ) | session ( optional NISTWebbook.AsyncWebbookSession, see openSession ) | outputdirectory ( directory the file is saved in )
+    OUTPUT: returns the filename with the output directory path
+    """
+    async with openSession(session) as session:
+        remotefile = await session.get(URL)
+    filename = os.path.join(outputdirectory, molecule_name+".jdx")
+    await asyncio.to_thread(JDXConverter.writeFileAtomically, filename, remotefile.content)
+    return filename
+
+async def getMetaDataForMoleculeFromOnline(molecule_name, session=None):
+    """
+    This function is JDXConverter.getMetaDataForMoleculeFromOnline as a coroutine
+    INPUT: molecule_name | session ( optional NISTWebbook.AsyncWebbookSession, see openSession )
+    OUTPUT: molecular_formula | molecular_weight | electron_numbers ( all 'unknown' if the molecule is not found )
+    """
+    try:
+        async with openSession(session) as session:
+            url = session.moleculeURL(molecule_name)
+            record = await session.getMoleculePage(url)
+        molecular_formula = record['formula']
+        molecular_weight = record['molecularWeight']
+        if molecular_formula is None or molecular_weight is None:
+            raise ValueError(f'No molecular formula or weight found on {url}')
+        #pymatgen is slow to import, so the first call would hold up the event loop
+        electron_numbers = await asyncio.to_thread(JDXConverter.getElectronNumbers, molecular_formula)
+    except Exception:
+        molecular_formula = 'unknown'
+        molecular_weight = 'unknown'
+        electron_numbers = 'unknown'
+    return molecular_formula, molecular_weight, electron_numbers
+
+async def fetchJDXFromOnline(molecule_name, session):
+    """
+    This function downloads the JDX file of a molecule's mass spectrum: its molecule page, then its mass spectrum page, then the file
+    OUTPUT: JDXFile ( path+filename of the downloaded file. An exception is raised if the molecule has no mass spectrum )
+    """
+    mass_spectrum_url = (await session.getMoleculePage(session.moleculeURL(molecule_name)))['massSpectrumURL']
+    if mass_spectrum_url is None:
+        raise LookupError(f'No mass spectrum found for {molecule_name}')
+    jdx_download_url = (await session.getMoleculePage(mass_spectrum_url))['jcampURL']
+    if jdx_download_url is None:
+        raise LookupError(f'No JCAMP-DX file found on {mass_spectrum_url}')
+    return await getJDX(jdx_download_url, molecule_name, session=session)
+
+async def getSpectrumForMoleculeFromOnline(molecule_name, session=None, maximumAtomicUnit=None, executor=None):
+    """
+    This function is JDXConverter.getSpectrumForMoleculeFromOnline as a coroutine. The JDX file is downloaded, then read and binned on executor
+    INPUT: molecule_name | session ( optional NISTWebbook.AsyncWebbookSession, see openSession ) | maximumAtomicUnit ( as for binSpectrum ) | executor ( see runInExecutor )
+    OUTPUT: spectrum_data | SourceOfFragmentationPattern ( as for JDXConverter.getSpectrumForMoleculeFromOnline )
+    """
+    try:
+        async with openSession(session) as session:
+            jdx_filename = await fetchJDXFromOnline(molecule_name, session)
+        spectrum_data = await runInExecutor(executor, readSpectrum, jdx_filename, maximumAtomicUnit)
+        SourceOfFragmentationPattern = 'NIST Webbook'
+    except Exception:
+        spectrum_data = [0] * (JDXConverter.MaximumAtomicUnit if maximumAtomicUnit is None else 0 if maximumAtomicUnit == 'auto' else maximumAtomicUnit)
+        SourceOfFragmentationPattern = 'unknown'
+
+        print(f'Spectrum data for {molecule_name} NOT FOUND in NIST Webbook. It is set to a blank list and SourceOfFragmentationPattern is set to unknown')
+
+    return spectrum_data, SourceOfFragmentationPattern
+
+async def convertJDXFile(filename, executor=None, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
+    """
+    This function is JDXConverter.convertJDXFile run on executor ( see runInExecutor )
+    OUTPUT: massIndices | intensities | error ( as for JDXConverter.convertJDXFile )
+    """
+    return await runInExecutor(executor, JDXConverter.convertJDXFile, filename, rounding, duplicatePolicy, maximumAtomicUnit)
+
+async def getSpectrumDataFromLocalJDXInParallel(JDXFilesList, executor=None, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None, sparse=False):
+    """
+    This function is JDXConverter.getSpectrumDataFromLocalJDXInParallel as a coroutine: every file is converted on executor ( see runInExecutor ), all of them at once
+    INPUT: JDXFilesList | rounding, duplicatePolicy, maximumAtomicUnit | sparse ( as for JDXConverter.getSpectrumDataFromLocalJDXInParallel ) | executor
+    OUTPUT: AllSpectraData | failures ( as for JDXConverter.getSpectrumDataFromLocalJDXInParallel )
+    """
+    measured = Instrumentation.enabled
+    convert = JDXConverter.convertJDXFileMeasured if measured else JDXConverter.convertJDXFile
+    results = await asyncio.gather(*(runInExecutor(executor, convert, filename, rounding, duplicatePolicy, maximumAtomicUnit) for filename in JDXFilesList))
+    return JDXConverter.collectLocalSpectra(JDXFilesList, results, maximumAtomicUnit, sparse, measured)
+
+async def getMoleculeMetaDataFromOnline(molecule, session):
+    """
+    This function looks up online the metadata of a molecule of StreamingConversion.resolveMolecules, if its database row does not give all of it
+    OUTPUT: onlineMetaData ( what getMetaDataForMoleculeFromOnline returns, None if the lookup is not needed )
+    """
+    if not StreamingConversion.needsOnlineMetaData(molecule):
+        return None
+    return await getMetaDataForMoleculeFromOnline(molecule['MoleculeName'], session)
+
+async def getMoleculeSpectrum(molecule, session, executor, maximumAtomicUnit):
+    """
+    This function converts the spectrum of a molecule of StreamingConversion.resolveMolecules: from its local JDX file, or from online if it has none or it cannot be converted, as convertMolecules does
+    OUTPUT: spectrum ( (massToCharges, intensities) of a local file, or the binned spectrum from online ) | SourceOfFragmentationPattern ( None if the spectrum is that of the local file )
+    """
+    if molecule['JDXFile'] is not None:
+        massIndices, intensities, error = await convertJDXFile(molecule['JDXFile'], executor, maximumAtomicUnit=maximumAtomicUnit)
+        if error is None:
+            return (massIndices + 1, intensities), None
+        print(f"Could not convert {molecule['JDXFile']} ({error}). Its spectrum will be taken from online instead.")
+    return await getSpectrumForMoleculeFromOnline(molecule['MoleculeName'], session, maximumAtomicUnit, executor)
+
+async def convertMolecule(molecule, session, executor, semaphore, maximumAtomicUnit):
+    """
+    This function converts one molecule of StreamingConversion.resolveMolecules once semaphore lets it. The metadata lookup and the spectrum run at the same time
+    OUTPUT: spectrum ( see getMoleculeSpectrum ) | metadata ( see StreamingConversion.getMoleculeMetadata )
+    """
+    async with semaphore:
+        moleculeStartTime = time.perf_counter()
+        onlineMetaData, (spectrum, SourceOfFragmentationPattern) = await asyncio.gather(getMoleculeMetaDataFromOnline(molecule, session),
+                                                                                         getMoleculeSpectrum(molecule, session, executor, maximumAtomicUnit))
+        metadata = StreamingConversion.getMoleculeMetadata(molecule, onlineMetaData)
+        if SourceOfFragmentationPattern is not None:
+            metadata['SourceOfFragmentationPatterns'] = SourceOfFragmentationPattern
+        Instrumentation.record('molecule', time.perf_counter() - moleculeStartTime)
+    return spectrum, metadata
+
+async def convert(MoleculeNames, DataBase_data_holder=(), JDXFilesLocation='JDXFiles//', outputFileDirectoryPath='OutputFiles', outputFormats=('csv', 'txt', 'tab'),
+                  max_workers=None, maximumAtomicUnit=None, session=None, concurrentMolecules=ConcurrentMolecules, indexFileName=None):
+    """
+    This function is JDXConverter.convertMolecules as a coroutine. Up to concurrentMolecules molecules are converted at once, so their Webbook lookups and downloads overlap the parsing of the JDX files of the others
+    INPUT: MoleculeNames, JDXFilesLocation, outputFileDirectoryPath, outputFormats, maximumAtomicUnit, indexFileName ( as for convertMolecules ) | DataBase_data_holder ( as for convertMolecules, empty to look up every molecule online ) | max_workers ( number of processes parsing JDX files, the number of CPUs if not given. With 1 the files are parsed in threads of this process ) | session ( optional NISTWebbook.AsyncWebbookSession, see openSession ) | concurrentMolecules ( molecules converted at once )
+    OUTPUT: outputFileNames ( as for convertMolecules )
+    With max_workers above 1 the parsing processes are started with spawn, which imports the main module of the program again in each of them. A script calling this function must then do so under if __name__ == '__main__':, otherwise the pool fails with concurrent.futures.process.BrokenProcessPool
+    """
+    if maximumAtomicUnit is None:
+        maximumAtomicUnit = JDXConverter.MaximumAtomicUnit
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    JDXDirectory = await asyncio.to_thread(JDXConverter.getJDXDirectoryIndex, JDXFilesLocation, outputFileDirectoryPath, indexFileName)
+    molecules = await asyncio.to_thread(list, StreamingConversion.resolveMolecules(MoleculeNames, DataBase_data_holder, JDXFilesLocation, JDXDirectory))
+
+    semaphore = asyncio.Semaphore(concurrentMolecules)
+    #The parsing processes are started with spawn, as forking a process whose threads hold locks is not safe
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) if max_workers > 1 else None
+    try:
+        async with openSession(session) as session:
+            tasks = [asyncio.ensure_future(convertMolecule(molecule, session, executor, semaphore, maximumAtomicUnit)) for molecule in molecules]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    AllSpectra = JDXConverter.SparseSpectraMatrix(maximumAtomicUnit=maximumAtomicUnit)
+    for spectrum, metadata in results:
+        if isinstance(spectrum, tuple):
+            AllSpectra.appendPeaks(*spectrum, **metadata)
+        else:
+            AllSpectra.append(spectrum, **metadata)
+    return await asyncio.to_thread(JDXConverter.exportToOutputFormats, outputFileDirectoryPath, AllSpectra, outputFormats)
@@ -0,0 +1,178 @@
+'''
+Instrumentation.py records where the time of a conversion goes. It is opt-in: nothing is recorded unless it is
+enabled, with enable() or by setting the JDX_INSTRUMENTATION environment variable to 1.
+Stages are timed with stage(), used either as a context manager or as a decorator. Each stage keeps its number of
+runs, total and longest wall time and a histogram of its durations. count() adds to named counters such as bytes
+read or cache hits. The records can be printed as a summary, or exported as JSON or in the Prometheus text format.
+Example:
+    with Instrumentation.stage('database load'):
+        database = loadMoleculeDatabase('MoleculesInfo.csv')
+    Instrumentation.count('bytes read', 1024)
+    print(Instrumentation.summary())
+Work done in other processes ( e.g. the workers of getSpectrumDataFromLocalJDXInParallel ) is only recorded if the
+process sends its measurements back to be recorded by the parent.
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+
+#Nothing is recorded unless this is True
+enabled = os.environ.get('JDX_INSTRUMENTATION', '') not in ('', '0')
+
+#Upper bounds of the histogram buckets, in seconds. The last bucket holds everything longer.
+histogramBuckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+class StageRecord:
+    """
+    This class holds the measurements of one stage: number of runs, total and longest wall time in seconds, and the number of runs in each histogram bucket
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        self.bucketCounts = [0] * (len(histogramBuckets) + 1)
+
+    def add(self, seconds):
+        self.count = self.count + 1
+        self.totalSeconds = self.totalSeconds + seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        bucket = 0
+        while bucket < len(histogramBuckets) and seconds > histogramBuckets[bucket]:
+            bucket = bucket + 1
+        self.bucketCounts[bucket] = self.bucketCounts[bucket] + 1
+
+stages = {} #stage name -> StageRecord
+counters = {} #counter name -> value
+lock = threading.Lock()
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    """
+    This function forgets everything recorded so far
+    """
+    with lock:
+        stages.clear()
+        counters.clear()
+
+def record(stageName, seconds):
+    """
+    This function adds one run of a stage that was timed elsewhere, e.g. in a worker process
+    INPUT: stageName | seconds ( wall time of the run )
+    """
+    if not enabled:
+        return
+    with lock:
+        if stageName not in stages:
+            stages[stageName] = StageRecord()
+        stages[stageName].add(seconds)
+
+def count(counterName, amount=1):
+    """
+    This function adds amount to a counter. Example: count('bytes fetched', len(content))
+    """
+    if not enabled:
+        return
+    with lock:
+        counters[counterName] = counters.get(counterName, 0) + amount
+
+class stage:
+    """
+    This class times a stage, as a context manager ( with stage('export'): ... ) or as a decorator ( @stage('export') ). It records nothing when instrumentation is disabled.
+    INPUT: stageName ( name of the stage, e.g. 'network fetch' )
+    """
+
+    def __init__(self, stageName):
+        self.stageName = stageName
+        self.startTimes = threading.local() #A decorated function can run in several threads at once
+
+    def __enter__(self):
+        if enabled:
+            if not hasattr(self.startTimes, 'stack'):
+                self.startTimes.stack = []
+            self.startTimes.stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exceptionType, exception, traceback):
+        stack = getattr(self.startTimes, 'stack', None)
+        if stack:
+            record(self.stageName, time.perf_counter() - stack.pop())
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def timedFunction(*args, **kwargs):
+            with self:
+                return function(*args, **kwargs)
+        return timedFunction
+
+def toDictionary():
+    """
+    This function returns everything recorded as a dictionary: {'stages': {name: {'count', 'totalSeconds', 'maxSeconds', 'histogram': {bucket upper bound: runs}}}, 'counters': {name: value}}
+    """
+    with lock:
+        stagesDictionary = {}
+        for stageName, stageRecord in stages.items():
+            histogram = {str(upperBound): runs for upperBound, runs in zip(histogramBuckets + ('+Inf',), stageRecord.bucketCounts)}
+            stagesDictionary[stageName] = {'count': stageRecord.count, 'totalSeconds': stageRecord.totalSeconds, 'maxSeconds': stageRecord.maxSeconds, 'histogram': histogram}
+        return {'stages': stagesDictionary, 'counters': dict(counters)}
+
+def toJSON():
+    return json.dumps(toDictionary(), indent=2)
+
+def prometheusName(name):
+    #Prometheus names and labels only allow letters, digits and underscores
+    return ''.join(character if character.isalnum() else '_' for character in name.lower())
+
+def toPrometheus(prefix='jdxconverter'):
+    """
+    This function returns everything recorded in the Prometheus text format: one histogram per stage ( {prefix}_stage_seconds with a stage label ) and one counter per counter ( {prefix}_{name}_total )
+    """
+    records = toDictionary()
+    lines = [f'# HELP {prefix}_stage_seconds Wall time of the stages of a conversion.', f'# TYPE {prefix}_stage_seconds histogram']
+    for stageName, stageRecord in sorted(records['stages'].items()):
+        label = stageName.replace('\\', '\\\\').replace('"', '\\"')
+        runs = 0
+        for upperBound, bucketRuns in stageRecord['histogram'].items():
+            runs = runs + bucketRuns
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="{upperBound}"}} {runs}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {stageRecord["totalSeconds"]}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {stageRecord["count"]}')
+    for counterName, value in sorted(records['counters'].items()):
+        metricName = f'{prefix}_{prometheusName(counterName)}_total'
+        lines.append(f'# TYPE {metricName} counter')
+        lines.append(f'{metricName} {value}')
+    return '\n'.join(lines) + '\n'
+
+def summary():
+    """
+    This function returns a table of the stages, longest total time first, followed by the counters
+    """
+    records = toDictionary()
+    lines = [f'{"stage":<28}{"count":>10}{"total s":>12}{"mean ms":>12}{"max ms":>12}']
+    for stageName, stageRecord in sorted(records['stages'].items(), key=lambda item: -item[1]['totalSeconds']):
+        meanMilliseconds = 1000 * stageRecord['totalSeconds'] / stageRecord['count'] if stageRecord['count'] else 0.0
+        lines.append(f'{stageName:<28}{stageRecord["count"]:>10}{stageRecord["totalSeconds"]:>12.3f}{meanMilliseconds:>12.2f}{1000 * stageRecord["maxSeconds"]:>12.2f}')
+    for counterName, value in sorted(records['counters'].items()):
+        lines.append(f'{counterName:<28}{value:>10}')
+    return '\n'.join(lines)
+
+def writeReport(filename):
+    """
+    This function writes everything recorded to a file: in the Prometheus text format if the file name ends in .prom or .txt, as JSON otherwise
+    """
+    with open(filename, 'w') as reportFile:
+        if filename.endswith('.prom') or filename.endswith('.txt'):
+            reportFile.write(toPrometheus())
+        else:
+            reportFile.write(toJSON())
@@ -1,4 +1,10 @@
-from numpy import array, linspace, amin, amax, alen, append, arange, float64, logical_and, log10
+from numpy import array, amin, amax, arange, float64, logical_and, log10, concatenate, cumsum, \
+    repeat, frombuffer, fromstring, bincount, uint8, where, ones, zeros, intp, int8, isin, flatnonzero, \
+    maximum, isclose, empty, divide, multiply, minimum, searchsorted
+from numpy import log10 as array_log10      ## `log10` itself is math.log10 (imported below), which only takes scalars
+import io
+import locale
+import mmap
 import re
 import string
 import pdb
@@ -37,9 +43,12 @@ END OF LICENSE
 jcamp.py contains functions useful for parsing JCAMP-DX formatted files containing spectral data. The main
 function `JCAMP_reader()` formats the input file into a Python dictionary, while `JCAMP_calc_xsec()`
 converts a given JCAMP-style data dictionary from absorption units to cross-section (m^2).
+Files holding several blocks (compound `##BLOCKS=` files, GC-MS runs) are read one block at a time with
+`JCAMP_blocks()`, and very large files are read through a memory map with `JCAMP_mmap_reader()`.
 '''
 
-__all__ = ['JCAMP_reader', 'JCAMP_calc_xsec', 'is_float']
+__all__ = ['JCAMP_reader', 'JCAMP_mmap_reader', 'JCAMP_parse', 'JCAMP_index_blocks', 'JCAMP_blocks', 'JCAMPBlock', 'JCAMPBlockList',
+           'JCAMP_calc_xsec', 'JCAMP_calc_xsec_batch', 'is_float']
 
 ##=====================================================================================================
 def JCAMP_reader(filename):
@@ -53,99 +62,802 @@ def JCAMP_reader(filename):
     filename : str
         The JCAMP-DX filename to read.
 
+    Returns
+    -------
+    jcamp_dict : dict
+        The dictionary containing the header and data vectors.
+
+    All the blocks of a multi-block file end up in the one dictionary. Use `JCAMP_blocks()` to read them
+    separately.
+    '''
+    with open(filename, 'r') as f:
+        return(JCAMP_parse(f))
+
+##=====================================================================================================
+## A header (`##`) or comment (`$$`) line of a file read by `JCAMP_mmap_reader()`.
+LABEL_LINE_PATTERN = re.compile(rb'^(?:##|\$\$)[^\n]*', re.MULTILINE)
+LONE_CR_PATTERN = re.compile(rb'\r(?!\n)')
+MMAP_CHUNK_SIZE = 2**22      ## bytes of data lines parsed at a time by `JCAMP_mmap_reader()`
+LINSPACE_CHUNK_POINTS = 2**20    ## x values generated at a time by `linspace_lines()`
+
+def JCAMP_mmap_reader(filename, chunk_size=MMAP_CHUNK_SIZE):
+    '''
+    Read a JDX-format file as `JCAMP_reader()` does, with a memory map instead of reading it line by line.
+
+    Parameters
+    ----------
+    filename : str
+        The JCAMP-DX filename to read.
+    chunk_size : int
+        The number of bytes of data lines handed to the numeric parser at a time.
+
+    Returns
+    -------
+    jcamp_dict : dict
+        The dictionary containing the header and data vectors, the same as that of `JCAMP_reader()`.
+
+    Only the header lines are decoded into strings. The byte ranges of the data blocks are found in the memory
+    map and parsed by `parse_xyy_chunk()` directly from the mapped bytes, `chunk_size` bytes at a time, so the
+    memory used beyond the final `x` and `y` vectors stays around a few times `chunk_size`. (X++(Y..Y)) blocks
+    in plain (AFFN) form take this path. ASDF compressed blocks, blocks with invalid lines and (XY..XY) blocks
+    are decoded and parsed as lines, as by `JCAMP_reader()`.
+    '''
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:          ## empty file
+            return(JCAMP_parse([]))
+        try:
+            ## Text mode also ends lines at a lone carriage return, which the byte ranges below do not.
+            if LONE_CR_PATTERN.search(data):
+                return(JCAMP_reader(filename))
+            encoding = locale.getpreferredencoding(False)
+
+            jcamp_dict = {}
+            (xstart, xnum, y, ycheck, x) = ([], [], [], [], [])
+            datastart = False
+            block_mode = None
+            block_ranges = []       ## byte ranges of the data lines of the current data block
+
+            def flush_block():
+                if not block_ranges: return
+                parsed = None
+                if (block_mode == 'xyy'):
+                    parsed = parse_xyy_ranges(data, block_ranges, chunk_size)
+                if (parsed is None):
+                    lines = [line + '\n' for (start,stop) in block_ranges for line in data[start:stop].decode(encoding).replace('\r\n', '\n').split('\n') if line.strip()]
+                    if (block_mode == 'xyy'):
+                        parsed = parse_xyy_block(lines)
+                    else:
+                        (block_x, block_y) = parse_xy_block(lines, separator=(',' if block_mode == 'xy_comma' else ' '))
+                        x.append(block_x)
+                        y.append(block_y)
+                if (block_mode == 'xyy'):
+                    xstart.append(parsed[0])
+                    xnum.append(parsed[1])
+                    y.append(parsed[2])
+                    ycheck.append(parsed[3])
+                del block_ranges[:]
+
+            position = 0
+            for match in LABEL_LINE_PATTERN.finditer(data):
+                if datastart and (block_mode is not None) and (match.start() > position):
+                    block_ranges.append((position, match.start()))
+                position = match.end() + 1
+                if (match.group()[:2] == b'$$'): continue
+
+                (lhs,rhs) = parse_header_line(match.group().decode(encoding).rstrip('\r'), jcamp_dict)
+                if (lhs in ('xydata','xypoints','peak table')):
+                    flush_block()
+                    datastart = True
+                    block_mode = data_block_mode(rhs, jcamp_dict)
+                elif (lhs == 'end'):
+                    flush_block()
+                    datastart = False
+            if datastart and (block_mode is not None) and (data.size() > position):
+                block_ranges.append((position, data.size()))
+            flush_block()
+        finally:
+            data.close()
+
+    return(JCAMP_data_arrays(jcamp_dict, xstart, xnum, y, ycheck, x))
+
+##=====================================================================================================
+def JCAMP_parse(lines):
+    '''
+    Parse the lines of a JCAMP-DX file or block into a dictionary, as `JCAMP_reader()` does for a whole file.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines to parse, e.g. an open text file.
+
     Returns
     -------
     jcamp_dict : dict
         The dictionary containing the header and data vectors.
     '''
 
-    f = open(filename, 'r')
     jcamp_dict = {}
-    xstart = []
-    xnum = []
-    y = []
-    x = []
+    xstart = []         ## one array of line-start x values per data block
+    xnum = []           ## one array of y-values-per-line counts per data block
+    y = []              ## one array of y values per data block
+    ycheck = []         ## one array per (X++(Y..Y)) data block flagging the ASDF Y-check values in `y`
+    x = []              ## one array of x values per (XY..XY) data block
     datastart = False
-    values_pattern = re.compile('\s*\w\s*')
-    jcamp_numbers_pattern = re.compile(r'([+-]?\d+\.\d*)|([+-]?\d+)')
+    block_mode = None   ## how the lines of the current data block are parsed, see `data_block_mode()`
+    block_lines = []
+
+    def flush_block():
+        ## Parse all the lines collected for the current data block in one go.
+        if not block_lines: return
+        if (block_mode == 'xyy'):
+            (block_xstart, block_xnum, block_y, block_ycheck) = parse_xyy_block(block_lines)
+            xstart.append(block_xstart)
+            xnum.append(block_xnum)
+            y.append(block_y)
+            ycheck.append(block_ycheck)
+        else:
+            (block_x, block_y) = parse_xy_block(block_lines, separator=(',' if block_mode == 'xy_comma' else ' '))
+            x.append(block_x)
+            y.append(block_y)
+        del block_lines[:]
 
-    for line in f:
+    for line in lines:
         if not line.strip(): continue
         if line.startswith('$$'): continue
 
         ## Lines beginning with '##' are header lines.
         if line.startswith('##'):
-            line = line.strip('##')
-            (lhs,rhs) = line.split('=', 1)
-            lhs = lhs.strip().lower()
-            rhs = rhs.strip()
-            continuation = rhs.endswith('=')
-
-            if rhs.isdigit():
-                jcamp_dict[lhs] = int(rhs)
-            elif is_float(rhs):
-                jcamp_dict[lhs] = float(rhs)
-            else:
-                jcamp_dict[lhs] = rhs
+            (lhs,rhs) = parse_header_line(line, jcamp_dict)
 
             if (lhs in ('xydata','xypoints','peak table')):
+                flush_block()
                 datastart = True
                 datatype = rhs
-                continue        ## data starts on next line
+                block_mode = data_block_mode(datatype, jcamp_dict)
             elif (lhs == 'end'):
+                flush_block()
                 datastart = False
+            ## A header line is never a data line, even inside a data block.
+            continue
+
+        ## If the line does not start with '##' or '$$' then it should be a data line.
+        if datastart and (block_mode is not None):
+            block_lines.append(line)
+    flush_block()
+
+    return(JCAMP_data_arrays(jcamp_dict, xstart, xnum, y, ycheck, x))
+
+def parse_header_line(line, jcamp_dict):
+    '''
+    Store the value of a `##LABEL=value` header line in `jcamp_dict`, under the lowercase label, as an int or a
+    float if it is one. Returns the label and the value as strings.
+    '''
+    line = line.strip('##')
+    (lhs,rhs) = line.split('=', 1)
+    lhs = lhs.strip().lower()
+    rhs = rhs.strip()
+
+    if rhs.isdigit():
+        jcamp_dict[lhs] = int(rhs)
+    elif is_float(rhs):
+        jcamp_dict[lhs] = float(rhs)
+    else:
+        jcamp_dict[lhs] = rhs
+    return(lhs, rhs)
 
-        if datastart and (datatype == '(X++(Y..Y))'):
-            ## If the line does not start with '##' or '$$' then it should be a data line.
-            ## The pair of lines below involve regex splitting on floating point numbers and integers. We can't just
-            ## split on spaces because JCAMP allows minus signs to replace spaces in the case of negative numbers.
-            new = re.split(jcamp_numbers_pattern, line.strip())
-            new = [n for n in new if n != '' and n is not None]
-            datavals = [n for n in new if n.strip() != '']
-
-            if not all(is_float(datavals)): continue
-            xstart.append(float(datavals[0]))
-            xnum.append(len(datavals)-1)
-            for dataval in datavals[1:]:
-                y.append(float(dataval))
-        elif datastart and (('xypoints' in jcamp_dict) or ('xydata' in jcamp_dict)) and (datatype == '(XY..XY)'):
-            datavals = [v.strip() for v in line.split(',')]     ## split at commas and remove whitespace
-            if not all(is_float(datavals)): continue
-            datavals = array(datavals)
-            x.extend(datavals[0::2])        ## every other data point starting at the zeroth
-            y.extend(datavals[1::2])        ## every other data point starting at the first
-        elif datastart and ('peak table' in jcamp_dict) and (datatype == '(XY..XY)'):
-            line = line.replace(',',' ')
-            datavals = [v.strip() for v in line.split(' ') if v]  ## be careful not to allow empty strings
-            #datavals = values_pattern.split(line)
-            #datavals = [v for v]
-            #print('datavals=', datavals)
-            if not all(is_float(datavals)): continue
-            datavals = array(datavals)
-            x.extend(datavals[0::2])        ## every other data point starting at the zeroth
-            y.extend(datavals[1::2])        ## every other data point starting at the first
+def JCAMP_data_arrays(jcamp_dict, xstart, xnum, y, ycheck, x):
+    '''
+    Join the arrays parsed from the data blocks of a file into its `x` and `y` vectors, generating the x values
+    of (X++(Y..Y)) data and applying the x and y factors, and add them to `jcamp_dict`.
 
+    Parameters
+    ----------
+    jcamp_dict : dict
+        The header values of the file.
+    xstart, xnum, y, ycheck : list of ndarray
+        One array per data block, as returned by `parse_xyy_block()` (`ycheck` and `xnum` are only given for
+        (X++(Y..Y)) blocks).
+    x : list of ndarray
+        One array of x values per (XY..XY) data block.
+
+    Returns
+    -------
+    jcamp_dict : dict
+        The same dictionary, with its `x` and `y` vectors.
+    '''
     if ('xydata' in jcamp_dict) and (jcamp_dict['xydata'] == '(X++(Y..Y))'):
         ## You got all of the Y-values. Next you need to figure out how to generate the missing X's...
         ## First look for the "lastx" dictionary entry. You will need that one to finish the set.
-        xstart.append(jcamp_dict['lastx'])
-        x = array([])
-        for n in range(len(xnum)):
-            x = append(x, linspace(xstart[n],xstart[n+1],xnum[n]))
-        y = array(y)
+        xstart = concatenate(xstart + [array([jcamp_dict['lastx']], dtype=float64)])
+        xnum = concatenate(xnum) if xnum else array([], dtype=intp)
+        x = linspace_lines(xstart, xnum)
+        y = concatenate(y) if y else array([])
+        ## ASDF Y-check values repeat the previous line's last point, so they are only needed to place the x values.
+        keep = ~concatenate(ycheck) if ycheck else ones(0, dtype=bool)
+        if (keep.size == y.size) and not keep.all():
+            x = x[keep]
+            y = y[keep]
     else:
-        x = array([float(xval) for xval in x])
-        y = array([float(yval) for yval in y])
+        x = concatenate(x) if x else array([])
+        y = concatenate(y) if y else array([])
 
     ## The "xfactor" and "yfactor" variables contain any scaling information that may need to be applied
-    ## to the data. Go ahead and apply them.
-    if ('xfactor' in jcamp_dict): x = x * jcamp_dict['xfactor']
-    if ('yfactor' in jcamp_dict): y = y * jcamp_dict['yfactor']
+    ## to the data. Go ahead and apply them (in place: `x` and `y` are new arrays built above).
+    if ('xfactor' in jcamp_dict): x *= jcamp_dict['xfactor']
+    if ('yfactor' in jcamp_dict): y *= jcamp_dict['yfactor']
     jcamp_dict['x'] = x
     jcamp_dict['y'] = y
 
     return(jcamp_dict)
 
+##=====================================================================================================
+## A `##TITLE=` or `##END=` label at the start of a line. Labels are case-insensitive and may contain spaces.
+BLOCK_LABEL_PATTERN = re.compile(rb'^[ \t]*##[ \t]*(TITLE|END)[ \t]*=([^\r\n]*)', re.MULTILINE | re.IGNORECASE)
+
+def JCAMP_index_blocks(filename):
+    '''
+    Find the byte range of every block of a JCAMP-DX file, without parsing any of them.
+
+    Parameters
+    ----------
+    filename : str
+        The JCAMP-DX filename to index.
+
+    Returns
+    -------
+    index : list of tuple
+        One `(offset, length, header_length, title, depth, parent)` tuple per block, in file order. A block runs
+        from its `##TITLE=` line to the end of its `##END=` line. `header_length` is the number of bytes before
+        the block's first nested block (equal to `length` if it has none), `depth` is the nesting level (0 for
+        top-level blocks) and `parent` is the position in `index` of the enclosing LINK block, or None.
+
+    The file is memory-mapped and searched for `##TITLE=` and `##END=` labels, so that indexing a large library
+    file does not read it line by line. A block without an `##END=` runs to the end of the file, and a file
+    without any `##TITLE=` is a single block.
+    '''
+    with open(filename, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:          ## empty file
+            return([])
+        try:
+            index = []
+            open_blocks = []        ## positions in `index` of the blocks not yet closed, innermost last
+            for match in BLOCK_LABEL_PATTERN.finditer(data):
+                if (match.group(1).upper() == b'TITLE'):
+                    parent = open_blocks[-1] if open_blocks else None
+                    if (parent is not None) and (index[parent][2] is None):
+                        index[parent][2] = match.start() - index[parent][0]
+                    title = match.group(2).strip().decode('utf-8', errors='replace')
+                    index.append([match.start(), None, None, title, len(open_blocks), parent])
+                    open_blocks.append(len(index) - 1)
+                elif open_blocks:
+                    ## The block ends after the newline of its `##END=` line.
+                    end = data.find(b'\n', match.end())
+                    end = data.size() if (end < 0) else end + 1
+                    n = open_blocks.pop()
+                    index[n][1] = end - index[n][0]
+            size = data.size()
+        finally:
+            data.close()
+
+    if not index:
+        return([(0, size, size, '', 0, None)])
+    for entry in index:
+        if entry[1] is None: entry[1] = size - entry[0]
+        if entry[2] is None: entry[2] = entry[1]
+    return([tuple(entry) for entry in index])
+
+##=====================================================================================================
+class JCAMPBlock(object):
+    '''
+    One block of a JCAMP-DX file. Only its place in the file is kept: the block is read and parsed when
+    `jcamp_dict` is first used.
+
+    Attributes
+    ----------
+    filename : str
+        The file holding the block.
+    offset, length : int
+        The byte range of the block in the file.
+    header_length : int
+        The number of bytes of the block before its first nested block.
+    title : str
+        The block's `##TITLE=`.
+    depth : int
+        The nesting level of the block, 0 for top-level blocks.
+    parent : int or None
+        The position in `JCAMP_index_blocks()` of the enclosing LINK block.
+    is_link : bool
+        True for a LINK block, which holds other blocks rather than data.
+    '''
+    def __init__(self, filename, offset, length, header_length, title, depth, parent):
+        self.filename = filename
+        self.offset = offset
+        self.length = length
+        self.header_length = header_length
+        self.title = title
+        self.depth = depth
+        self.parent = parent
+        self.is_link = (header_length < length)
+        self._jcamp_dict = None
+
+    def __repr__(self):
+        return('JCAMPBlock(' + repr(self.filename) + ', title=' + repr(self.title) + ', offset=' + str(self.offset) + ')')
+
+    def read_lines(self):
+        '''
+        Read the block's own lines from the file. The lines of a LINK block stop at its first nested block.
+        '''
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            raw = f.read(self.header_length)
+        ## Decode the same way `open(filename, 'r')` does, so that a block parses exactly as a file would.
+        return(io.TextIOWrapper(io.BytesIO(raw)).readlines())
+
+    def read_header(self):
+        '''
+        Parse only the header lines of the block, stopping at its first data label. The returned dictionary
+        has no `x` and `y` entries.
+        '''
+        header = []
+        for line in self.read_lines():
+            if line.startswith('##') and (line.strip('#').split('=', 1)[0].strip().lower() in ('xydata','xypoints','peak table')):
+                break
+            header.append(line)
+        jcamp_dict = JCAMP_parse(header)
+        del jcamp_dict['x'], jcamp_dict['y']
+        return(jcamp_dict)
+
+    @property
+    def jcamp_dict(self):
+        '''
+        The block parsed by `JCAMP_parse()`, read from the file on first use.
+        '''
+        if (self._jcamp_dict is None):
+            self._jcamp_dict = JCAMP_parse(self.read_lines())
+        return(self._jcamp_dict)
+
+    @property
+    def x(self):
+        return(self.jcamp_dict['x'])
+
+    @property
+    def y(self):
+        return(self.jcamp_dict['y'])
+
+class JCAMPBlockList(object):
+    '''
+    A read-only sequence of the blocks of a JCAMP-DX file, as returned by `JCAMP_blocks()`. Indexing or iterating
+    creates a new `JCAMPBlock` each time, so blocks that are no longer referenced are freed together with their
+    data.
+    '''
+    def __init__(self, filename, index):
+        self.filename = filename
+        self.index = index
+
+    def __len__(self):
+        return(len(self.index))
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return(JCAMPBlockList(self.filename, self.index[n]))
+        return(JCAMPBlock(self.filename, *self.index[n]))
+
+    def __iter__(self):
+        for entry in self.index:
+            yield JCAMPBlock(self.filename, *entry)
+
+    def titles(self):
+        '''
+        Return the titles of all the blocks, without reading any of them.
+        '''
+        return([entry[3] for entry in self.index])
+
+def JCAMP_blocks(filename, include_links=False):
+    '''
+    Index the blocks of a JCAMP-DX file and return them as a lazy sequence of `JCAMPBlock` objects.
+
+    Parameters
+    ----------
+    filename : str
+        The JCAMP-DX filename to read.
+    include_links : bool
+        If False, LINK blocks (which hold other blocks rather than data) are left out, so that every item is a
+        spectrum.
+
+    Returns
+    -------
+    blocks : JCAMPBlockList
+        The blocks in file order. Each block is read from the file and parsed only when its data is used.
+
+    Example
+    -------
+    >>> for block in JCAMP_blocks('run.jdx'):
+    ...     print(block.title, block.y.max())
+    '''
+    index = JCAMP_index_blocks(filename)
+    if not include_links:
+        index = [entry for entry in index if (entry[2] == entry[1])]
+    return(JCAMPBlockList(filename, index))
+
+##=====================================================================================================
+## A valid line of an (X++(Y..Y)) block: numbers separated by whitespace, or by nothing at all in front of a
+## sign, since JCAMP allows minus signs to replace spaces in the case of negative numbers.
+JCAMP_NUMBER = r'[+-]?\d+(?:\.\d*)?'
+XYY_BLOCK_PATTERN = re.compile(r'(?:[^\S\n]*' + JCAMP_NUMBER + r'(?:(?:[^\S\n]+|(?=[+-]))' + JCAMP_NUMBER + r')*[^\S\n]*\n)*', re.ASCII)
+IS_WHITESPACE_BYTE = zeros(256, dtype=bool)
+IS_WHITESPACE_BYTE[frombuffer(b' \t\n\r\x0b\x0c', dtype=uint8)] = True
+
+## ASDF compressed data: a pseudo-digit replaces the sign and first digit of a number and gives its form. SQZ
+## numbers are absolute values, DIF numbers are differences from the previous ordinate, and DUP numbers are the
+## number of times the previous value (or difference) occurs.
+(ASDF_ABS, ASDF_DIF, ASDF_DUP, ASDF_EOL, ASDF_JUNK) = (0, 1, 2, 3, 4)
+ASDF_PSEUDO_DIGITS = {}
+for (n,c) in enumerate('@ABCDEFGHI'): ASDF_PSEUDO_DIGITS[c] = (ASDF_ABS, str(n))
+for (n,c) in enumerate('abcdefghi'): ASDF_PSEUDO_DIGITS[c] = (ASDF_ABS, '-' + str(n+1))
+for (n,c) in enumerate('%JKLMNOPQR'): ASDF_PSEUDO_DIGITS[c] = (ASDF_DIF, str(n))
+for (n,c) in enumerate('jklmnopqr'): ASDF_PSEUDO_DIGITS[c] = (ASDF_DIF, '-' + str(n+1))
+for (n,c) in enumerate('STUVWXYZs'): ASDF_PSEUDO_DIGITS[c] = (ASDF_DUP, str(n+1))
+ASDF_CHARACTER_PATTERN = re.compile(r'[@A-Za-s%]')
+## An AFFN number may carry an exponent, which starts with the letters used for the SQZ pseudo-digits +5 and -5.
+## An 'E' or 'e' right after a number is read as an exponent when a sign follows it. When a digit follows it, it
+## is only read as an exponent in blocks that hold no other ASDF characters, since '500E23' is an x value followed
+## by the SQZ ordinate 523 in ASDF data.
+AFFN_EXPONENT_PATTERN = re.compile(r'(?<=[\d.])[Ee][+-]?\d')
+def asdf_token_pattern(exponent):
+    return(re.compile(r'[ \t,]*(?:([+-]?(?:\d+\.?\d*|\.\d+)(?:' + exponent + r')?)|([@A-Ia-i%J-Rj-rS-Zs])(\d*\.?\d*)|(\n)|(\S))', re.ASCII))
+ASDF_TOKEN_PATTERN = asdf_token_pattern(r'[Ee][+-]\d+')
+AFFN_TOKEN_PATTERN = asdf_token_pattern(r'[Ee][+-]?\d+')
+
+def data_block_mode(datatype, jcamp_dict):
+    '''
+    Decide how the lines of a data block are parsed: 'xyy' for (X++(Y..Y)) lines, 'xy_comma' for (XY..XY)
+    XYDATA/XYPOINTS lines, 'xy_space' for (XY..XY) PEAK TABLE lines, or None if the block is skipped.
+    '''
+    if (datatype == '(X++(Y..Y))'):
+        return('xyy')
+    elif (('xypoints' in jcamp_dict) or ('xydata' in jcamp_dict)) and (datatype == '(XY..XY)'):
+        return('xy_comma')
+    elif ('peak table' in jcamp_dict) and (datatype == '(XY..XY)'):
+        return('xy_space')
+    return(None)
+
+def parse_xyy_block(lines):
+    '''
+    Parse the lines of an (X++(Y..Y)) data block in bulk.
+
+    Parameters
+    ----------
+    lines : list of str
+        The data lines of the block (non-empty, not starting with '##' or '$$').
+
+    Returns
+    -------
+    xstart : ndarray
+        The x value at the start of each valid line.
+    xnum : ndarray
+        The number of y values on each valid line.
+    y : ndarray
+        All of the y values, in order.
+    ycheck : ndarray of bool
+        True for the values of `y` that are ASDF Y-check values. They take part in placing the x values but are
+        removed afterwards.
+
+    Blocks in ASDF compressed form (SQZ, DIF and DUP pseudo-digits) are decoded by `parse_asdf_block()`. In other
+    blocks, lines containing anything other than plain (AFFN) numbers are skipped.
+    '''
+    text = ''.join(lines)
+    if not text.endswith('\n'): text += '\n'
+    if (XYY_BLOCK_PATTERN.fullmatch(text) is None):
+        if ASDF_CHARACTER_PATTERN.search(text):
+            return(parse_asdf_block(text))
+        (xstart, xnum, y) = parse_xyy_lines(lines)
+        return(xstart, xnum, y, zeros(y.size, dtype=bool))
+
+    ## Put a space in front of every sign (in a valid block a sign only ever starts a number), and then let numpy
+    ## parse the whole block at once.
+    text = text.replace('-', ' -').replace('+', ' +')
+    values = fromstring(text, dtype=float64, sep=' ')
+
+    ## Count the numbers on each line: a number starts wherever a non-space byte follows a space byte.
+    raw = frombuffer(text.encode('ascii'), dtype=uint8)
+    is_space = IS_WHITESPACE_BYTE[raw]
+    starts = ~is_space
+    starts[1:] &= is_space[:-1]
+    line_number = cumsum(raw == ord('\n')) - (raw == ord('\n'))
+    counts = bincount(line_number[starts], minlength=len(lines))
+    assert (counts.sum() == values.size)
+
+    first = cumsum(counts) - counts         ## index of each line's x value within `values`
+    is_y = ones(values.size, dtype=bool)
+    is_y[first] = False
+    return(values[first], counts - 1, values[is_y], zeros(values.size - first.size, dtype=bool))
+
+## The bytes that can appear in a chunk of plain (AFFN) (X++(Y..Y)) lines.
+IS_AFFN_BYTE = IS_WHITESPACE_BYTE.copy()
+IS_AFFN_BYTE[frombuffer(b'0123456789.+-', dtype=uint8)] = True
+
+def is_affn_chunk(raw):
+    '''
+    Test, without a regex, whether a chunk of data lines (as a uint8 array) holds only plain numbers in the form
+    matched by `XYY_BLOCK_PATTERN`, with blank lines allowed: a sign must be followed by a digit, and a decimal
+    point must follow a digit and be the only one of its number.
+    '''
+    if not IS_AFFN_BYTE[raw].all():
+        return(False)
+    is_digit = (raw >= ord('0')) & (raw <= ord('9'))
+    signs = flatnonzero((raw == ord('+')) | (raw == ord('-')))
+    if (signs.size > 0) and ((signs[-1] + 1 == raw.size) or not is_digit[signs + 1].all()):
+        return(False)
+    points = flatnonzero(raw == ord('.'))
+    if (points.size > 0) and ((points[0] == 0) or not is_digit[points - 1].all()):
+        return(False)
+    ## Two decimal points belong to the same number unless a space or a sign comes between them.
+    separators = flatnonzero(~is_digit & (raw != ord('.')))
+    between = searchsorted(separators, points)
+    return(not (between[1:] == between[:-1]).any())
+
+def parse_xyy_chunk(chunk):
+    '''
+    Parse a chunk of (X++(Y..Y)) data lines in plain (AFFN) form, given as bytes.
+
+    Parameters
+    ----------
+    chunk : bytes
+        Whole data lines, each ending in a newline. Blank lines are ignored.
+
+    Returns
+    -------
+    xstart, xnum, y : ndarray
+        As for `parse_xyy_block()`, or None if the chunk holds anything but plain numbers.
+    '''
+    if not is_affn_chunk(frombuffer(chunk, dtype=uint8)):
+        return(None)
+
+    ## As in `parse_xyy_block()`: a space in front of every sign, and numpy parses the whole chunk at once.
+    chunk = chunk.replace(b'-', b' -').replace(b'+', b' +')
+    raw = frombuffer(chunk, dtype=uint8)
+    is_space = IS_WHITESPACE_BYTE[raw]
+    starts = ~is_space
+    starts[1:] &= is_space[:-1]
+    is_newline = (raw == ord('\n'))
+    counts = bincount((cumsum(is_newline) - is_newline)[starts], minlength=int(is_newline.sum()))
+    counts = counts[counts > 0]             ## blank lines
+    if (counts.size == 0):
+        return(array([]), array([], dtype=intp), array([]))
+
+    values = fromstring(chunk, dtype=float64, sep=' ')
+    assert (counts.sum() == values.size)
+
+    first = cumsum(counts) - counts
+    is_y = ones(values.size, dtype=bool)
+    is_y[first] = False
+    return(values[first], counts - 1, values[is_y])
+
+def parse_xyy_ranges(data, ranges, chunk_size=MMAP_CHUNK_SIZE):
+    '''
+    Parse the data lines of an (X++(Y..Y)) block from byte ranges of a memory-mapped file, `chunk_size` bytes
+    of whole lines at a time.
+
+    Returns
+    -------
+    xstart, xnum, y, ycheck : ndarray
+        As for `parse_xyy_block()`, or None if the block is not in plain (AFFN) form.
+    '''
+    (xstart, xnum, y) = ([], [], [])
+    for (start,stop) in ranges:
+        while (start < stop):
+            end = min(start + chunk_size, stop)
+            if (end < stop):
+                end = data.rfind(b'\n', start, end) + 1
+                if (end <= start): end = data.find(b'\n', start + chunk_size, stop) + 1 or stop
+            chunk = data[start:end]
+            if not chunk.endswith(b'\n'): chunk += b'\n'
+            parsed = parse_xyy_chunk(chunk)
+            if (parsed is None):
+                return(None)
+            xstart.append(parsed[0])
+            xnum.append(parsed[1])
+            y.append(parsed[2])
+            start = end
+    if not xstart:
+        return(array([]), array([], dtype=intp), array([]), zeros(0, dtype=bool))
+    y = concatenate(y)
+    return(concatenate(xstart), concatenate(xnum), y, zeros(y.size, dtype=bool))
+
+def parse_asdf_block(text):
+    '''
+    Decode an (X++(Y..Y)) data block written in ASDF compressed form.
+
+    Parameters
+    ----------
+    text : str
+        The data lines of the block, each ending in a newline. AFFN, SQZ, DIF and DUP values may be mixed.
+
+    Returns
+    -------
+    xstart, xnum, y, ycheck : ndarray
+        As for `parse_xyy_block()`.
+
+    When a line ends in DIF form, the first ordinate of the next line repeats the last ordinate of that line as a
+    check value. It is compared with the decoded value and a ValueError is raised if they differ. The check value
+    is flagged in `ycheck` rather than dropped here, since the line's x value is its abscissa. Lines holding
+    characters that are neither ASDF nor AFFN values are skipped.
+    '''
+    ## Tokenize the block in a single regex pass. Every token becomes a kind and a numeric string.
+    if ASDF_CHARACTER_PATTERN.search(AFFN_EXPONENT_PATTERN.sub('', text)):
+        tokens = ASDF_TOKEN_PATTERN.findall(text)
+    else:
+        tokens = AFFN_TOKEN_PATTERN.findall(text)
+    kind = array([ASDF_PSEUDO_DIGITS[p][0] if p else (ASDF_ABS if a else (ASDF_EOL if e else ASDF_JUNK)) for (a,p,d,e,j) in tokens], dtype=int8)
+    value = array([ASDF_PSEUDO_DIGITS[p][1] + d if p else (a or '0') for (a,p,d,e,j) in tokens], dtype=float64)
+
+    ## Drop bad lines: lines with junk, and lines that do not start with an absolute x value.
+    is_eol = (kind == ASDF_EOL)
+    line = cumsum(is_eol) - is_eol
+    keep = ~is_eol & ~isin(line, line[kind == ASDF_JUNK])
+    (kind, value, line) = (kind[keep], value[keep], line[keep])
+    is_first = ones(kind.size, dtype=bool)
+    is_first[1:] = (line[1:] != line[:-1])
+    keep = ~isin(line, line[is_first & (kind != ASDF_ABS)])
+    (kind, value, line, is_first) = (kind[keep], value[keep], line[keep], is_first[keep])
+
+    ## Expand DUP counts: the token in front of a DUP token occurs `count` times in total.
+    is_dup = (kind == ASDF_DUP)
+    if is_dup.any():
+        dup = flatnonzero(is_dup)
+        if (is_dup[dup - 1] | is_first[dup - 1]).any():
+            raise ValueError('ASDF data has a DUP count that does not follow an ordinate')
+        counts = ones(kind.size, dtype=intp)
+        counts[dup - 1] = value[dup].astype(intp)
+        counts[dup] = 0
+        (kind, value, line, is_first) = (repeat(kind, counts), repeat(value, counts), repeat(line, counts), repeat(is_first, counts))
+        is_first[1:] &= (line[1:] != line[:-1])
+
+    ## The first value of each line is its x value. Turn the DIF ordinates into absolute values: a running sum of
+    ## the differences, offset by the last absolute ordinate before them.
+    xstart = value[is_first]
+    (ykind, yvalue, yline) = (kind[~is_first], value[~is_first], line[~is_first])
+    is_abs = (ykind == ASDF_ABS)
+    if (yvalue.size > 0) and not is_abs[0]:
+        raise ValueError('ASDF data starts with a DIF ordinate, which has no previous ordinate to add to')
+    difsum = cumsum(where(is_abs, 0.0, yvalue))
+    last_abs = maximum.accumulate(where(is_abs, arange(yvalue.size), 0))
+    y = yvalue[last_abs] + (difsum - difsum[last_abs])
+
+    ## Y-value checks: the first ordinate of each line that follows a line ending in DIF form.
+    xnum = bincount(yline, minlength=line.max()+1 if line.size else 0)[line[is_first]]
+    with_y = flatnonzero(xnum > 0)
+    first_y = (cumsum(xnum) - xnum)[with_y]
+    last_y = (cumsum(xnum) - 1)[with_y]
+    checked = (ykind[last_y[:-1]] == ASDF_DIF)
+    (expected, found) = (y[last_y[:-1]][checked], y[first_y[1:]][checked])
+    mismatch = ~isclose(expected, found, rtol=1.0E-9, atol=0.0)
+    if mismatch.any():
+        n = flatnonzero(mismatch)[0]
+        raise ValueError('ASDF Y-value check failed: a line repeats the ordinate ' + repr(float(found[n])) + ' but the previous line ends in ' + repr(float(expected[n])))
+    ycheck = zeros(y.size, dtype=bool)
+    ycheck[first_y[1:][checked]] = True
+
+    return(xstart, xnum, y, ycheck)
+
+def parse_xyy_lines(lines):
+    '''
+    Parse (X++(Y..Y)) data lines one at a time. This is the slow path of `parse_xyy_block()`, used for blocks
+    that contain lines which are not plain numbers.
+    '''
+    jcamp_numbers_pattern = re.compile(r'([+-]?\d+\.\d*)|([+-]?\d+)')
+    xstart = []
+    xnum = []
+    y = []
+    for line in lines:
+        ## The pair of lines below involve regex splitting on floating point numbers and integers. We can't just
+        ## split on spaces because JCAMP allows minus signs to replace spaces in the case of negative numbers.
+        new = re.split(jcamp_numbers_pattern, line.strip())
+        new = [n for n in new if n != '' and n is not None]
+        datavals = [n for n in new if n.strip() != '']
+
+        if not all(is_float(datavals)): continue
+        xstart.append(float(datavals[0]))
+        xnum.append(len(datavals)-1)
+        for dataval in datavals[1:]:
+            y.append(float(dataval))
+    return(array(xstart, dtype=float64), array(xnum, dtype=intp), array(y, dtype=float64))
+
+def parse_xy_block(lines, separator=','):
+    '''
+    Parse the lines of an (XY..XY) data block in bulk.
+
+    Parameters
+    ----------
+    lines : list of str
+        The data lines of the block.
+    separator : str
+        ',' if the values are separated by commas (XYDATA, XYPOINTS), or ' ' if they are separated by spaces
+        and commas (PEAK TABLE).
+
+    Returns
+    -------
+    x, y : ndarray
+        The x values (every other value of each line, starting at the first) and the y values.
+
+    Lines with any non-numeric value are skipped.
+    '''
+    if (separator == ','):
+        rows = [line.split(',') for line in lines]
+    else:
+        rows = [[v for v in line.replace(',',' ').split(' ') if v] for line in lines]
+
+    try:
+        ## numpy accepts exactly the strings float() accepts, surrounding whitespace included.
+        values = array([v for row in rows for v in row], dtype=float64)
+    except ValueError:
+        return(parse_xy_lines(rows))
+
+    counts = array([len(row) for row in rows], dtype=intp)
+    position = arange(values.size) - repeat(cumsum(counts) - counts, counts)   ## position of each value on its line
+    is_x = (position % 2 == 0)
+    return(values[is_x], values[~is_x])
+
+def parse_xy_lines(rows):
+    '''
+    Parse (XY..XY) data lines, already split into values, one at a time. This is the slow path of
+    `parse_xy_block()`, used for blocks that contain non-numeric values.
+    '''
+    x = []
+    y = []
+    for row in rows:
+        datavals = [v.strip() for v in row]
+        if not all(is_float(datavals)): continue
+        x.extend(float(v) for v in datavals[0::2])      ## every other data point starting at the zeroth
+        y.extend(float(v) for v in datavals[1::2])      ## every other data point starting at the first
+    return(array(x, dtype=float64), array(y, dtype=float64))
+
+def linspace_lines(xstart, xnum, chunk_points=LINSPACE_CHUNK_POINTS):
+    '''
+    Generate the x values of an (X++(Y..Y)) data set: for each line n, `xnum[n]` values evenly spaced from
+    `xstart[n]` to `xstart[n+1]`. The result is bit-for-bit the same as concatenating
+    `linspace(xstart[n], xstart[n+1], xnum[n])` over all lines, without a Python loop per line. The lines are
+    processed in groups of about `chunk_points` values, so that the temporaries stay small next to the result.
+    '''
+    nlines = len(xnum)
+    if (nlines == 0): return(array([]))
+    ends = cumsum(xnum)
+    x = empty(ends[-1])
+    first = 0
+    while (first < nlines):
+        offset = ends[first] - xnum[first]
+        last_line = max(int(searchsorted(ends, offset + chunk_points, side='right')), first + 1)
+        linspace_chunk(xstart[first:last_line+1], xnum[first:last_line], x[offset:ends[last_line-1]])
+        first = last_line
+    return(x)
+
+##=====================================================================================================
+def linspace_chunk(xstart, xnum, out):
+    '''
+    Write the x values of the lines described by `xstart` and `xnum` into `out` (see `linspace_lines()`).
+    '''
+    nlines = len(xnum)
+    start = xstart[:-1]
+    delta = xstart[1:] - start
+    div = (xnum - 1).astype(float64)
+    with_step = div > 0
+    step = where(with_step, delta / where(with_step, div, 1.0), 0.0)
+
+    line = repeat(arange(nlines), xnum)
+    k = (arange(line.size) - repeat(cumsum(xnum) - xnum, xnum)).astype(float64)
+    ## `linspace()` multiplies by the step, unless the step is zero, in which case it scales by delta/div instead.
+    zero_step = with_step & (step == 0)
+    out[:] = where(zero_step[line], k / where(with_step, div, 1.0)[line] * delta[line], k * step[line]) + start[line]
+
+    ## The last value of each line is set exactly to the next line's start.
+    last = (cumsum(xnum) - 1)[with_step]
+    out[last] = xstart[1:][with_step]
+    return
+
 ##=====================================================================================================
 def JCAMP_calc_xsec(jcamp_dict, wavemin=None, wavemax=None, skip_nonquant=True, debug=False):
     '''
@@ -230,11 +942,11 @@ def JCAMP_calc_xsec(jcamp_dict, wavemin=None, wavemax=None, skip_nonquant=True,
         ell = 0.1
         if debug: print('Path length variable not found. Using 0.1m as a default ...')
 
-    assert(alen(x) == alen(y))
+    assert(len(x) == len(y))
 
     if ('npoints' in jcamp_dict):
-        if (alen(x) != jcamp_dict['npoints']):
-            npts_retrieved = str(alen(x))
+        if (len(x) != jcamp_dict['npoints']):
+            npts_retrieved = str(len(x))
             msg = '"' + jcamp_dict['title'] + '": Number of data points retrieved (' + npts_retrieved + \
                   ') does not equal the expected length (npoints = ' + str(jcamp_dict['npoints']) + ')!'
             raise ValueError(msg)
@@ -271,6 +983,199 @@ def JCAMP_calc_xsec(jcamp_dict, wavemin=None, wavemax=None, skip_nonquant=True,
 
     return
 
+##=====================================================================================================
+## Lookup tables shared by the batched cross-section calculation. X units map to (kind, scale): the abscissa is
+## multiplied by `scale` and holds wavenumbers (kind 0) or wavelengths (kind 1). Y units map to the way the ordinate
+## is turned into absorbance, and path length units to how many of them make a meter.
+XSEC_XUNITS = {'1/cm':(0,1.0), 'cm-1':(0,1.0), 'cm^-1':(0,1.0),
+               'micrometers':(1,1.0), 'um':(1,1.0), 'wavelength (um)':(1,1.0),
+               'nanometers':(1,1000.0), 'nm':(1,1000.0), 'wavelength (nm)':(1,1000.0)}
+XSEC_YUNITS = {'transmittance':0, 'absorbance':1, '(micromol/mol)-1m-1 (base 10)':2}
+XSEC_PATH_LENGTH_UNITS = {'cm':100.0, 'm':1.0, 'mm':1000.0}
+XSEC_BASELINE_TITLES = ('propane','n_butane','butane')
+XSEC_CHUNK_POINTS = 16384       ## points converted per block of `JCAMP_calc_xsec_batch()`
+XSEC_T = 296.0                  ## the temperature (23 degC) used by NIST when collecting spectra
+XSEC_R = 1.0355E-25             ## the constant for converting data (includes the gas constant)
+
+def xsec_path_length(path_length):
+    (val,unit) = path_length.lower().split()[0:2]
+    if (unit in XSEC_PATH_LENGTH_UNITS):
+        return(float(val) / XSEC_PATH_LENGTH_UNITS[unit])
+    return(0.1)
+
+def xsec_partial_pressure(partial_pressure):
+    (val,unit) = partial_pressure.split()[0:2]
+    p = float(val)
+    if (unit.lower() == 'ppm'):
+        p = p * 759.8 * 1.0E-6
+    return(p)
+
+def xsec_convert_block(jcamp_dicts, block, pieces, ykind, xkind, xscale):
+    '''
+    Convert one block of `JCAMP_calc_xsec_batch()`: consecutive pieces of spectra with the same units, written one
+    after the other into the (4, n) `block` of the stacked buffer. Each piece is a (dictionary index, first point,
+    last point, p * ell) tuple.
+    '''
+    (wavelengths, wavenumbers, absorbance, xsec) = block
+    xs = [jcamp_dicts[n]['x'] if (first == 0) and (last == len(jcamp_dicts[n]['x'])) else jcamp_dicts[n]['x'][first:last] for (n,first,last,p_ell) in pieces]
+    ys = [jcamp_dicts[n]['y'] if (first == 0) and (last == len(jcamp_dicts[n]['y'])) else jcamp_dicts[n]['y'][first:last] for (n,first,last,p_ell) in pieces]
+
+    if (xkind == 0):
+        concatenate(xs, out=wavenumbers)
+        divide(10000.0, wavenumbers, out=wavelengths)
+    else:
+        concatenate(xs, out=wavelengths)
+        if (xscale != 1.0): multiply(wavelengths, xscale, out=wavelengths)
+        divide(10000.0, wavelengths, out=wavenumbers)
+
+    ## Copy `y`, correcting for any unphysical negative values.
+    if (len(ys) == 1):
+        maximum(ys[0], 0.0, out=absorbance)
+    else:
+        concatenate(ys, out=absorbance)
+        maximum(absorbance, 0.0, out=absorbance)
+    if (ykind == 0):
+        ## In transmittance, any y > 1.0 are unphysical. Convert to absorbance as `log10(1.0 / y)`.
+        minimum(absorbance, 1.0, out=absorbance)
+        divide(1.0, absorbance, out=absorbance)
+        array_log10(absorbance, out=absorbance)
+
+    ## Convert the absorbance units to cross-section in meters squared per molecule, as `y * (T * R / (p * ell))`.
+    if (len(pieces) == 1):
+        multiply(absorbance, XSEC_T * XSEC_R / pieces[0][3], out=xsec)
+    else:
+        multiply(absorbance, repeat([XSEC_T * XSEC_R / p_ell for (n,first,last,p_ell) in pieces], [last - first for (n,first,last,p_ell) in pieces]), out=xsec)
+    return
+
+def JCAMP_calc_xsec_batch(jcamp_dicts, skip_nonquant=True, debug=False, out=None):
+    '''
+    Convert many IR spectra to absorption cross-section at once, as `JCAMP_calc_xsec()` does for one spectrum.
+
+    The units, path length and partial pressure of all the spectra are resolved first, each distinct header
+    string being parsed only once. The abscissae, absorbances and cross-sections of all the spectra are then
+    computed in place in a single stacked buffer, a block of consecutive points at a time, with four passes over
+    the data rather than the six, and the full-size temporaries, of `JCAMP_calc_xsec()`. The time saved is the
+    per-spectrum overhead of many small spectra: for a few large spectra the two take about as long, as both are
+    bound by the arithmetic on every point. The cross-sections are computed as `y * (T * R / (p * ell))`, so they
+    can differ from those of `JCAMP_calc_xsec()` in the last bit.
+
+    Parameters
+    ----------
+    jcamp_dicts : list of dict
+        The JCAMP spectrum dictionaries, e.g. from `JCAMP_reader()`.
+    skip_nonquant: bool
+        If True then leave out the spectra missing quantitative data (path length or partial pressure). If False,
+        then fill in the missing values with the defaults of `JCAMP_calc_xsec()` (0.1 m and 150 mmHg).
+    debug : bool
+        If True, print the defaults used for missing values.
+    out : ndarray, optional
+        A float64 array of shape (4, n), with n at least the total number of points, to compute into instead of a
+        new buffer. Reusing one buffer across the batches of a large library saves allocating it each time.
+
+    Returns
+    -------
+    stacked : ndarray
+        A (4, npoints) array holding, for all the converted spectra one after the other, their wavelengths (row 0),
+        wavenumbers (row 1), absorbances (row 2) and cross-sections (row 3).
+    slices : list of slice or None
+        For each input dictionary, the columns of `stacked` holding its spectrum, or None if it was skipped.
+
+    As with `JCAMP_calc_xsec()`, negative (and for transmittance, above 1.0) values of `y` are clipped to 0.0
+    (1.0), but in the stacked copy, so that `x` and `y` are left unchanged. The "wavelengths", "wavenumbers",
+    "xsec" and (for transmittance spectra) "absorbance" entries are added to each converted dictionary, as views
+    into `stacked`. Skipped dictionaries are left untouched.
+    '''
+    ## Resolve the header of every spectrum into (y kind, x kind, x scale, p * ell, number of points).
+    path_lengths = {}
+    partial_pressures = {}
+    selected = []
+    for n,jcamp_dict in enumerate(jcamp_dicts):
+        xunits = jcamp_dict['xunits'].lower()
+        if (xunits not in XSEC_XUNITS):
+            raise ValueError('Don\'t know how to convert the spectrum\'s x units ("' + jcamp_dict['xunits'] + '") to micrometers.')
+        yunits = jcamp_dict['yunits'].lower()
+        if (yunits not in XSEC_YUNITS):
+            raise ValueError('Don\'t know how to convert the spectrum\'s y units ("' + jcamp_dict['yunits'] + '") to absorbance.')
+
+        if ('path length' in jcamp_dict):
+            if (jcamp_dict['path length'] not in path_lengths):
+                path_lengths[jcamp_dict['path length']] = xsec_path_length(jcamp_dict['path length'])
+            ell = path_lengths[jcamp_dict['path length']]
+        else:
+            if skip_nonquant: continue
+            ell = 0.1
+            if debug: print('Path length variable not found. Using 0.1m as a default ...')
+
+        npts = len(jcamp_dict['x'])
+        if (len(jcamp_dict['y']) != npts):
+            raise ValueError('"' + jcamp_dict['title'] + '": The numbers of x values (' + str(npts) + ') and y values (' + str(len(jcamp_dict['y'])) + ') differ!')
+        if ('npoints' in jcamp_dict) and (npts != jcamp_dict['npoints']):
+            msg = '"' + jcamp_dict['title'] + '": Number of data points retrieved (' + str(npts) + \
+                  ') does not equal the expected length (npoints = ' + str(jcamp_dict['npoints']) + ')!'
+            raise ValueError(msg)
+
+        if ('partial_pressure' in jcamp_dict):
+            if (jcamp_dict['partial_pressure'] not in partial_pressures):
+                partial_pressures[jcamp_dict['partial_pressure']] = xsec_partial_pressure(jcamp_dict['partial_pressure'])
+            p = partial_pressures[jcamp_dict['partial_pressure']]
+        else:
+            if skip_nonquant: continue
+            p = 150.0
+            if debug: print('Partial pressure variable not found. Using 150mmHg as a default ...')
+
+        (xkind,xscale) = XSEC_XUNITS[xunits]
+        selected.append((XSEC_YUNITS[yunits], xkind, xscale, n, p * ell, npts))
+
+    ## Spectra with the same units are stacked next to each other, and converted in blocks of XSEC_CHUNK_POINTS
+    ## consecutive points with one call per step and block. A block is kept small enough to stay in the processor
+    ## cache from the copy of `x` and `y` to the cross-section. It can hold the end of one spectrum and the start of
+    ## the next ones, so that the number of numpy calls follows the number of points rather than of spectra.
+    selected.sort(key=lambda entry: entry[0:4])
+    npts_total = sum(entry[5] for entry in selected)
+    if out is None:
+        stacked = empty((4, npts_total))
+    elif (out.ndim != 2) or (out.shape[0] != 4) or (out.shape[1] < npts_total) or (out.dtype != float64):
+        raise ValueError('"out" must be a float64 array of shape (4, n) with n >= ' + str(npts_total) + ', not ' + str(out.dtype) + ' ' + str(out.shape) + '.')
+    else:
+        stacked = out[:, :npts_total]
+    (wavelengths, wavenumbers, absorbance, xsec) = stacked
+    slices = [None] * len(jcamp_dicts)
+    start = 0
+    pieces = []          ## the (dictionary index, first point, last point, p * ell) pieces of the spectra in the current block
+    block_start = 0
+    for (k,(ykind,xkind,xscale,n,p_ell,npts)) in enumerate(selected):
+        slices[n] = slice(start, start + npts)
+        first = 0
+        while (first < npts):
+            last = min(npts, first + XSEC_CHUNK_POINTS - (start + first - block_start))
+            pieces.append((n, first, last, p_ell))
+            first = last
+            if (start + first - block_start == XSEC_CHUNK_POINTS):
+                xsec_convert_block(jcamp_dicts, stacked[:, block_start:start + first], pieces, ykind, xkind, xscale)
+                (pieces, block_start) = ([], start + first)
+        start = start + npts
+        if pieces and ((k + 1 == len(selected)) or (selected[k+1][0:3] != (ykind,xkind,xscale))):
+            xsec_convert_block(jcamp_dicts, stacked[:, block_start:start], pieces, ykind, xkind, xscale)
+            pieces = []
+        if not pieces:
+            block_start = start
+
+    for (ykind,xkind,xscale,n,p_ell,npts) in selected:
+        jcamp_dict = jcamp_dicts[n]
+        if (jcamp_dict['title'].lower() in XSEC_BASELINE_TITLES):
+            okay = logical_and(wavelengths[slices[n]] >= 8.0, wavelengths[slices[n]] <= 12.0)
+            xsec[slices[n]] -= amin(xsec[slices[n]][okay])
+
+        jcamp_dict['wavelengths'] = wavelengths[slices[n]]
+        jcamp_dict['wavenumbers'] = wavenumbers[slices[n]]
+        if (ykind == 0):
+            jcamp_dict['absorbance'] = absorbance[slices[n]]
+        elif (ykind == 2):
+            jcamp_dict['yunits'] = 'xsec (m^2))'
+        jcamp_dict['xsec'] = xsec[slices[n]]
+
+    return(stacked, slices)
+
 ##=====================================================================================================
 def is_float(s):
     '''
@@ -340,7 +1245,7 @@ if __name__ == "__main__":
     filename = './mass_spectra/ethanol_ms.jdx'
     jcamp_dict = JCAMP_reader(filename)
     plt.figure()
-    for n in arange(alen(jcamp_dict['x'])):
+    for n in arange(len(jcamp_dict['x'])):
         plt.plot((jcamp_dict['x'][n],jcamp_dict['x'][n]), (0.0, jcamp_dict['y'][n]), 'm-', linewidth=2.0)
     plt.title(filename)
     plt.xlabel(jcamp_dict['xunits'])
@@ -0,0 +1,417 @@
+"""
+JDXBenchmarks.py measures the speed of the converter: reading JDX files (JCampSG.JCAMP_reader and the memory-mapped JCAMP_mmap_reader), binning them
+(createArray, combineArray), converting IR spectra to cross-sections (JCampSG.JCAMP_calc_xsec_batch) and onto a
+common grid (SpectraResampling), converting a directory on a process pool, exporting (exportToCSV), searching the
+converted library (SpectraSearch), converting a database into output files (convertMolecules, the streaming
+StreamingConversion and the asyncio AsyncConversion) and getting molecules from the NIST Webbook. The Webbook chain runs against
+WebbookStandIn, a local HTTP server serving pages built from the bundled JDX files, so no request leaves the machine.
+The synthetic generators scale the bundled JDXFiles and MoleculesInfo.csv up to any number of spectra (e.g. 100000)
+and write IR files of any number of points (e.g. 10**6).
+Run: python JDXBenchmarks.py --spectra 100000 --ir-points 1000000 --output results.json
+The results are written as JSON, with the git commit, Python and numpy versions, so that runs of different versions
+can be compared.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy
+
+import AsyncConversion
+import JCampSG
+import JDXConverter
+import NISTWebbook
+import SpectraResampling
+import SpectraSearch
+import StreamingConversion
+
+#The example files of the repository, used as templates by the generators and served by the stand-in
+bundledJDXDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'JDXFiles')
+bundledDatabaseFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MoleculesInfo.csv')
+
+def writeMassSpectrumJDX(filename, title, x, y, headers=None):
+    """
+    This function writes a mass spectrum as a JDX file with a ##PEAK TABLE, in the layout of the NIST Webbook files
+    INPUT: filename | title ( ##TITLE ) | x, y ( m/z values and intensities ) | headers ( optional dictionary of more header labels and values, e.g. {'MOLFORM': 'C2 H6 O', 'MW': 46} )
+    """
+    lines = [f'##TITLE={title}', '##JCAMP-DX=4.24', '##DATA TYPE=MASS SPECTRUM']
+    for label, value in (headers or {}).items():
+        lines.append(f'##{label}={value}')
+    lines.extend(['##XUNITS=M/Z', '##YUNITS=RELATIVE INTENSITY', '##XFACTOR=1', '##YFACTOR=1', f'##NPOINTS={len(x)}', '##PEAK TABLE=(XY..XY)'])
+    pairs = [f'{int(mz)},{int(intensity)}' for mz, intensity in zip(x, y)]
+    for start in range(0, len(pairs), 4):
+        lines.append(' '.join(pairs[start:start + 4]))
+    lines.append('##END=')
+    with open(filename, 'w') as JDXFile:
+        JDXFile.write('\n'.join(lines) + '\n')
+
+def generateMassSpectraLibrary(directory, numberOfSpectra, seed=0):
+    """
+    This function scales the bundled examples up to a library of any size: it writes numberOfSpectra JDX files, each a bundled spectrum with randomly scaled intensities, and a database file listing them in the layout of MoleculesInfo.csv
+    INPUT: directory ( directory to write, created if needed ) | numberOfSpectra | seed ( seed of the random intensities, the same seed gives the same files )
+    OUTPUT: JDXFilesList ( paths of the JDX files ) | databaseFileName ( path of the database file )
+    """
+    randomNumbers = numpy.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    templates = []
+    for databaseRow in JDXConverter.readFromLocalDatabaseFile(bundledDatabaseFileName)[1:]:
+        jcampDict = JCampSG.JCAMP_reader(os.path.join(bundledJDXDirectory, databaseRow[3]))
+        templates.append((databaseRow, jcampDict['x'], jcampDict['y'], jcampDict.get('molform', ''), jcampDict.get('cas registry no', '')))
+
+    JDXFilesList = []
+    databaseLines = ['Molecule Name;Electrons;Mass;File Name;knownMoleculeIonizationType;knownIonizationFactorRelativeToN2;SourceOfFragmentationPattern;SourceOfIonizationInformation']
+    for spectrumNumber in range(numberOfSpectra):
+        databaseRow, x, y, formula, casNumber = templates[spectrumNumber % len(templates)]
+        moleculeName = f'synthetic{spectrumNumber}'
+        scaledY = numpy.maximum(1, numpy.round(y * randomNumbers.uniform(0.5, 1.5, size=len(y))))
+        JDXFileName = os.path.join(directory, moleculeName + '.jdx')
+        writeMassSpectrumJDX(JDXFileName, moleculeName, x, scaledY, {'CAS REGISTRY NO': casNumber, 'MOLFORM': formula, 'MW': databaseRow[2]})
+        JDXFilesList.append(JDXFileName)
+        databaseLines.append(';'.join([moleculeName, databaseRow[1], databaseRow[2], moleculeName + '.jdx'] + databaseRow[4:]))
+
+    databaseFileName = os.path.join(directory, 'MoleculesInfo.csv')
+    with open(databaseFileName, 'w') as databaseFile:
+        databaseFile.write('\n'.join(databaseLines) + '\n')
+    return JDXFilesList, databaseFileName
+
+def generateIRFile(filename, numberOfPoints=10**6, valuesPerLine=10, seed=0):
+    """
+    This function writes a synthetic IR spectrum in (X++(Y..Y)) form, the layout of large IR and UV files
+    INPUT: filename | numberOfPoints | valuesPerLine ( number of y values on each data line ) | seed ( seed of the random noise )
+    """
+    randomNumbers = numpy.random.default_rng(seed)
+    x = numpy.linspace(400.0, 4000.0, numberOfPoints)
+    y = numpy.round(5000 + 4000 * numpy.sin(x / 50.0) + randomNumbers.normal(0, 100, numberOfPoints)).astype(numpy.int64)
+    lines = ['##TITLE=synthetic IR spectrum', '##JCAMP-DX=4.24', '##DATA TYPE=INFRARED SPECTRUM', '##XUNITS=1/CM', '##YUNITS=ABSORBANCE',
+             '##XFACTOR=1.0', '##YFACTOR=0.0001', f'##FIRSTX={x[0]}', f'##LASTX={x[-1]}', f'##NPOINTS={numberOfPoints}', '##XYDATA=(X++(Y..Y))']
+    with open(filename, 'w') as IRFile:
+        IRFile.write('\n'.join(lines) + '\n')
+        for start in range(0, numberOfPoints, valuesPerLine):
+            IRFile.write(f'{x[start]:.6f} ' + ' '.join(map(str, y[start:start + valuesPerLine].tolist())) + '\n')
+        IRFile.write('##END=\n')
+
+class WebbookStandInHandler(BaseHTTPRequestHandler):
+    """
+    This class answers the requests of WebbookStandIn: molecule pages (?Name=), mass spectrum pages (?ID=) and JCAMP downloads (?JCAMP=)
+    """
+
+    protocol_version = 'HTTP/1.1'
+    #The headers and the body are written separately on keep-alive connections, so without TCP_NODELAY every response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def sendContent(self, content, contentType='text/html', status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        standIn = self.server.standIn
+        standIn.countRequest()
+        if standIn.latency:
+            time.sleep(standIn.latency)
+        query = parse_qs(urlsplit(self.path).query)
+        if 'Name' in query:
+            molecule = standIn.molecules.get(query['Name'][0].lower())
+            if molecule is None:
+                return self.sendContent(b'<html><body><h1>Name Not Found</h1></body></html>')
+            return self.sendContent(standIn.moleculePage(molecule).encode())
+        if 'ID' in query and query['ID'][0] in standIn.moleculesByID:
+            return self.sendContent(standIn.massSpectrumPage(standIn.moleculesByID[query['ID'][0]]).encode())
+        if 'JCAMP' in query and query['JCAMP'][0] in standIn.moleculesByID:
+            with open(standIn.moleculesByID[query['JCAMP'][0]]['JDXFileName'], 'rb') as JDXFile:
+                return self.sendContent(JDXFile.read(), 'chemical/x-jcamp-dx')
+        self.sendContent(b'Not Found', 'text/plain', 404)
+
+class WebbookStandIn:
+    """
+    This class is a local HTTP server imitating the NIST Webbook pages that this project reads, built from a directory of JDX files: each file is a molecule named after the file, with the formula, weight and CAS number of its header.
+    Pass its domain to NISTWebbook.WebbookSession to send the online fetch chain to it.
+    INPUT: JDXDirectory ( directory of JDX files to serve ) | latency ( seconds added to every response, to imitate a remote server )
+    """
+
+    def __init__(self, JDXDirectory=bundledJDXDirectory, latency=0.0):
+        self.latency = latency
+        self.requestCount = 0
+        self.lock = threading.Lock()
+        self.molecules = {}
+        self.moleculesByID = {}
+        for fileName in sorted(os.listdir(JDXDirectory)):
+            if not fileName.lower().endswith('.jdx'):
+                continue
+            JDXFileName = os.path.join(JDXDirectory, fileName)
+            header = JCampSG.JCAMP_blocks(JDXFileName)[0].read_header()
+            moleculeID = 'C' + str(header.get('cas registry no', '')).replace('-', '') if header.get('cas registry no') else f'X{len(self.molecules)}'
+            molecule = {'name': os.path.splitext(fileName)[0], 'JDXFileName': JDXFileName, 'ID': moleculeID, 'casNumber': str(header.get('cas registry no', '')),
+                        'formula': str(header.get('molform', '')).replace(' ', ''), 'molecularWeight': header.get('mw', '')}
+            self.molecules.setdefault(molecule['name'].lower(), molecule)
+            self.moleculesByID.setdefault(moleculeID, molecule)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebbookStandInHandler)
+        self.server.daemon_threads = True
+        self.server.standIn = self
+        self.domain = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def countRequest(self):
+        with self.lock:
+            self.requestCount = self.requestCount + 1
+
+    def moleculePage(self, molecule):
+        return (f'<html><body><h1 id="Top">{molecule["name"]}</h1><ul>'
+                f'<li><strong><a title="IUPAC definition of empirical formula" href="/cgi/cbook.cgi?Contrib=&amp;Units=SI">Formula</a>:</strong> {molecule["formula"]}</li>'
+                f'<li><strong><a title="IUPAC definition of relative molecular mass (molecular weight)" href="/cgi/cbook.cgi?Contrib=&amp;Units=SI">Molecular weight</a>:</strong> {molecule["molecularWeight"]}</li>'
+                f'<li><strong>CAS Registry Number:</strong> {molecule["casNumber"]}</li>'
+                f'<li><a href="/cgi/cbook.cgi?ID={molecule["ID"]}&amp;Units=SI&amp;Mask=200#Mass-Spec">Mass spectrum (electron ionization)</a></li>'
+                '</ul></body></html>')
+
+    def massSpectrumPage(self, molecule):
+        return f'<html><body><a href="/cgi/cbook.cgi?JCAMP={molecule["ID"]}&amp;Index=0&amp;Type=Mass">Download spectrum in JCAMP-DX format.</a></body></html>'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def timeFunction(function, repeat):
+    """
+    This function runs function repeat times and returns the fastest wall time in seconds and the return value of the last run
+    """
+    times = []
+    result = None
+    for run in range(max(1, repeat)):
+        startTime = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - startTime)
+    return min(times), result
+
+def benchmarkResult(name, items, seconds, **parameters):
+    return {'name': name, 'items': items, 'seconds': seconds, 'itemsPerSecond': items / seconds if seconds > 0 else None, 'parameters': parameters}
+
+def runBenchmarks(numberOfSpectra=1000, IRPoints=10**6, repeat=3, max_workers=None, fetchMolecules=38, fetchWorkers=8, latency=0.0, workDirectory=None):
+    """
+    This function generates the synthetic data and runs every benchmark
+    INPUT: numberOfSpectra ( size of the synthetic mass spectra library ) | IRPoints ( points of the synthetic IR file, 0 to skip it ) | repeat ( runs of each benchmark, the fastest is reported ) | max_workers ( processes of the parallel conversion, the number of CPUs if not given ) | fetchMolecules ( molecules fetched from the stand-in, 0 to skip the fetch ) | fetchWorkers ( threads of the fetch ) | latency ( seconds the stand-in waits before each response ) | workDirectory ( directory for the generated files, a temporary directory removed at the end if not given )
+    OUTPUT: results ( dictionary with the versions of the run and a 'benchmarks' list, each entry with 'name', 'items', 'seconds', 'itemsPerSecond' and 'parameters' )
+    """
+    temporaryDirectory = None
+    if workDirectory is None:
+        temporaryDirectory = tempfile.mkdtemp(prefix='JDXBenchmarks')
+        workDirectory = temporaryDirectory
+    benchmarks = []
+    try:
+        libraryDirectory = os.path.join(workDirectory, 'library')
+        startTime = time.perf_counter()
+        JDXFilesList, databaseFileName = generateMassSpectraLibrary(libraryDirectory, numberOfSpectra)
+        benchmarks.append(benchmarkResult('generateMassSpectraLibrary', numberOfSpectra, time.perf_counter() - startTime))
+
+        seconds, jcampDicts = timeFunction(lambda: [JCampSG.JCAMP_reader(JDXFileName) for JDXFileName in JDXFilesList], repeat)
+        benchmarks.append(benchmarkResult('JCAMP_reader (mass spectra)', len(JDXFilesList), seconds))
+
+        if IRPoints:
+            IRFileName = os.path.join(workDirectory, 'synthetic_ir.jdx')
+            generateIRFile(IRFileName, IRPoints)
+            seconds, IRDict = timeFunction(lambda: JCampSG.JCAMP_reader(IRFileName), repeat)
+            benchmarks.append(benchmarkResult('JCAMP_reader (IR file)', IRPoints, seconds, bytes=os.path.getsize(IRFileName)))
+            seconds, unused = timeFunction(lambda: JCampSG.JCAMP_mmap_reader(IRFileName), repeat)
+            benchmarks.append(benchmarkResult('JCAMP_mmap_reader (IR file)', IRPoints, seconds, bytes=os.path.getsize(IRFileName)))
+            #The IR file is cut into 100 spectra, converted to cross-sections one at a time and as a batch
+            IRDicts = [dict(IRDict, x=x, y=y, npoints=len(x)) for x, y in zip(numpy.array_split(IRDict['x'], 100), numpy.array_split(IRDict['y'], 100))]
+            seconds, unused = timeFunction(lambda: [JCampSG.JCAMP_calc_xsec(IRPart, skip_nonquant=False) for IRPart in IRDicts], repeat)
+            benchmarks.append(benchmarkResult('JCAMP_calc_xsec', len(IRDicts), seconds, points=IRPoints))
+            seconds, unused = timeFunction(lambda: JCampSG.JCAMP_calc_xsec_batch(IRDicts, skip_nonquant=False), repeat)
+            benchmarks.append(benchmarkResult('JCAMP_calc_xsec_batch', len(IRDicts), seconds, points=IRPoints))
+            stacked = numpy.empty((4, IRPoints))
+            seconds, unused = timeFunction(lambda: JCampSG.JCAMP_calc_xsec_batch(IRDicts, skip_nonquant=False, out=stacked), repeat)
+            benchmarks.append(benchmarkResult('JCAMP_calc_xsec_batch (reused buffer)', len(IRDicts), seconds, points=IRPoints))
+            #The 100 parts are resampled onto one grid, as if each was a spectrum of the same range
+            IRSpectra = [dict(IRPart, x=IRDicts[0]['x']) for IRPart in IRDicts if len(IRPart['x']) == len(IRDicts[0]['x'])]
+            resampler = SpectraResampling.SpectraResampler(SpectraResampling.makeGrid(float(IRDicts[0]['x'].min()), float(IRDicts[0]['x'].max()), float(numpy.ptp(IRDicts[0]['x'])) / len(IRDicts[0]['x'])))
+            seconds, unused = timeFunction(lambda: resampler.resampleJCAMP(IRSpectra, values='absorbance'), repeat)
+            benchmarks.append(benchmarkResult('SpectraResampler.resampleJCAMP', len(IRSpectra), seconds, gridPoints=len(resampler.grid), pointsPerSpectrum=len(IRDicts[0]['x'])))
+
+        seconds, spectra = timeFunction(lambda: [JDXConverter.createArray(jcampDict) for jcampDict in jcampDicts], repeat)
+        benchmarks.append(benchmarkResult('createArray', len(jcampDicts), seconds))
+
+        def combineIntoSpectraMatrix():
+            AllSpectra = JDXConverter.SpectraMatrix()
+            for spectrum in spectra:
+                JDXConverter.combineArray(AllSpectra, spectrum)
+            return AllSpectra
+        seconds, AllSpectra = timeFunction(combineIntoSpectraMatrix, repeat)
+        benchmarks.append(benchmarkResult('combineArray (SpectraMatrix)', len(spectra), seconds))
+
+        #The legacy flat list grows by one element per m/z value, so it is timed on at most 1000 spectra
+        flatListSpectra = spectra[:1000]
+        def combineIntoFlatList():
+            OverallArray = []
+            for spectrum in flatListSpectra:
+                JDXConverter.combineArray(OverallArray, spectrum)
+            return OverallArray
+        seconds, OverallArray = timeFunction(combineIntoFlatList, repeat)
+        benchmarks.append(benchmarkResult('combineArray (flat list)', len(flatListSpectra), seconds))
+
+        seconds, (ParallelSpectra, failures) = timeFunction(lambda: JDXConverter.getSpectrumDataFromLocalJDXInParallel(JDXFilesList, max_workers=max_workers), repeat)
+        benchmarks.append(benchmarkResult('getSpectrumDataFromLocalJDXInParallel', len(JDXFilesList), seconds, workers=max_workers or os.cpu_count(), failures=len(failures)))
+
+        database = JDXConverter.loadMoleculeDatabase(databaseFileName)
+        seconds, unused = timeFunction(lambda: JDXConverter.loadMoleculeDatabase(databaseFileName), repeat)
+        benchmarks.append(benchmarkResult('loadMoleculeDatabase', len(database) - 1, seconds))
+        for columnName, metadataColumn in (('Molecule Name', 'MoleculeNames'), ('Electrons', 'ENumbers'), ('Mass', 'MWeights')):
+            AllSpectra.metadata[metadataColumn] = database.column(columnName)
+        exportFileName = os.path.join(workDirectory, 'ConvertedSpectra.csv')
+        exportFileNames = [(exportFileName, ';'), (os.path.join(workDirectory, 'ConvertedSpectraTable.txt'), '\t'), (os.path.join(workDirectory, 'ConvertedSpectraTable.tab'), '\t')]
+        seconds, unused = timeFunction(lambda: JDXConverter.exportToCSV(exportFileName, AllSpectra, delimeter=';'), repeat)
+        benchmarks.append(benchmarkResult('exportToCSV', len(AllSpectra), seconds, bytes=os.path.getsize(exportFileName)))
+        seconds, unused = timeFunction(lambda: JDXConverter.exportToMultipleFiles(exportFileNames, AllSpectra), repeat)
+        benchmarks.append(benchmarkResult('exportToMultipleFiles (csv, txt, tab)', len(AllSpectra), seconds))
+        binaryDirectory = os.path.join(workDirectory, 'ConvertedSpectra.spectra')
+        seconds, unused = timeFunction(lambda: JDXConverter.exportToBinary(binaryDirectory, AllSpectra), repeat)
+        benchmarks.append(benchmarkResult('exportToBinary', len(AllSpectra), seconds))
+        seconds, unused = timeFunction(lambda: JDXConverter.loadFromBinary(binaryDirectory), repeat)
+        benchmarks.append(benchmarkResult('loadFromBinary', len(AllSpectra), seconds))
+
+        seconds, searchIndex = timeFunction(lambda: SpectraSearch.SpectraSearchIndex(AllSpectra), repeat)
+        benchmarks.append(benchmarkResult('SpectraSearchIndex', len(AllSpectra), seconds))
+        #The queries are library spectra with every peak changed by up to 10%
+        random = numpy.random.default_rng(0)
+        queryRows = random.choice(len(AllSpectra), min(1000, len(AllSpectra)), replace=False)
+        queries = AllSpectra.spectra[queryRows] * random.uniform(0.9, 1.1, size=(len(queryRows), AllSpectra.maximumAtomicUnit))
+        for method in SpectraSearch.SearchMethods:
+            for prefilter in (False, True):
+                seconds, unused = timeFunction(lambda: searchIndex.search(queries, topHits=5, method=method, prefilter=prefilter), repeat)
+                benchmarks.append(benchmarkResult('SpectraSearchIndex.search', len(queries), seconds, method=method, prefilter=prefilter, librarySpectra=len(AllSpectra)))
+
+        benchmarks.extend(runConversionBenchmarks(libraryDirectory, databaseFileName, max_workers, repeat, workDirectory))
+
+        if fetchMolecules:
+            benchmarks.extend(runFetchBenchmarks(fetchMolecules, fetchWorkers, latency, repeat, workDirectory))
+    finally:
+        if temporaryDirectory is not None:
+            shutil.rmtree(temporaryDirectory, ignore_errors=True)
+
+    return {'gitCommit': getGitCommit(), 'python': platform.python_version(), 'numpy': numpy.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'repeat': repeat, 'benchmarks': benchmarks}
+
+def runConversionBenchmarks(libraryDirectory, databaseFileName, max_workers, repeat, workDirectory):
+    """
+    This function times the conversion of the synthetic library into output files, by convertMolecules, by StreamingConversion.convertMoleculesStreaming and, if aiohttp is installed, by AsyncConversion.convert. The synthetic database rows leave some metadata unknown, which is looked up on a WebbookStandIn
+    OUTPUT: benchmarks ( list of benchmark results )
+    """
+    standIn = WebbookStandIn()
+    session = NISTWebbook.WebbookSession(domain=standIn.domain, cache=NISTWebbook.WebbookCache(':memory:'), requestsPerSecond=None)
+    NISTWebbook.setDefaultSession(session)
+    database = JDXConverter.loadMoleculeDatabase(databaseFileName)
+    MoleculeNames = database.moleculeNames()
+    outputFormats = ('csv', 'long', 'binary')
+    outputDirectory = os.path.join(workDirectory, 'ConvertedLibrary')
+    benchmarks = []
+    try:
+        seconds, unused = timeFunction(lambda: JDXConverter.convertMolecules(MoleculeNames, database, JDXFilesLocation=libraryDirectory + os.sep, outputFileDirectoryPath=outputDirectory,
+                                                                             outputFormats=outputFormats, max_workers=max_workers), repeat)
+        benchmarks.append(benchmarkResult('convertMolecules', len(MoleculeNames), seconds, workers=max_workers or os.cpu_count(), formats=list(outputFormats)))
+        seconds, unused = timeFunction(lambda: StreamingConversion.convertMoleculesStreaming(MoleculeNames, database, JDXFilesLocation=libraryDirectory + os.sep, outputFileDirectoryPath=outputDirectory + 'Stream',
+                                                                                                outputFormats=outputFormats, max_workers=max_workers), repeat)
+        benchmarks.append(benchmarkResult('convertMoleculesStreaming', len(MoleculeNames), seconds, workers=max_workers or os.cpu_count(), formats=list(outputFormats),
+                                          moleculesPerChunk=StreamingConversion.MoleculesPerChunk))
+        if importlib.util.find_spec('aiohttp') is not None:
+            seconds, unused = timeFunction(lambda: asyncio.run(AsyncConversion.convert(MoleculeNames, database, JDXFilesLocation=libraryDirectory + os.sep, outputFileDirectoryPath=outputDirectory + 'Async',
+                                                                                   outputFormats=outputFormats, max_workers=max_workers)), repeat)
+            benchmarks.append(benchmarkResult('AsyncConversion.convert', len(MoleculeNames), seconds, workers=max_workers or os.cpu_count(), formats=list(outputFormats),
+                                              concurrentMolecules=AsyncConversion.ConcurrentMolecules))
+    finally:
+        NISTWebbook.setDefaultSession(None)
+        session.close()
+        session.cache.close()
+        standIn.close()
+    return benchmarks
+
+def runFetchBenchmarks(fetchMolecules, fetchWorkers, latency, repeat, workDirectory):
+    """
+    This function times getDataForMoleculesFromOnline against a WebbookStandIn serving the bundled JDX files, first without a cache and then from a warm cache
+    OUTPUT: benchmarks ( list of benchmark results )
+    """
+    standIn = WebbookStandIn(latency=latency)
+    moleculeNames = [standIn.molecules[key]['name'] for key in sorted(standIn.molecules)]
+    moleculeNames = (moleculeNames * (fetchMolecules // len(moleculeNames) + 1))[:fetchMolecules]
+    #getJDX saves the downloaded files in JDXFiles relative to the working directory, which must not be the repository's own JDXFiles
+    previousDirectory = os.getcwd()
+    os.chdir(workDirectory)
+    benchmarks = []
+    try:
+        def fetchWithoutCache():
+            session = NISTWebbook.WebbookSession(domain=standIn.domain, maxConnections=fetchWorkers, requestsPerSecond=None)
+            try:
+                return JDXConverter.getDataForMoleculesFromOnline(moleculeNames, max_workers=fetchWorkers, session=session)
+            finally:
+                session.close()
+        requestsBefore = standIn.requestCount
+        seconds, results = timeFunction(fetchWithoutCache, repeat)
+        benchmarks.append(benchmarkResult('getDataForMoleculesFromOnline (no cache)', len(moleculeNames), seconds, workers=fetchWorkers, latency=latency,
+                                          requests=(standIn.requestCount - requestsBefore) // max(1, repeat), notFound=sum(result['SourceOfFragmentationPattern'] == 'unknown' for result in results)))
+
+        cachedSession = NISTWebbook.WebbookSession(domain=standIn.domain, cache=NISTWebbook.WebbookCache(':memory:'), maxConnections=fetchWorkers, requestsPerSecond=None)
+        try:
+            JDXConverter.getDataForMoleculesFromOnline(moleculeNames, max_workers=fetchWorkers, session=cachedSession)
+            def fetchFromCache():
+                cachedSession.parsedPages.clear() #Time the cache, not the in-memory parsed pages
+                return JDXConverter.getDataForMoleculesFromOnline(moleculeNames, max_workers=fetchWorkers, session=cachedSession)
+            requestsBefore = standIn.requestCount
+            seconds, results = timeFunction(fetchFromCache, repeat)
+            benchmarks.append(benchmarkResult('getDataForMoleculesFromOnline (warm cache)', len(moleculeNames), seconds, workers=fetchWorkers,
+                                              requests=(standIn.requestCount - requestsBefore) // max(1, repeat)))
+        finally:
+            cachedSession.close()
+            cachedSession.cache.close()
+    finally:
+        os.chdir(previousDirectory)
+        standIn.close()
+    return benchmarks
+
+def getGitCommit():
+    #The commit of the benchmarked code, None outside of a git checkout
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='JDXBenchmarks.py', description='Benchmarks of JDX parsing, binning, exporting and fetching. Results are printed, or written with --output, as JSON.')
+    parser.add_argument('--spectra', type=int, default=1000, help='size of the synthetic mass spectra library (default: 1000)')
+    parser.add_argument('--ir-points', type=int, default=10**6, help='points of the synthetic IR file, 0 to skip it (default: 1000000)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the fastest is reported (default: 3)')
+    parser.add_argument('--workers', type=int, default=None, help='processes of the parallel conversion (default: number of CPUs)')
+    parser.add_argument('--fetch-molecules', type=int, default=38, help='molecules fetched from the local stand-in server, 0 to skip the fetch (default: 38)')
+    parser.add_argument('--fetch-workers', type=int, default=8, help='threads of the fetch (default: 8)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stand-in server waits before each response (default: 0)')
+    parser.add_argument('--work-dir', default=None, help='directory for the generated files, kept after the run (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to (default: standard output)')
+    arguments = parser.parse_args(argv)
+
+    results = runBenchmarks(numberOfSpectra=arguments.spectra, IRPoints=arguments.ir_points, repeat=arguments.repeat, max_workers=arguments.workers,
+                            fetchMolecules=arguments.fetch_molecules, fetchWorkers=arguments.fetch_workers, latency=arguments.latency, workDirectory=arguments.work_dir)
+    if arguments.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(arguments.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
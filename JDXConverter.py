@@ -1,93 +1,53 @@
 
-#This variable determines the largest fragment size that the program can handle
-MaximumAtomicUnit = 300
+#The spectra containers live in their own module, so that the modules using them and this file run as a script share the same classes
+from SpectraContainers import MaximumAtomicUnit, PeakList, SpectraMetadataColumns, SpectraMatrix, SparseSpectraMatrix
 
-def getMassSpectrumURL(URL):
+def getMassSpectrumURL(URL, session=None):
 
     """
     This function will take the NISTWebbook Website URL of a particular molecule and extract the Mass Spectrum URL from that webpage
-    INPUT: URL ( NISTWebbook URL of a specific molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI )
+    INPUT: URL ( NISTWebbook URL of a specific molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI ) | session ( optional NISTWebbook.WebbookSession, the shared default session is used if not given )
     OUTPUT: mass_spec_url ( mass spectrum URL of that specific molecule )
     """
-    import httplib2
-    from bs4 import BeautifulSoup, SoupStrainer
+    return getMoleculeRecordFromOnline(URL, session=session)['massSpectrumURL']
 
-    http = httplib2.Http()
-    status, response = http.request(URL)
-
-    all_links = BeautifulSoup(response, parse_only=SoupStrainer('a'), features='html.parser')
-
-    for link in all_links:
-        if link.has_attr('href'):
-            value = link['href']
-            if(value.find('#Mass-Spec')>0):
-                domain = 'https://webbook.nist.gov'
-                mass_spec_url = domain + value
-                return mass_spec_url
-
-def getJDXDownloadURL(mass_spectrum_url):
-
-    """
-    This function will take the mass spectrum url of a specific molecule and extract the "Download spectrum in JCAMP-DX format" URL
-    INPUT: mass_spectrum_url ( Specific molecule's mass spectrum webpage's URL . Example : https://webbook.nist.gov/cgi/cbook.cgi?ID=C64175&Units=SI&Mask=200#Mass-Spec )
-    OUTPUT: download_url (Specific molecule's mass spectrum's JDX Format file download link. Example : https://webbook.nist.gov/cgi/cbook.cgi?JCAMP=C64175&Index=0&Type=Mass )
-    """
-    import httplib2
-    from bs4 import BeautifulSoup, SoupStrainer
-
-    http = httplib2.Http()
-    status, response = http.request(mass_spectrum_url)
-
-    all_links = BeautifulSoup(response, parse_only=SoupStrainer('a'), features='html.parser')
-
-    for link in all_links:
-        if link.has_attr('href'):
-            value = link['href']
-            if(value.find('JCAMP')>0):
-                domain = 'https://webbook.nist.gov'
-                download_url = domain + value
-                return download_url
-
-def getMolecularWeight(URL):
+def getMolecularWeight(URL, session=None):
 
     """
     This function will take the specific molecule's NISTWebBook URL and fetch the Molecular weight value from that web page.
-    INPUT: URL (specific molecule's NISTWebBook URL that contains the details of that molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI ) 
+    INPUT: URL (specific molecule's NISTWebBook URL that contains the details of that molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI ) | session ( optional NISTWebbook.WebbookSession )
     OUTPUT: molecularWeight ( the molecular weight value from the NISTWebBook page of the specific molecule. The value is in Float dataType )
     """
-    import requests
-    from bs4 import BeautifulSoup
-
-    webpage = requests.get(URL) 
-    soup = BeautifulSoup(webpage.content, "lxml")
-
-    molecularWeight = soup.find("a", attrs={"title": 'IUPAC definition of relative molecular mass (molecular weight)'}).find_parent().nextSibling
-    return float(molecularWeight)
+    molecularWeight = getMoleculeRecordFromOnline(URL, session=session)['molecularWeight']
+    if molecularWeight is None:
+        raise ValueError(f'No molecular weight found on {URL}')
+    return molecularWeight
 
-def getMolecularFormula(URL):
+def getMolecularFormula(URL, session=None):
 
     """
     This function will extract the Formula from the specific molecule's NISTWebBook URL.
-    INPUT: URL (specific molecule's NISTWebBook URL that contains the details of that molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI)
+    INPUT: URL (specific molecule's NISTWebBook URL that contains the details of that molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI) | session ( optional NISTWebbook.WebbookSession )
     OUTPUT: formula (extracted molecular formula string from the NISTWebBook URL)
     """
-    import bs4
-    import requests
-    from bs4 import BeautifulSoup
-    
-    webpage = requests.get(URL) 
-    soup = BeautifulSoup(webpage.content, "lxml")
-
-    formula_tag = soup.find("a", attrs={"title": 'IUPAC definition of empirical formula'}).find_parent().next_siblings
-    formula = ''
-    for sib in formula_tag:                                                                                             #sib is the siblings inside formula_tag
-        if(type(sib) == bs4.element.Tag):
-            formula = formula +sib.text
-        else:
-            formula = formula + sib
-
+    formula = getMoleculeRecordFromOnline(URL, session=session)['formula']
+    if formula is None:
+        raise ValueError(f'No molecular formula found on {URL}')
     return formula
 
+def getMoleculeRecordFromOnline(URL, session=None):
+
+    """
+    This function reads a molecule's NISTWebBook page once and returns everything this module uses from it.
+    INPUT: URL ( NISTWebbook URL of a specific molecule, or of its mass spectrum page ) | session ( optional NISTWebbook.WebbookSession, the shared default session is used if not given )
+    OUTPUT: record ( dictionary with 'formula', 'molecularWeight', 'casNumber', 'massSpectrumURL' and 'jcampURL', None for fields missing from the page. Example: {'formula': 'C2H6O', 'molecularWeight': 46.0684, 'casNumber': '64-17-5', 'massSpectrumURL': 'https://webbook.nist.gov/cgi/cbook.cgi?ID=C64175&Units=SI&Mask=200#Mass-Spec', 'jcampURL': None} )
+    """
+    import NISTWebbook
+
+    if session is None:
+        session = NISTWebbook.getDefaultSession()
+    return session.getMoleculePage(URL)
+
 def getElectronNumbers(formula):
 
     """
@@ -100,45 +60,54 @@ def getElectronNumbers(formula):
     comp = pymatgen.core.composition.Composition(formula)
     return comp.total_electrons
 
-def getJDXDownloadURL(mass_spectrum_url):
+def getJDXDownloadURL(mass_spectrum_url, session=None):
     """
     This function will take in the URL of the mass spectrum webpage  of the specific molecule and extract the JDX download URL from that page.
-    INPUT: mass_spectrum_url(specific molecule's mass spectrum webpage's URL)
+    INPUT: mass_spectrum_url(specific molecule's mass spectrum webpage's URL) | session ( optional NISTWebbook.WebbookSession )
     OUTPUT: mass_spec_url ( specific molecule's mass spectrum in JCAMP-DX format download URL)
     """
-    import httplib2
-    from bs4 import BeautifulSoup, SoupStrainer
+    return getMoleculeRecordFromOnline(mass_spectrum_url, session=session)['jcampURL']
 
-    http = httplib2.Http()
-    status, response = http.request(mass_spectrum_url)
-
-    for link in BeautifulSoup(response, parse_only=SoupStrainer('a'), features='html.parser'):
-        if link.has_attr('href'):
-            value = link['href']
-            if(value.find('JCAMP')>0):
-                domain = 'https://webbook.nist.gov'
-                mass_spec_url = domain + value
-                return mass_spec_url
-
-def getJDX(URL,molecule_name):
+def getJDX(URL,molecule_name, session=None, outputdirectory="JDXFiles"):
 
     """
     This function retrieves the JDX Formatted file of a specific molecule taking in the NISTWebBook URL and the molecule's name
-    INPUT: URL (mass spectrum in JCAMP-DX format download URL) | molecule_name (specific molecule's name to name the jdx formatted file in the output directory)
+    INPUT: URL (mass spectrum in JCAMP-DX format download URL) | molecule_name (specific molecule's name to name the jdx formatted file in the output directory) | session ( optional NISTWebbook.WebbookSession ) | outputdirectory ( directory the file is saved in )
     OUTPUT: returns the filename with the output directory path
     """
-    import urllib.request
-    import cgi
+    import os
+    import NISTWebbook
 
     # URL = "https://webbook.nist.gov/cgi/cbook.cgi?JCAMP=C67561&Index=0&Type=Mass"
-    remotefile = urllib.request.urlopen(URL)
-    remotefileName = remotefile.info()['Content-Disposition']
-    value, params = cgi.parse_header(remotefileName)
-    outputdirectory = "JDXFiles"
-    filename = "%s\\%s" %(outputdirectory,molecule_name+".jdx")
-    urllib.request.urlretrieve(URL, filename)
+    if session is None:
+        session = NISTWebbook.getDefaultSession()
+    remotefile = session.get(URL)
+    filename = os.path.join(outputdirectory, molecule_name+".jdx")
+    writeFileAtomically(filename, remotefile.content)
     return filename
 
+def writeFileAtomically(filename, content):
+    """
+    This function writes content to a temporary file next to filename and then renames it to filename, so that readers, and other threads or processes writing the same file at the same time, only ever see a complete file
+    INPUT: filename ( path+filename, its directory is created if needed ) | content ( bytes )
+    """
+    import os
+    import threading
+
+    directory = os.path.dirname(filename)
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    #The temporary name is unique to this thread of this process, so concurrent writers never share one
+    temporaryFileName = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temporaryFileName, 'wb') as outputFile:
+            outputFile.write(content)
+        os.replace(temporaryFileName, filename)
+    except BaseException:
+        if os.path.exists(temporaryFileName):
+            os.remove(temporaryFileName)
+        raise
+
 def getOverAllArray(listOfFiles):
     
     import JCampSG
@@ -151,57 +120,157 @@ def getOverAllArray(listOfFiles):
     OverallArray=combineArray(OverallArray, holderArray)
     return OverallArray
 
-def createArray(jcampDict):
-    DataArray =[]
+def binSpectrum(x, y, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
+    """
+    This function scatters the intensities of a spectrum into an array indexed by m/z in one vectorized pass.
+    INPUT: x ( m/z values of the spectrum ) | y ( intensities, same length as x ) | rounding ( how non-integer m/z values are mapped to a bin: 'nearest', 'floor' or 'ceil' ) | duplicatePolicy ( what to do when several peaks land in the same bin: 'sum', 'max' or 'last' ) | maximumAtomicUnit ( number of bins, defaults to MaximumAtomicUnit. With 'auto' there is one bin per m/z up to the largest m/z of the spectrum, so no peak is dropped )
+    OUTPUT: binnedSpectrum ( numpy float array of length maximumAtomicUnit, index i holds the intensity at m/z i+1. Peaks outside 1..maximumAtomicUnit are dropped, with a warning for those above maximumAtomicUnit ( see warnDroppedPeaks ) )
+    """
+    import numpy
+
+    if maximumAtomicUnit is None:
+        maximumAtomicUnit = MaximumAtomicUnit
+
+    roundingFunctions = {'nearest': numpy.rint, 'floor': numpy.floor, 'ceil': numpy.ceil}
+    if rounding not in roundingFunctions:
+        raise ValueError(f"Unknown rounding '{rounding}'. Expected one of {sorted(roundingFunctions)}")
+    if duplicatePolicy not in ('sum', 'max', 'last'):
+        raise ValueError(f"Unknown duplicatePolicy '{duplicatePolicy}'. Expected one of ['last', 'max', 'sum']")
+
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    if x.shape != y.shape:
+        raise ValueError(f"x and y must have the same length, got {x.size} and {y.size}")
+
+    #The bin of m/z value 1 is at index 0, so every index is shifted down by one
+    indices = roundingFunctions[rounding](x).astype(numpy.intp) - 1
+    if maximumAtomicUnit == 'auto':
+        maximumAtomicUnit = max(0, int(indices.max()) + 1) if indices.size else 0
+    inRange = (indices >= 0) & (indices < maximumAtomicUnit)
+    warnDroppedPeaks(int(numpy.count_nonzero(indices >= maximumAtomicUnit)), maximumAtomicUnit)
+    indices = indices[inRange]
+    y = y[inRange]
+
+    if duplicatePolicy == 'sum':
+        binnedSpectrum = numpy.bincount(indices, weights=y, minlength=maximumAtomicUnit)
+    elif duplicatePolicy == 'max':
+        binnedSpectrum = numpy.full(maximumAtomicUnit, -numpy.inf)
+        numpy.maximum.at(binnedSpectrum, indices, y)
+        binnedSpectrum[numpy.isneginf(binnedSpectrum)] = 0.0
+    else:
+        #Keep the last peak of every bin: the first occurrence in the reversed arrays is the last one in the original order
+        binnedSpectrum = numpy.zeros(maximumAtomicUnit)
+        uniqueIndices, positionsInReversed = numpy.unique(indices[::-1], return_index=True)
+        binnedSpectrum[uniqueIndices] = y[::-1][positionsInReversed]
+
+    return binnedSpectrum
 
-    counterY=0
-    counter =0
-    for number in jcampDict['x']:    
-        counter = counter +1
-        counterY2=0
-        while counter != float(number):
-        
-            DataArray.append(0)
-            #fileData.write('%f,'%zero)
-            #fileData.write('\n')
-            counter = counter +1 
+def warnDroppedPeaks(droppedPeaks, maximumAtomicUnit):
+    """
+    This function reports the peaks that binning drops because their m/z is above maximumAtomicUnit: they are added to the 'peaks dropped' counter of Instrumentation, and a warning tells how to keep them
+    INPUT: droppedPeaks ( number of peaks dropped from one spectrum ) | maximumAtomicUnit ( largest m/z kept )
+    """
+    import warnings
+    import Instrumentation
 
-        for number2 in jcampDict['y']:
-            if counterY2 == counterY:
-                
-                DataArray.append(number2) 
-                #fileData.write('%f,'%number2)
-                #fileData.write('\n')
-                #counterY2 =counterY2 + 1
-                break;
-            else:
-                counterY2=counterY2 +1  
+    if droppedPeaks == 0:
+        return
+    Instrumentation.count('peaks dropped', droppedPeaks)
+    warnings.warn(f"{droppedPeaks} peaks above m/z {maximumAtomicUnit} were dropped. Use maximumAtomicUnit='auto' (--max-mz auto) to keep every peak", stacklevel=3)
+
+def createArray(jcampDict, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
+    """
+    This function takes a dictionary returned by JCampSG.JCAMP_reader and returns its spectrum binned by integer m/z
+    INPUT: jcampDict ( dictionary containing the 'x' and 'y' vectors of the spectrum ) | rounding, duplicatePolicy, maximumAtomicUnit ( see binSpectrum )
+    OUTPUT: DataArray ( numpy array of length MaximumAtomicUnit, index i holds the intensity at m/z i+1 )
+    """
+    return binSpectrum(jcampDict['x'], jcampDict['y'], rounding=rounding, duplicatePolicy=duplicatePolicy, maximumAtomicUnit=maximumAtomicUnit)
+
+def getPeakList(spectrum):
+    """
+    This function returns the peaks of a binned spectrum
+    INPUT: spectrum ( dense binned spectrum as returned by createArray, index i holds m/z i+1, or a PeakList, which is returned as it is )
+    OUTPUT: peakList ( PeakList )
+    """
+    import numpy
 
-        counterY= counterY +1
+    if isinstance(spectrum, PeakList):
+        return spectrum
+    spectrum = numpy.asarray(spectrum, dtype=numpy.float64).ravel()
+    massIndices = numpy.flatnonzero(spectrum)
+    return PeakList(massIndices + 1, spectrum[massIndices])
 
-    if len(DataArray) < MaximumAtomicUnit:
-        for i in range(len(DataArray), MaximumAtomicUnit):
-            DataArray.append(0)
-    return DataArray
+def createPeakList(jcampDict, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit='auto'):
+    """
+    This function is createArray returning a PeakList: the spectrum of a dictionary returned by JCampSG.JCAMP_reader binned by integer m/z, without building a dense array
+    INPUT: jcampDict ( dictionary containing the 'x' and 'y' vectors of the spectrum ) | rounding, duplicatePolicy ( see binSpectrum ) | maximumAtomicUnit ( largest m/z kept, 'auto' to keep every peak, None for MaximumAtomicUnit )
+    OUTPUT: peakList ( PeakList )
+    """
+    import numpy
+
+    roundingFunctions = {'nearest': numpy.rint, 'floor': numpy.floor, 'ceil': numpy.ceil}
+    if rounding not in roundingFunctions:
+        raise ValueError(f"Unknown rounding '{rounding}'. Expected one of {sorted(roundingFunctions)}")
+    if maximumAtomicUnit is None:
+        maximumAtomicUnit = MaximumAtomicUnit
+    x = numpy.asarray(jcampDict['x'], dtype=numpy.float64)
+    y = numpy.asarray(jcampDict['y'], dtype=numpy.float64)
+    if x.shape != y.shape:
+        raise ValueError(f"x and y must have the same length, got {x.size} and {y.size}")
+
+    massToCharges = roundingFunctions[rounding](x).astype(numpy.int64)
+    inRange = massToCharges >= 1
+    if maximumAtomicUnit != 'auto':
+        inRange &= massToCharges <= maximumAtomicUnit
+        warnDroppedPeaks(int(numpy.count_nonzero(massToCharges > maximumAtomicUnit)), maximumAtomicUnit)
+    return PeakList(massToCharges[inRange], y[inRange], duplicatePolicy)
 
 def combineArray(Array1, Array2):
-    
+    """
+    This function appends one binned spectrum to a collection of spectra
+    INPUT: Array1 ( a SpectraMatrix or SparseSpectraMatrix, or the legacy flat list of concatenated spectra ) | Array2 ( a single binned spectrum or PeakList, or a SpectraMatrix or SparseSpectraMatrix whose rows will all be appended )
+    OUTPUT: Array1 ( the same collection with Array2 appended )
+    """
+    if isinstance(Array1, (SpectraMatrix, SparseSpectraMatrix)):
+        if isinstance(Array2, (SpectraMatrix, SparseSpectraMatrix)):
+            Array1.extend(Array2)
+        else:
+            Array1.append(Array2)
+        return Array1
+
+    if isinstance(Array2, PeakList):
+        Array2 = Array2.toArray(MaximumAtomicUnit)
     for i in range(MaximumAtomicUnit):
         Array1.append(Array2[i])
     
     
     return Array1
 
+def getSpectraArray(OverallArray):
+    """
+    This function returns a (molecules x m/z) numpy array for any of the spectra collections used in this module
+    INPUT: OverallArray ( a SpectraMatrix, a SparseSpectraMatrix ( expanded to dense form ), a 2-D array, or the legacy flat list of concatenated spectra )
+    OUTPUT: spectraArray ( 2-D numpy array )
+    """
+    import numpy
+
+    if isinstance(OverallArray, (SpectraMatrix, SparseSpectraMatrix)):
+        return OverallArray.spectra
+    spectraArray = numpy.asarray(OverallArray, dtype=numpy.float64)
+    if spectraArray.ndim == 2:
+        return spectraArray
+    return spectraArray.reshape(-1, MaximumAtomicUnit)
+
 def getSpectrumDataFromLocalJDX(JDXFilesList):
     """
     This function will take in a JDX file and extract the spectrum data into a python Array
     INPUT: JDXFilesList(This must be a list of path+filename . Example : ['JDXFiles\\Ethanol.jdx','JDXFiles\\Methanol.jdx'])
-    OUTPUT: AllSpectraData(Python list of spectrum data retrieved from the JDX)
+    OUTPUT: AllSpectraData(SpectraMatrix with one row of spectrum data per JDX file, in the order of JDXFilesList)
     """
     
     import JCampSG
 
-    AllSpectraData=[]
+    AllSpectraData=SpectraMatrix(initialCapacity=len(JDXFilesList))
     individual_spectrum=[]
     for file in JDXFilesList:
         stripped_fileName = file.strip()
@@ -212,89 +281,325 @@ def getSpectrumDataFromLocalJDX(JDXFilesList):
 
         jcampDict=JCampSG.JCAMP_reader(filename)
         individual_spectrum=createArray(jcampDict)
-        AllSpectraData=combineArray(AllSpectraData, individual_spectrum)
+        AllSpectraData.append(individual_spectrum)
     return AllSpectraData
 
-def exportToCSV(filename, OverallArray, MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData, delimeter=';'):
+def convertJDXFile(filename, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
     """
-    This function basically takes in all the metadata of molecules and write them into csv file/files
+    This function reads and bins one JDX file. It is the work done on each process by getSpectrumDataFromLocalJDXInParallel, and returns the spectrum in a compact form (only its nonzero bins) to keep the transfer back to the parent process small
+    INPUT: filename ( path+filename, '.jdx' is added if missing ) | rounding, duplicatePolicy, maximumAtomicUnit ( as for binSpectrum )
+    OUTPUT: massIndices ( indices of the nonzero bins, index i is m/z i+1 ) | intensities ( values of those bins ) | error ( None, or a description of why the file could not be converted, in which case massIndices and intensities are None )
     """
-    import os.path
+    import numpy
+    import JCampSG
+
+    filename = filename.strip()
+    if('.jdx' not in filename):
+        filename = filename+'.jdx'
+    try:
+        spectrum = createArray(JCampSG.JCAMP_reader(filename), rounding, duplicatePolicy, maximumAtomicUnit)
+    except Exception as error:
+        return None, None, f'{type(error).__name__}: {error}'
+    massIndices = numpy.flatnonzero(spectrum).astype(numpy.int32)
+    return massIndices, spectrum[massIndices], None
+
+def convertJDXFileMeasured(filename, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
+    """
+    This function is convertJDXFile with measurements, used by getSpectrumDataFromLocalJDXInParallel when Instrumentation is enabled. The measurements are returned so that the parent process can record them, as the workers' own Instrumentation records are lost
+    INPUT: as for convertJDXFile
+    OUTPUT: result ( what convertJDXFile returns ) | seconds ( wall time of the conversion ) | bytesRead ( size of the JDX file, 0 if it could not be read )
+    """
+    import os
+    import time
+
+    startTime = time.perf_counter()
+    result = convertJDXFile(filename, rounding, duplicatePolicy, maximumAtomicUnit)
+    seconds = time.perf_counter() - startTime
+    filename = filename.strip()
+    if('.jdx' not in filename):
+        filename = filename+'.jdx'
+    try:
+        bytesRead = os.path.getsize(filename)
+    except OSError:
+        bytesRead = 0
+    return result, seconds, bytesRead
+
+def getSpectrumDataFromLocalJDXInParallel(JDXFilesList, max_workers=None, rounding='nearest', duplicatePolicy='sum', chunksize=None, maximumAtomicUnit=None, sparse=False):
+    """
+    This function converts many JDX files at once, spreading the parsing and binning of the files over a pool of processes. A file that cannot be converted does not stop the others
+    INPUT: JDXFilesList ( list of path+filename, as for getSpectrumDataFromLocalJDX ) | max_workers ( number of processes, the number of CPUs if not given. With 1 the files are converted in this process ) | rounding, duplicatePolicy, maximumAtomicUnit ( as for binSpectrum ) | chunksize ( number of files sent to a process at a time, chosen from the number of files if not given ) | sparse ( True to return a SparseSpectraMatrix )
+    OUTPUT: AllSpectraData ( SpectraMatrix, or SparseSpectraMatrix if sparse is True, with one row per JDX file, in the order of JDXFilesList. The rows of files that failed are all zeros ) | failures ( list of (filename, error) pairs for the files that could not be converted, in the order of JDXFilesList )
+    """
+    import concurrent.futures
+    import functools
+    import os
+    import Instrumentation
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(JDXFilesList)))
+    if chunksize is None:
+        chunksize = max(1, len(JDXFilesList) // (max_workers * 4)) #A few chunks per process balances the load without sending each file separately
+
+    measured = Instrumentation.enabled
+    convert = functools.partial(convertJDXFileMeasured if measured else convertJDXFile, rounding=rounding, duplicatePolicy=duplicatePolicy, maximumAtomicUnit=maximumAtomicUnit)
+    if max_workers == 1:
+        return collectLocalSpectra(JDXFilesList, map(convert, JDXFilesList), maximumAtomicUnit, sparse, measured)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        #executor.map returns the results in the order of JDXFilesList, whichever process finishes first
+        return collectLocalSpectra(JDXFilesList, executor.map(convert, JDXFilesList, chunksize=chunksize), maximumAtomicUnit, sparse, measured)
+
+def collectLocalSpectra(JDXFilesList, results, maximumAtomicUnit=None, sparse=False, measured=False):
+    """
+    This function gathers the results of convertJDXFile for a list of JDX files into one matrix
+    INPUT: JDXFilesList ( list of path+filename ) | results ( iterable of what convertJDXFile returned for each file, in the order of JDXFilesList ) | maximumAtomicUnit ( as for binSpectrum ) | sparse ( True to return a SparseSpectraMatrix ) | measured ( True if the results are those of convertJDXFileMeasured, whose measurements are then recorded )
+    OUTPUT: AllSpectraData | failures ( as for getSpectrumDataFromLocalJDXInParallel )
+    """
+    import Instrumentation
 
-    if(os.path.exists(filename)):
-        f5 = open(filename, 'w')
+    #The spectra are collected in sparse form when the m/z range is only known once every file is converted
+    collectSparse = sparse or maximumAtomicUnit == 'auto'
+    if collectSparse:
+        AllSpectraData=SparseSpectraMatrix(maximumAtomicUnit=maximumAtomicUnit, initialCapacity=len(JDXFilesList))
     else:
-        directory_name = filename.split('\\')[0]
-        if(not os.path.isdir(directory_name)):
-            os.mkdir(directory_name)
-        f5 = open(filename, 'w')
-
-    f5.write('#CommentsLine:')
-    for i in range(len(MoleculeNames)):
-        f5.write(delimeter)
-    f5.write('\n')
-    
-    #write the molecules
-    f5.write('Molecules')
-    for i in MoleculeNames:
-        f5.write(f'{delimeter}{i}')
-    f5.write('\n')
-
-    #write the Electron Numbers
-    f5.write('Electron Numbers')
-    for i in ENumbers:
-        f5.write(f"{delimeter}{float(i)}")
-    # f5.write(str(ENumbers))
-    f5.write('\n')
-    
-    #write the ionization type
-    f5.write('knownMoleculesIonizationTypes')
-    for i in knownMoleculeIonizationTypes:
-        f5.write(f'{delimeter}{i}')
-    f5.write('\n')
-    
-    #write the ionization factor
-    f5.write('knownIonizationFactorsRelativeToN2')
-    for i in knownIonizationFactorsRelativeToN2:
-        f5.write(f'{delimeter}{i}')
-    f5.write('\n')
-    
-    #write the header
-    f5.write('SourceOfFragmentationPatterns')
-    for i in SourceOfFragmentationPatterns:
-        f5.write(f'{delimeter}{i}')
-    f5.write('\n')
-    
-    #write the ionization data source
-    f5.write("SourceOfIonizationData")
-    for i in SourceOfIonizationData:
-        f5.write(f'{delimeter}{i}')
-    f5.write('\n')
-    
-    #write the molecular weights
-    f5.write('Molecular Mass')
-    for i in MWeights:
-        f5.write(f'{delimeter}{float(i)}')
-    # f5.write(str(MWeights))
-    f5.write('\n')
-    
-    Array1=OverallArray
-    printRow= len(Array1)//MaximumAtomicUnit #TODO: printRow is not a good variable name, this should be changed.
-    printArray =[]
-    zeros = True
-
-    for i in range(1,MaximumAtomicUnit+1):
-        zeros = True
-        for k in range(printRow):
-            if Array1[MaximumAtomicUnit*k +i-1] != 0: #The -1 is for array indexing
-                zeros =False                
-        if zeros == False:
-            f5.write('%d'%(i))    
-            for y in range(printRow):    
-                f5.write(f'{delimeter}{int(Array1[MaximumAtomicUnit*y +i-1])}') #The -1 is for array indexing
-            f5.write('\n')
-            
-    f5.close()
+        AllSpectraData=SpectraMatrix(maximumAtomicUnit=maximumAtomicUnit, initialCapacity=len(JDXFilesList))
+    failures=[]
+    for filename, result in zip(JDXFilesList, results):
+        if measured:
+            result, seconds, bytesRead = result
+            Instrumentation.record('jdx file', seconds)
+            Instrumentation.count('bytes read', bytesRead)
+        massIndices, intensities, error = result
+        if collectSparse:
+            if error is None:
+                AllSpectraData.appendPeaks(massIndices + 1, intensities)
+            else:
+                AllSpectraData.appendPeaks([], [])
+        else:
+            rowIndex = AllSpectraData.append([])
+            if error is None:
+                AllSpectraData.buffer[rowIndex, massIndices] = intensities
+        if error is not None:
+            failures.append((filename, error))
+    if collectSparse and not sparse:
+        AllSpectraData = AllSpectraData.toSpectraMatrix()
+    return AllSpectraData, failures
+
+def getSpectrumDataFromJDXLibraryFile(JDXFileName, rounding='nearest', duplicatePolicy='sum'):
+    """
+    This function reads every spectrum of a multi-block JDX file (a compound ##BLOCKS= file, or a GC-MS run with many spectra) into a SpectraMatrix. The blocks are read one at a time, so only one block's data is in memory at once
+    INPUT: JDXFileName ( path+filename of the JDX file ) | rounding, duplicatePolicy ( as for binSpectrum )
+    OUTPUT: AllSpectraData ( SpectraMatrix with one row per spectrum block, in file order, with the block titles as MoleculeNames )
+    """
+    import JCampSG
+
+    blocks=JCampSG.JCAMP_blocks(JDXFileName)
+    AllSpectraData=SpectraMatrix(initialCapacity=len(blocks))
+    for block in blocks:
+        AllSpectraData.append(createArray(block.jcamp_dict, rounding, duplicatePolicy), MoleculeNames=block.title)
+    return AllSpectraData
+
+def exportToCSV(filename, OverallArray, MoleculeNames=None, ENumbers=None, MWeights=None, knownMoleculeIonizationTypes=None, knownIonizationFactorsRelativeToN2=None, SourceOfFragmentationPatterns=None, SourceOfIonizationData=None, delimeter=';'):
+    """
+    This function basically takes in all the metadata of molecules and write them into csv file/files
+    If OverallArray is a SpectraMatrix, any metadata list that is not given is taken from its metadata columns.
+    To write the same table in several formats, exportToMultipleFiles does it in a single pass.
+    """
+    exportToMultipleFiles([(filename, delimeter)], OverallArray, MoleculeNames=MoleculeNames, ENumbers=ENumbers, MWeights=MWeights,
+                          knownMoleculeIonizationTypes=knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2=knownIonizationFactorsRelativeToN2,
+                          SourceOfFragmentationPatterns=SourceOfFragmentationPatterns, SourceOfIonizationData=SourceOfIonizationData)
+
+def getExportHeaderRows(MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData):
+    """
+    This function generates the metadata rows at the top of the exported table, each as a list of cell strings: the row name followed by one cell per molecule
+    """
+    yield ['#CommentsLine:'] + [''] * len(MoleculeNames)
+    yield ['Molecules'] + [f'{i}' for i in MoleculeNames]
+    yield ['Electron Numbers'] + [f'{float(i)}' for i in ENumbers]
+    yield ['knownMoleculesIonizationTypes'] + [f'{i}' for i in knownMoleculeIonizationTypes]
+    yield ['knownIonizationFactorsRelativeToN2'] + [f'{i}' for i in knownIonizationFactorsRelativeToN2]
+    yield ['SourceOfFragmentationPatterns'] + [f'{i}' for i in SourceOfFragmentationPatterns]
+    yield ['SourceOfIonizationData'] + [f'{i}' for i in SourceOfIonizationData]
+    yield ['Molecular Mass'] + [f'{float(i)}' for i in MWeights]
+
+def getExportTableRows(OverallArray, MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData, massRowsPerChunk=256):
+    """
+    This function generates the rows of the exported table one at a time, each as a list of cell strings, so that the table is never held in memory as a whole
+    INPUT: OverallArray and the metadata lists ( as for exportToCSV, all given ) | massRowsPerChunk ( number of m/z rows converted to text at a time )
+    OUTPUT: rows ( generator of lists of strings, one list per line of the table )
+    """
+    import numpy
+
+    yield from getExportHeaderRows(MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData)
+
+    if getattr(OverallArray, 'grid', None) is not None:
+        #Resampled spectra are written at every grid point and in full, they are not counts that can be truncated to integers
+        spectraArray = OverallArray.spectra
+        for chunkStart in range(0, len(OverallArray.grid), massRowsPerChunk):
+            chunkGrid = OverallArray.grid[chunkStart:chunkStart + massRowsPerChunk]
+            for gridValue, gridRow in zip(chunkGrid.tolist(), spectraArray[:, chunkStart:chunkStart + len(chunkGrid)].T.tolist()):
+                yield [str(gridValue)] + [str(value) for value in gridRow]
+        return
+
+    if isinstance(OverallArray, SparseSpectraMatrix):
+        #The peaks are sorted by m/z once, and each chunk of m/z rows is expanded to dense form on its own
+        massToCharges = OverallArray.massToCharges[:OverallArray.numberOfPeaks]
+        order = numpy.argsort(massToCharges, kind='stable')
+        sortedMassToCharges = massToCharges[order]
+        sortedIntensities = OverallArray.intensities[:OverallArray.numberOfPeaks][order]
+        sortedRowIndices = OverallArray.rowIndices()[order]
+        #Only the m/z values with an intensity for at least one molecule are written
+        distinctMassToCharges = numpy.unique(sortedMassToCharges)
+        for chunkStart in range(0, len(distinctMassToCharges), massRowsPerChunk):
+            chunkMassToCharges = distinctMassToCharges[chunkStart:chunkStart + massRowsPerChunk]
+            first = numpy.searchsorted(sortedMassToCharges, chunkMassToCharges[0], side='left')
+            last = numpy.searchsorted(sortedMassToCharges, chunkMassToCharges[-1], side='right')
+            chunk = numpy.zeros((len(chunkMassToCharges), len(OverallArray)))
+            chunk[numpy.searchsorted(chunkMassToCharges, sortedMassToCharges[first:last]), sortedRowIndices[first:last]] = sortedIntensities[first:last]
+            #int() truncates towards zero, and so does the conversion of the whole chunk to integers
+            for massToCharge, massRow in zip(chunkMassToCharges.tolist(), chunk.astype(numpy.int64).tolist()):
+                yield ['%d'%(massToCharge)] + [str(intensity) for intensity in massRow]
+        return
+
+    spectraArray = getSpectraArray(OverallArray) #(molecules x m/z), column i-1 holds m/z i
+    #Only the m/z values with an intensity for at least one molecule are written
+    massToCharges = numpy.flatnonzero(spectraArray.any(axis=0)) + 1
+    for chunkStart in range(0, len(massToCharges), massRowsPerChunk):
+        chunkMassToCharges = massToCharges[chunkStart:chunkStart + massRowsPerChunk]
+        #int() truncates towards zero, and so does the conversion of the whole chunk to integers
+        intensities = spectraArray[:, chunkMassToCharges - 1].T.astype(numpy.int64)
+        for massToCharge, massRow in zip(chunkMassToCharges.tolist(), intensities.tolist()):
+            yield ['%d'%(massToCharge)] + [str(intensity) for intensity in massRow]
+
+def exportToMultipleFiles(outputs, OverallArray, MoleculeNames=None, ENumbers=None, MWeights=None, knownMoleculeIonizationTypes=None, knownIonizationFactorsRelativeToN2=None, SourceOfFragmentationPatterns=None, SourceOfIonizationData=None, bufferSize=1024*1024):
+    """
+    This function writes the table of exportToCSV to several files at once, e.g. a ';' separated .csv and a tab separated .txt. The table is built once, one row at a time, and each row is written to every file through a buffered writer
+    INPUT: outputs ( list of (filename, delimeter) pairs. Example: [('OutputFiles\\ConvertedSpectra1.csv', ';'), ('OutputFiles\\ConvertedSpectraTable1.txt', '\t')] ) | OverallArray and the metadata lists ( as for exportToCSV ) | bufferSize ( bytes buffered per file before writing to disk )
+    """
+    if isinstance(OverallArray, (SpectraMatrix, SparseSpectraMatrix)):
+        if MoleculeNames is None: MoleculeNames = OverallArray.metadata['MoleculeNames']
+        if ENumbers is None: ENumbers = OverallArray.metadata['ENumbers']
+        if MWeights is None: MWeights = OverallArray.metadata['MWeights']
+        if knownMoleculeIonizationTypes is None: knownMoleculeIonizationTypes = OverallArray.metadata['knownMoleculeIonizationTypes']
+        if knownIonizationFactorsRelativeToN2 is None: knownIonizationFactorsRelativeToN2 = OverallArray.metadata['knownIonizationFactorsRelativeToN2']
+        if SourceOfFragmentationPatterns is None: SourceOfFragmentationPatterns = OverallArray.metadata['SourceOfFragmentationPatterns']
+        if SourceOfIonizationData is None: SourceOfIonizationData = OverallArray.metadata['SourceOfIonizationData']
+
+    writeTableRows(outputs, getExportTableRows(OverallArray, MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData), bufferSize)
+
+def writeTableRows(outputs, rows, bufferSize=1024*1024):
+    """
+    This function writes rows of cell strings to several files at once, each file with its own delimeter
+    INPUT: outputs ( list of (filename, delimeter) pairs, as for exportToMultipleFiles ) | rows ( iterable of lists of strings, e.g. from getExportTableRows ) | bufferSize ( as for exportToMultipleFiles )
+    """
+    import os
+
+    outputFiles = []
+    try:
+        for filename, delimeter in outputs:
+            os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+            outputFiles.append((open(filename, 'w', buffering=bufferSize), delimeter))
+
+        for row in rows:
+            for outputFile, delimeter in outputFiles:
+                outputFile.write(delimeter.join(row))
+                outputFile.write('\n')
+    finally:
+        for outputFile, delimeter in outputFiles:
+            outputFile.close()
+
+def exportToLongFormat(filename, OverallArray, MoleculeNames=None, delimeter=';', bufferSize=1024*1024):
+    """
+    This function writes the spectra in long form: a header line, then one line per nonzero peak with the molecule name, the m/z and the intensity. Unlike the table of exportToCSV its size grows with the number of peaks, not with molecules x m/z, and intensities are written in full rather than truncated to integers
+    If OverallArray is a SpectraMatrix or SparseSpectraMatrix and MoleculeNames is not given, its MoleculeNames column is used. For a SpectraMatrix with a grid, the grid values are written instead of m/z.
+    INPUT: filename ( Example: 'OutputFiles\\ConvertedSpectraPeaks1.csv' ) | OverallArray ( as for exportToCSV ) | MoleculeNames ( one name per spectrum ) | delimeter | bufferSize ( as for exportToMultipleFiles )
+    """
+    import os
+
+    if isinstance(OverallArray, (SpectraMatrix, SparseSpectraMatrix)) and MoleculeNames is None:
+        MoleculeNames = OverallArray.metadata['MoleculeNames']
+    grid = getattr(OverallArray, 'grid', None)
+    abscissaName = 'm/z' if grid is None else (OverallArray.gridUnits or 'x')
+    if not isinstance(OverallArray, SparseSpectraMatrix):
+        spectra = SparseSpectraMatrix(maximumAtomicUnit='auto')
+        spectra.extend(getSpectraArray(OverallArray))
+        OverallArray = spectra
+
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w', buffering=bufferSize) as outputFile:
+        outputFile.write(delimeter.join(['Molecule', abscissaName, 'Intensity']) + '\n')
+        for rowIndex in range(len(OverallArray)):
+            massToCharges, intensities = OverallArray.peaks(rowIndex)
+            if grid is not None:
+                massToCharges = grid[massToCharges - 1]
+            writeLongFormatPeaks(outputFile, MoleculeNames[rowIndex], massToCharges, intensities, delimeter)
+
+def writeLongFormatPeaks(outputFile, MoleculeName, massToCharges, intensities, delimeter=';'):
+    """
+    This function writes the lines of one molecule in the long form of exportToLongFormat, one line per peak
+    INPUT: outputFile ( open text file ) | MoleculeName | massToCharges, intensities ( numpy arrays of the peaks of the molecule ) | delimeter
+    """
+    prefix = f'{MoleculeName}{delimeter}'
+    for massToCharge, intensity in zip(massToCharges.tolist(), intensities.tolist()):
+        outputFile.write(f'{prefix}{massToCharge}{delimeter}{int(intensity) if intensity.is_integer() else repr(intensity)}\n')
+
+def exportToBinary(directoryName, OverallArray, MoleculeNames=None, ENumbers=None, MWeights=None, knownMoleculeIonizationTypes=None, knownIonizationFactorsRelativeToN2=None, SourceOfFragmentationPatterns=None, SourceOfIonizationData=None):
+    """
+    This function writes the spectra and the metadata of molecules in a binary form that loadFromBinary opens without parsing any text. The directory holds spectra.npy ( the (molecules x m/z) float64 array, readable with numpy.load ) and metadata.json ( the metadata columns, and the grid of resampled spectra )
+    If OverallArray is a SpectraMatrix, any metadata list that is not given is taken from its metadata columns.
+    INPUT: directoryName ( directory to write, created if needed. Example: 'OutputFiles\\ConvertedSpectra1.spectra' ) | OverallArray and the metadata lists ( as for exportToCSV )
+    """
+    import json
+    import os
+    import numpy
+
+    givenMetadata = {'MoleculeNames': MoleculeNames, 'ENumbers': ENumbers, 'MWeights': MWeights, 'knownMoleculeIonizationTypes': knownMoleculeIonizationTypes,
+                     'knownIonizationFactorsRelativeToN2': knownIonizationFactorsRelativeToN2, 'SourceOfFragmentationPatterns': SourceOfFragmentationPatterns, 'SourceOfIonizationData': SourceOfIonizationData}
+    spectraArray = getSpectraArray(OverallArray)
+    metadata = {}
+    for columnName in SpectraMetadataColumns:
+        column = givenMetadata[columnName]
+        if column is None and isinstance(OverallArray, (SpectraMatrix, SparseSpectraMatrix)):
+            column = OverallArray.metadata[columnName]
+        if column is None:
+            column = [''] * len(spectraArray)
+        #numpy scalars are stored as the python numbers they hold
+        metadata[columnName] = [datum.item() if isinstance(datum, numpy.generic) else datum for datum in column]
+
+    description = {'formatVersion': 1, 'numberOfSpectra': len(spectraArray), 'maximumAtomicUnit': spectraArray.shape[1], 'metadata': metadata}
+    if getattr(OverallArray, 'grid', None) is not None:
+        description['grid'] = OverallArray.grid.tolist()
+        description['gridUnits'] = OverallArray.gridUnits
+
+    os.makedirs(directoryName, exist_ok=True)
+    numpy.save(os.path.join(directoryName, 'spectra.npy'), numpy.ascontiguousarray(spectraArray, dtype=numpy.float64))
+    with open(os.path.join(directoryName, 'metadata.json'), 'w') as metadataFile:
+        json.dump(description, metadataFile)
+
+def loadFromBinary(directoryName, mmap_mode='r'):
+    """
+    This function opens spectra written by exportToBinary. The spectra are memory mapped by default, so opening a large library costs no more than reading its metadata, and rows are only read from disk when used
+    INPUT: directoryName ( directory written by exportToBinary ) | mmap_mode ( as for numpy.load: 'r' maps the spectra read-only, 'c' allows changes in memory only, None reads them fully into memory )
+    OUTPUT: AllSpectraData ( SpectraMatrix with the spectra and metadata columns. Appending to it copies the spectra into memory )
+    """
+    import json
+    import os
+    import numpy
+
+    with open(os.path.join(directoryName, 'metadata.json'), 'r') as metadataFile:
+        description = json.load(metadataFile)
+    if description.get('formatVersion') != 1:
+        raise ValueError(f"{directoryName} has format version {description.get('formatVersion')}, only version 1 can be read")
+    spectra = numpy.load(os.path.join(directoryName, 'spectra.npy'), mmap_mode=mmap_mode)
+    if spectra.shape != (description['numberOfSpectra'], description['maximumAtomicUnit']):
+        raise ValueError(f"{directoryName} has spectra of shape {spectra.shape} but its metadata describes {description['numberOfSpectra']} spectra of {description['maximumAtomicUnit']} m/z values")
+
+    AllSpectraData = SpectraMatrix(maximumAtomicUnit=description['maximumAtomicUnit'], initialCapacity=0, grid=description.get('grid'), gridUnits=description.get('gridUnits'))
+    AllSpectraData.buffer = spectra
+    AllSpectraData.numberOfSpectra = len(spectra)
+    for columnName in SpectraMetadataColumns:
+        AllSpectraData.metadata[columnName] = description['metadata'].get(columnName, [''] * len(spectra))
+    return AllSpectraData
 
 def takeInputAsList(molecule_name):
     """
@@ -308,17 +613,22 @@ def takeInputAsList(molecule_name):
         molecule_names.append(name)
     return molecule_names
 
-def getMetaDataForMoleculeFromOnline(molecule_name):
+def getMetaDataForMoleculeFromOnline(molecule_name, session=None):
     """
     This function takes in a specific molecule's name and return its meta data
-    INPUT: dataBase_data_holder_for_specific_molecule (Python list of metadata that we get from the database CSV File) | molecule_name ( name of the molecule which meta data will be returned )
+    INPUT: molecule_name ( name of the molecule which meta data will be returned ) | session ( optional NISTWebbook.WebbookSession, the shared default session is used if not given )
     OUTPUT: returns the molecular information of the specific molecule
     """
+    import NISTWebbook
+
+    if session is None:
+        session = NISTWebbook.getDefaultSession()
     try:
-        url = f'https://webbook.nist.gov/cgi/cbook.cgi?Name={molecule_name}&Units=SI'
+        url = session.moleculeURL(molecule_name)
 
-        molecular_formula = getMolecularFormula(url)
-        molecular_weight = getMolecularWeight(url)
+        #The formula and the weight come from the same parse of the molecule's page
+        molecular_formula = getMolecularFormula(url, session=session)
+        molecular_weight = getMolecularWeight(url, session=session)
         electron_numbers = getElectronNumbers(molecular_formula)
     except:
         molecular_formula = 'unknown'
@@ -330,29 +640,63 @@ def getMetaDataForMoleculeFromOnline(molecule_name):
 
     return molecular_formula,molecular_weight,electron_numbers
 
-def getSpectrumForMoleculeFromOnline(molecule_name):
+def getSpectrumForMoleculeFromOnline(molecule_name, session=None, maximumAtomicUnit=None):
     """
     This function will get the Spectrum data from Online source.
-    INPUT: molecule_name ( Specific Molecule's Name which spectrum data the user want from online )
+    INPUT: molecule_name ( Specific Molecule's Name which spectrum data the user want from online ) | session ( optional NISTWebbook.WebbookSession, the shared default session is used if not given ) | maximumAtomicUnit ( as for binSpectrum )
     OUTPUT: spectrum_data ( Data array containing the spectrum data from online ) | SourceOfFragmentationPattern ( As we are retrieving the data from online, it will be NIST Webbook in this case)
     """
-    url = f'https://webbook.nist.gov/cgi/cbook.cgi?Name={molecule_name}&Units=SI'
+    import JCampSG
+    import NISTWebbook
+
+    if session is None:
+        session = NISTWebbook.getDefaultSession()
+    url = session.moleculeURL(molecule_name)
 
     try:
-        mass_spectrum_url = getMassSpectrumURL(url)
-        jdx_download_url = getJDXDownloadURL(mass_spectrum_url)
-        jdx_filename = getJDX(jdx_download_url,molecule_name)
-        spectrum_data = getOverAllArray(jdx_filename)
+        mass_spectrum_url = getMassSpectrumURL(url, session=session)
+        jdx_download_url = getJDXDownloadURL(mass_spectrum_url, session=session)
+        jdx_filename = getJDX(jdx_download_url,molecule_name, session=session)
+        spectrum_data = createArray(JCampSG.JCAMP_reader(jdx_filename), maximumAtomicUnit=maximumAtomicUnit)
 
         SourceOfFragmentationPattern = 'NIST Webbook'
     except:
-        spectrum_data = [0] * MaximumAtomicUnit
+        spectrum_data = [0] * (MaximumAtomicUnit if maximumAtomicUnit is None else 0 if maximumAtomicUnit == 'auto' else maximumAtomicUnit)
         SourceOfFragmentationPattern = 'unknown'
 
         print(f'Spectrum data for {molecule_name} NOT FOUND in NIST Webbook. It is set to a blank list and SourceOfFragmentationPattern is set to unknown')
 
     return spectrum_data, SourceOfFragmentationPattern
 
+def getDataForMoleculesFromOnline(molecule_names, max_workers=8, session=None, fetchMetaData=True, fetchSpectrum=True):
+    """
+    This function resolves many molecules from the NIST Webbook at once on a bounded thread pool, all threads sharing one pooled and rate limited session
+    INPUT: molecule_names ( list of molecule names ) | max_workers ( number of molecules fetched concurrently ) | session ( optional NISTWebbook.WebbookSession, e.g. pointing at a local stand-in server. A session sized for max_workers is created if not given ) | fetchMetaData, fetchSpectrum ( which of the two lookups to run )
+    OUTPUT: results ( list in the order of molecule_names. Each entry is a dictionary with the returns of getMetaDataForMoleculeFromOnline under 'molecular_formula', 'molecular_weight', 'electron_numbers' and of getSpectrumForMoleculeFromOnline under 'spectrum_data', 'SourceOfFragmentationPattern' )
+    """
+    import concurrent.futures
+    import NISTWebbook
+
+    ownSession = session is None
+    if ownSession:
+        session = NISTWebbook.WebbookSession(maxConnections=max_workers)
+
+    def fetchOneMolecule(molecule_name):
+        result = {}
+        if fetchMetaData:
+            result['molecular_formula'], result['molecular_weight'], result['electron_numbers'] = getMetaDataForMoleculeFromOnline(molecule_name, session=session)
+        if fetchSpectrum:
+            result['spectrum_data'], result['SourceOfFragmentationPattern'] = getSpectrumForMoleculeFromOnline(molecule_name, session=session)
+        return result
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(fetchOneMolecule, molecule_names))
+    finally:
+        if ownSession:
+            session.close()
+    return results
+
 def readFromLocalDatabaseFile(localDatabaseFileName, delimeter=';'):
     """
     This function will take the local database csv file name and return its content in a python list type variable.
@@ -379,14 +723,189 @@ def readFromLocalDatabaseFile(localDatabaseFileName, delimeter=';'):
 def getDataIfMoleculeExists(databaseDataHolderList, molecule_name):
     """
     This function will search inside the databaseDataHolderList if a certain molecule_name exists or not
-    INPUT: databaseDataHolderList(contents in list format from MoleculesInfo.csv(default database csv file)) | molecule_name(user provided specific molecule's name)
+    INPUT: databaseDataHolderList(contents in list format from MoleculesInfo.csv(default database csv file), or a MoleculeDatabase, which finds the molecule through its index) | molecule_name(user provided specific molecule's name)
     OUTPUT: datum ( the data list of the specific molecule name. If not found then empty list will be returned)
     """
+    if isinstance(databaseDataHolderList, MoleculeDatabase):
+        return databaseDataHolderList.lookup(molecule_name)
     for datum in databaseDataHolderList:
         if(datum[0] == molecule_name): #The very first entry of each 1D list contains the Molecule Name inside the database file
             return datum
     return []
 
+def normalizeMoleculeName(molecule_name):
+    """
+    This function returns the form of a molecule name (or CAS number, or synonym) used as a key by MoleculeDatabase: lower case, with surrounding whitespace removed and inner runs of whitespace made single spaces. Example: '  Ethyl   Acetate ' -> 'ethyl acetate'
+    """
+    return ' '.join(molecule_name.split()).lower()
+
+class MoleculeDatabase:
+    """
+    This class holds the rows of a molecule database file ( e.g. MoleculesInfo.csv ) with a dictionary index from molecule names to rows, so that finding a molecule takes the same time however large the database is.
+    It can be used wherever the list returned by readFromLocalDatabaseFile is used: len(), indexing and iteration give the rows, the header row first.
+    Rows are split into fields only when they are first used, and columns only when they are first asked for.
+    Besides its exact name, a molecule is found by its normalized name ( see normalizeMoleculeName ) and by the values of its alias columns: 'CAS', 'CAS Number' or 'CAS Registry Number', and 'Synonyms' ( several synonyms separated by '|' ), when the database has them.
+    """
+
+    aliasColumnNames = ('CAS', 'CAS Number', 'CAS Registry Number', 'Synonyms')
+    synonymSeparator = '|'
+
+    def __init__(self, lines, delimeter=';'):
+        import csv
+
+        self.delimeter = delimeter
+        self.lines = lines
+        self.parsedRows = [None] * len(lines)
+        self.columns = {}
+        if any('"' in line for line in lines):
+            #Quoted fields may hold the delimeter, so the rows are parsed by the csv module now instead of being split when used
+            self.parsedRows = [row for row in csv.reader(lines, delimiter=delimeter)]
+        self.header = self[0] if lines else []
+
+        #The index: exact molecule names first, so that they always win over normalized names and aliases of other molecules
+        self.exactIndex = {}
+        self.normalizedIndex = {}
+        for rowIndex in range(1, len(lines)):
+            moleculeName = self.getMoleculeName(rowIndex)
+            if moleculeName is None:
+                continue
+            self.exactIndex.setdefault(moleculeName, rowIndex)
+            self.normalizedIndex.setdefault(normalizeMoleculeName(moleculeName), rowIndex)
+        for columnName in self.aliasColumnNames:
+            if columnName in self.header:
+                for rowIndex, aliases in enumerate(self.column(columnName), start=1):
+                    for alias in aliases.split(self.synonymSeparator):
+                        if alias.strip() != '':
+                            self.normalizedIndex.setdefault(normalizeMoleculeName(alias), rowIndex)
+
+    def __getstate__(self):
+        #A snapshot keeps the lines and the index, the rows are split again when used
+        state = dict(self.__dict__)
+        if not any('"' in line for line in self.lines):
+            state['parsedRows'] = None
+            state['columns'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.parsedRows is None:
+            self.parsedRows = [None] * len(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, rowIndex):
+        import csv
+
+        row = self.parsedRows[rowIndex]
+        if row is None:
+            line = self.lines[rowIndex]
+            row = next(csv.reader([line], delimiter=self.delimeter), [])
+            self.parsedRows[rowIndex] = row
+        return row
+
+    def __iter__(self):
+        for rowIndex in range(len(self.lines)):
+            yield self[rowIndex]
+
+    def getMoleculeName(self, rowIndex):
+        #The molecule name is the first field. It is taken without parsing the whole row unless the row is already parsed
+        row = self.parsedRows[rowIndex]
+        if row is not None:
+            return row[0] if row else None
+        line = self.lines[rowIndex]
+        return line.split(self.delimeter, 1)[0] if line != '' else None
+
+    def lookup(self, molecule_name):
+        """
+        This function finds a molecule by its name, normalized name, CAS number or synonym
+        INPUT: molecule_name ( name, CAS number or synonym of the molecule )
+        OUTPUT: datum ( the row of the molecule, or an empty list if it is not in the database, as for getDataIfMoleculeExists )
+        """
+        rowIndex = self.exactIndex.get(molecule_name)
+        if rowIndex is None:
+            rowIndex = self.normalizedIndex.get(normalizeMoleculeName(molecule_name))
+        if rowIndex is None:
+            return []
+        return self[rowIndex]
+
+    def __contains__(self, molecule_name):
+        return self.lookup(molecule_name) != []
+
+    def addAlias(self, alias, molecule_name):
+        """
+        This function makes a molecule of the database also found by another name
+        INPUT: alias ( other name, CAS number or synonym ) | molecule_name ( a name under which the molecule is already found )
+        """
+        rowIndex = self.exactIndex.get(molecule_name)
+        if rowIndex is None:
+            rowIndex = self.normalizedIndex.get(normalizeMoleculeName(molecule_name))
+        if rowIndex is None:
+            raise KeyError(f'{molecule_name} is not in the database')
+        self.normalizedIndex[normalizeMoleculeName(alias)] = rowIndex
+
+    def moleculeNames(self):
+        """
+        This function returns the names of all the molecules, in the order of the database file, without parsing their rows
+        """
+        return [self.getMoleculeName(rowIndex) for rowIndex in range(1, len(self.lines)) if self.getMoleculeName(rowIndex) is not None]
+
+    def column(self, columnName):
+        """
+        This function returns the values of one column for all the molecules, in the order of the database file. A column is extracted the first time it is asked for and then kept
+        INPUT: columnName ( name of the column in the header row. Example: 'Electrons' )
+        OUTPUT: values ( list of strings, '' for rows that are too short )
+        """
+        import csv
+
+        if columnName not in self.columns:
+            columnIndex = self.header.index(columnName)
+            if None in self.parsedRows:
+                #A whole column needs every row, and the csv module splits all of them much faster in one call than one by one
+                self.parsedRows = [row for row in csv.reader(self.lines, delimiter=self.delimeter)]
+            values = []
+            for rowIndex in range(1, len(self.lines)):
+                row = self[rowIndex]
+                values.append(row[columnIndex] if columnIndex < len(row) else '')
+            self.columns[columnName] = values
+        return self.columns[columnName]
+
+def loadMoleculeDatabase(localDatabaseFileName, delimeter=';', snapshotFileName=None):
+    """
+    This function reads a molecule database file into a MoleculeDatabase.
+    INPUT: localDatabaseFileName ( as for readFromLocalDatabaseFile ) | delimeter ( as for readFromLocalDatabaseFile ) | snapshotFileName ( optional file keeping a binary snapshot of the database. It is used instead of the database file while the database file keeps the modification time and size it had when the snapshot was written, and rewritten otherwise )
+    OUTPUT: database ( MoleculeDatabase )
+    """
+    import os
+    import pickle
+
+    databaseFileStatus = os.stat(localDatabaseFileName)
+    databaseFileVersion = (databaseFileStatus.st_mtime_ns, databaseFileStatus.st_size, delimeter)
+    if snapshotFileName is not None and os.path.exists(snapshotFileName):
+        try:
+            with open(snapshotFileName, 'rb') as snapshotFile:
+                snapshot = pickle.load(snapshotFile)
+            if snapshot.get('databaseFileVersion') == databaseFileVersion:
+                return snapshot['database']
+        except (pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+            pass #An unreadable snapshot is rewritten below
+
+    #Same encodings as readFromLocalDatabaseFile
+    if ('.txt' in localDatabaseFileName) or ('.tab' in localDatabaseFileName):
+        encoding = 'utf-16'
+    else:
+        encoding = None
+    with open(localDatabaseFileName, encoding=encoding) as databaseFile:
+        lines = databaseFile.read().split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    database = MoleculeDatabase(lines, delimeter=delimeter)
+
+    if snapshotFileName is not None:
+        with open(snapshotFileName, 'wb') as snapshotFile:
+            pickle.dump({'databaseFileVersion': databaseFileVersion, 'database': database}, snapshotFile, protocol=pickle.HIGHEST_PROTOCOL)
+    return database
+
 def checkInLocalJDXDirectory(localJDXFileDirectory, molecule_name):
     """
     This function will check inside the local directory where the JDX files are being kept if a particular molecule's JDX data exists there or not.
@@ -403,6 +922,193 @@ def checkInLocalJDXDirectory(localJDXFileDirectory, molecule_name):
                 return True
     return False
 
+def readJDXHeaderFields(JDXFileName):
+    """
+    This function reads the ##TITLE and ##CAS REGISTRY NO of a JDX file from its header, without reading the spectrum data
+    INPUT: JDXFileName ( path+filename of the JDX file )
+    OUTPUT: title, casNumber ( strings, '' when the header does not have them. Example: 'Ethanol', '64-17-5' )
+    """
+    title = ''
+    casNumber = ''
+    with open(JDXFileName, 'r', errors='replace') as JDXFile:
+        for line in JDXFile:
+            if not line.startswith('##'):
+                continue
+            label, _, value = line[2:].partition('=')
+            label = label.strip().upper()
+            if label == 'TITLE' and title == '':
+                title = value.strip()
+            elif label == 'CAS REGISTRY NO' and casNumber == '':
+                casNumber = value.strip()
+            elif label in ('XYDATA', 'XYPOINTS', 'PEAK TABLE', 'END'):
+                break
+    return title, casNumber
+
+#File in which a conversion keeps the JDXDirectoryIndex between runs, in the output directory so the JDX directory is only read
+JDXDirectoryIndexFileName = 'JDXDirectoryIndex.json'
+
+class JDXDirectoryIndex:
+    """
+    This class lists a JDX directory once with os.scandir and finds a molecule's JDX file by its file name ( without '.jdx' ), its ##TITLE or its ##CAS REGISTRY NO, all compared after normalizeMoleculeName.
+    With an indexFileName the index is saved, and later runs only read the headers of the JDX files whose modification time or size changed since.
+    INPUT: directory ( JDX directory. Example: 'JDXFiles//' ) | indexFileName ( optional JSON file where the index is kept between runs )
+    """
+
+    def __init__(self, directory, indexFileName=None):
+        self.directory = directory
+        self.indexFileName = indexFileName
+        self.fileNames = set() #Every file of the directory, JDX or not
+        self.files = {} #JDX file name -> [modification time in ns, size in bytes, title, CAS number]
+        self.paths = {}
+        self.headersRead = 0
+        self.load()
+        self.refresh()
+
+    def load(self):
+        import json
+        import os
+
+        if self.indexFileName is None or not os.path.exists(self.indexFileName):
+            return
+        try:
+            with open(self.indexFileName, 'r') as indexFile:
+                savedIndex = json.load(indexFile)
+        except ValueError:
+            return #An unreadable index is rebuilt
+        #An index file saved for another directory is rebuilt too
+        if savedIndex.get('formatVersion') == 1 and savedIndex.get('directory', os.path.abspath(self.directory)) == os.path.abspath(self.directory):
+            self.files = savedIndex['files']
+
+    def save(self):
+        import json
+        import os
+
+        if self.indexFileName is None:
+            return
+        os.makedirs(os.path.dirname(self.indexFileName) or '.', exist_ok=True)
+        with open(self.indexFileName, 'w') as indexFile:
+            json.dump({'formatVersion': 1, 'directory': os.path.abspath(self.directory), 'files': self.files}, indexFile)
+
+    def refresh(self):
+        """
+        This function lists the directory again, reads the headers of new and changed JDX files, forgets removed ones and saves the index if it has an indexFileName
+        """
+        import os
+
+        self.fileNames = set()
+        files = {}
+        changed = False
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as directoryEntries:
+                for directoryEntry in directoryEntries:
+                    if not directoryEntry.is_file():
+                        continue
+                    self.fileNames.add(directoryEntry.name)
+                    if not directoryEntry.name.lower().endswith('.jdx'):
+                        continue
+                    status = directoryEntry.stat()
+                    known = self.files.get(directoryEntry.name)
+                    if known is not None and known[0] == status.st_mtime_ns and known[1] == status.st_size:
+                        files[directoryEntry.name] = known
+                        continue
+                    title, casNumber = readJDXHeaderFields(directoryEntry.path)
+                    self.headersRead = self.headersRead + 1
+                    files[directoryEntry.name] = [status.st_mtime_ns, status.st_size, title, casNumber]
+                    changed = True
+        changed = changed or (len(files) != len(self.files))
+        self.files = files
+
+        #File names are looked up first, then titles, then CAS numbers. Files are taken in name order so the result does not depend on the listing order
+        self.paths = {}
+        for field in (None, 2, 3):
+            for fileName in sorted(files):
+                key = os.path.splitext(fileName)[0] if field is None else files[fileName][field]
+                if key != '':
+                    self.paths.setdefault(normalizeMoleculeName(key), os.path.join(self.directory, fileName))
+        if changed:
+            self.save()
+
+    def find(self, molecule_name):
+        """
+        This function returns the path of a molecule's JDX file
+        INPUT: molecule_name ( file name without '.jdx', title or CAS number of the molecule )
+        OUTPUT: path ( path of the JDX file, or None if there is none )
+        """
+        return self.paths.get(normalizeMoleculeName(molecule_name))
+
+    def __contains__(self, fileName):
+        #True if the directory has a file of that name, as for fileName in os.listdir(directory)
+        return fileName in self.fileNames
+
+def getJDXDirectoryIndex(JDXFilesLocation, outputFileDirectoryPath, indexFileName=None):
+    """
+    This function returns the JDXDirectoryIndex of the local JDX directory of a conversion. The index is kept in indexFileName, by default JDXDirectoryIndexFileName in the output directory. It is not kept if the JDX directory does not exist
+    INPUT: JDXFilesLocation ( local JDX directory ) | outputFileDirectoryPath ( directory of the output files ) | indexFileName ( optional JSON file where the index is kept between runs )
+    OUTPUT: JDXDirectory ( JDXDirectoryIndex )
+    """
+    import os
+
+    if not os.path.isdir(JDXFilesLocation):
+        indexFileName = None
+    elif indexFileName is None:
+        indexFileName = os.path.join(outputFileDirectoryPath, JDXDirectoryIndexFileName)
+    return JDXDirectoryIndex(JDXFilesLocation, indexFileName=indexFileName)
+
+def getJDXFileVersion(JDXFileName, previousVersion=None):
+    """
+    This function returns what identifies the content of a JDX file for an incremental rebuild. The file is only hashed again if its modification time or size differ from previousVersion, so an unchanged file is not read
+    INPUT: JDXFileName ( path+filename of the JDX file ) | previousVersion ( optional version returned by an earlier call for the same file )
+    OUTPUT: version ( [modification time in ns, size in bytes, SHA-256 hash of the content as a hex string] )
+    """
+    import hashlib
+    import os
+
+    status = os.stat(JDXFileName)
+    if previousVersion is not None and previousVersion[0] == status.st_mtime_ns and previousVersion[1] == status.st_size:
+        return list(previousVersion)
+    contentHash = hashlib.sha256()
+    with open(JDXFileName, 'rb') as JDXFile:
+        for block in iter(lambda: JDXFile.read(1024*1024), b''):
+            contentHash.update(block)
+    return [status.st_mtime_ns, status.st_size, contentHash.hexdigest()]
+
+def loadConvertedLibrary(libraryDirectory, conversionSettings):
+    """
+    This function opens the converted spectra kept by saveConvertedLibrary for an incremental rebuild
+    INPUT: libraryDirectory ( directory written by saveConvertedLibrary ) | conversionSettings ( dictionary of the settings of this run. If they differ from the settings of the stored library, the library is not used )
+    OUTPUT: previousSpectra ( SpectraMatrix, or None if there is no usable library ) | previousMolecules ( dictionary from molecule name to its manifest entry, with the 'row' of the molecule in previousSpectra, its 'databaseRow', its 'JDXFile' ( path or None ), 'JDXFileVersion' ( see getJDXFileVersion, or None ) and 'stale' ( True if an online lookup of the molecule failed, so it is converted again ) )
+    """
+    import json
+    import os
+
+    manifestFileName = os.path.join(libraryDirectory, 'manifest.json')
+    if not os.path.exists(manifestFileName):
+        return None, {}
+    try:
+        with open(manifestFileName, 'r') as manifestFile:
+            manifest = json.load(manifestFile)
+        if manifest.get('formatVersion') != 1 or manifest.get('conversionSettings') != conversionSettings:
+            return None, {}
+        #Read into memory rather than memory mapped, since saveConvertedLibrary overwrites the files at the end of the run
+        return loadFromBinary(libraryDirectory, mmap_mode=None), manifest['molecules']
+    except (ValueError, OSError, KeyError):
+        return None, {} #A damaged library means a full rebuild
+
+def saveConvertedLibrary(libraryDirectory, AllSpectra, moleculeEntries, conversionSettings):
+    """
+    This function keeps the converted spectra and a manifest of what they were converted from, for the next incremental rebuild
+    INPUT: libraryDirectory ( directory to write ) | AllSpectra ( SpectraMatrix of the run ) | moleculeEntries ( dictionary from molecule name to its manifest entry, see loadConvertedLibrary ) | conversionSettings ( dictionary of the settings of the run )
+    """
+    import json
+    import os
+
+    exportToBinary(libraryDirectory, AllSpectra)
+    #The manifest is written last, so an interrupted save leaves no manifest describing spectra it does not match
+    temporaryManifestFileName = os.path.join(libraryDirectory, 'manifest.json.tmp')
+    with open(temporaryManifestFileName, 'w') as manifestFile:
+        json.dump({'formatVersion': 1, 'conversionSettings': conversionSettings, 'molecules': moleculeEntries}, manifestFile)
+    os.replace(temporaryManifestFileName, os.path.join(libraryDirectory, 'manifest.json'))
+
 def takeMoleculeNamesInputFromUser (DataBase_data_holder):
     """
     This function will prompt the user to continuosly input molecule names and later it will process the inputs and return the total list of molecule names
@@ -502,7 +1208,7 @@ def startCommandLine(dataBaseFileName='MoleculesInfo.csv'):
     knownIonizationFactorsRelativeToN2 = list()
     filenames=''
     listOfFiles=list()
-    AllSpectra=[]
+    AllSpectra=SpectraMatrix()
     individual_spectrum=[]
     DataBase_data_holder=[]
     
@@ -534,8 +1240,7 @@ def startCommandLine(dataBaseFileName='MoleculesInfo.csv'):
                 MWeights.append(molecular_weight)   
                 ENumbers.append(electron_numbers)
 
-                individual_spectrum.extend(spectrum_data)
-                AllSpectra = combineArray(AllSpectra , individual_spectrum)
+                AllSpectra = combineArray(AllSpectra , spectrum_data)
 
                 print(f"RETRIEVED {moleculeName} from NIST WebBook")
  
@@ -632,29 +1337,14 @@ def startCommandLine(dataBaseFileName='MoleculesInfo.csv'):
 
     exportToCSV("%s\\ConvertedSpectra.csv" %outputDirectory, AllSpectra,  MoleculeNames, ENumbers, MWeights, knownMoleculeIonizationTypes, knownIonizationFactorsRelativeToN2, SourceOfFragmentationPatterns, SourceOfIonizationData)
 
-def startCommandLineInterface(dataBaseFileName='MoleculesInfo.csv', JDXFilesLocation='JDXFiles//', delimeter=","):
+def startCommandLineInterface(dataBaseFileName='MoleculesInfo.csv', JDXFilesLocation='JDXFiles//', delimeter=",", incremental=False):
     """
     This function will start the JDX Converter application and handle the user/app flow. #TODO: The function name will be renamed later accordingly.
+    With incremental=True the converted spectra are also kept in OutputFiles\\ConvertedSpectraLibrary with a manifest, and the next incremental run only converts the molecules whose database row or JDX file changed, taking the others from the library.
+    When Instrumentation is enabled ( JDX_INSTRUMENTATION=1 ), a summary of the time taken by each stage is printed at the end.
     """
     import os
-
-    #Initialized some variable variable
-    SourceOfFragmentationPattern = ''
-    SourcesOfFragmentationPattern = list()
-    SourceOfIonizationDatum = ''
-    SourceOfIonizationData = list()
-    ENumber = 0
-    ENumbers =list()
-    MWeight =0.0 
-    MWeights=list()
-    knownMoleculeIonizationType = ''
-    knownMoleculeIonizationTypes = list()
-    knownIonizationFactorRelativeToN2 = 0.0
-    knownIonizationFactorsRelativeToN2 = list()
-    JDXfilename=''
-    listOfJDXFileNames=list()
-    AllSpectra=[]
-    individual_spectrum=[]
+    import Instrumentation
 
     MoleculeNames=list()
     DataBase_data_holder=[]
@@ -680,137 +1370,516 @@ def startCommandLineInterface(dataBaseFileName='MoleculesInfo.csv', JDXFilesLoca
 
     #Reading the information from database file
     #print(f"LOADING Information from {dataBaseFileName}")
-    DataBase_data_holder = readFromLocalDatabaseFile(dataBaseFileName, delimeter=delimeter) #This variable will contain the full list or data of the CSV file in the link : https://github.com/AdityaSavara/JDX_Converter/blob/master/MoleculesInfo.csv
+    with Instrumentation.stage('database load'):
+        DataBase_data_holder = loadMoleculeDatabase(dataBaseFileName, delimeter=delimeter) #This variable will contain the full list or data of the CSV file in the link : https://github.com/AdityaSavara/JDX_Converter/blob/master/MoleculesInfo.csv, indexed by molecule name
    
     #Starting text for the application , also instructions for the User to start
     MoleculeNames = takeMoleculeNamesInputFromUser(DataBase_data_holder) #MoleculeNames is a list of molecule names, provided by the user. The DataBase_data_holder is passed into this function in case the user wants to convert all the molecules from the database.
-    
-    for moleculeName in MoleculeNames:    
-        JDXfilename = moleculeName #Default value for JDXFilename will be the molecule name, if the database has a filename specified inside it, we will replace it later.
-        #Getting the Data list if the Molecule name exists inside the database CSV file
-        molecule_meta_data_from_database = getDataIfMoleculeExists(DataBase_data_holder , moleculeName) #getDataIfMoleculeExists will return the existing metadata inside the database_data_holder
 
-        molecule_final_meta_data = [''] * 8 # Indices will contain , 0: moleculeName, 1: ENumber, 2: MWeight, 3: JDXFileName , 4: knownMoleculesIonizationTypes, 5: knownIonizationFactorsRelativeToN2, 6: SourceOfFragmentationPatterns, 7: SourceOfIonizationData
-        molecule_final_meta_data_status = [False] * 8
+    outputFileNames = convertMolecules(MoleculeNames, DataBase_data_holder, JDXFilesLocation=JDXFilesLocation, outputFileDirectoryPath=outputFileDirectoryPath, incremental=incremental)
+
+    #Now this function will terminate showing the user where the output has been written
+    print(f"Conversion complete: outputs written in {os.path.join(outputFileDirectoryPath, outputFileNames['csv'])}, {os.path.join(outputFileDirectoryPath, outputFileNames['txt'])}, and {os.path.join(outputFileDirectoryPath, outputFileNames['tab'])}")
+    if Instrumentation.enabled:
+        print(Instrumentation.summary())
+
+#Output formats of convertMolecules and exportToOutputFormats: format -> ( expected file name, file extension, delimeter, None for the binary format of exportToBinary ). 'long' is the one peak per line format of exportToLongFormat, the others with a delimeter are the table of exportToCSV
+OutputFormats = {'csv': ('ConvertedSpectra.csv', '.csv', ';'),
+                 'txt': ('ConvertedSpectraTable.txt', '.txt', '\t'),
+                 'tab': ('ConvertedSpectraTable.tab', '.tab', '\t'),
+                 'long': ('ConvertedSpectraPeaks.csv', '.csv', ';'),
+                 'binary': ('ConvertedSpectraBinary.spectra', '.spectra', None)}
+
+def exportToOutputFormats(outputFileDirectoryPath, AllSpectra, outputFormats=('csv', 'txt', 'tab')):
+    """
+    This function writes AllSpectra to the next free file name of each output format in outputFileDirectoryPath
+    INPUT: outputFileDirectoryPath ( directory of the output files, created if needed ) | AllSpectra ( SpectraMatrix or SparseSpectraMatrix with its metadata columns ) | outputFormats ( any of the keys of OutputFormats )
+    OUTPUT: outputFileNames ( dictionary format -> name of the file written in outputFileDirectoryPath )
+    """
+    import os
+    import Instrumentation
 
-        #Now We will check if the molecule's data exist inside the database file
+    #mkaing the directory for exported files, if it isn't already there
+    if not os.path.exists(outputFileDirectoryPath):
+        os.makedirs(outputFileDirectoryPath)
+   
+    #Now we will get the appropriate file name for the output. The OutputFiles will have a number at the end which is 1 or higher and the lowest number will be used.
+    outputFileNames = {}
+    for outputFormat in outputFormats:
+        expectedFileName, fileExtension, delimeter = OutputFormats[outputFormat]
+        outputFileNames[outputFormat] = getOutputFileName(outputFileDirectoryPath, expectedFileName=expectedFileName, fileExtension=fileExtension)
+
+    #Now we will write all the metadata and spectrum data to the csv, txt and tab files in one pass
+    textOutputs = [(os.path.join(outputFileDirectoryPath, outputFileNames[outputFormat]), OutputFormats[outputFormat][2]) for outputFormat in outputFormats if OutputFormats[outputFormat][2] is not None and outputFormat != 'long']
+    with Instrumentation.stage('export'):
+        if textOutputs:
+            exportToMultipleFiles(textOutputs, AllSpectra)
+        if 'long' in outputFormats:
+            exportToLongFormat(os.path.join(outputFileDirectoryPath, outputFileNames['long']), AllSpectra, delimeter=OutputFormats['long'][2])
+        if 'binary' in outputFormats:
+            exportToBinary(os.path.join(outputFileDirectoryPath, outputFileNames['binary']), AllSpectra)
+
+    return outputFileNames
+
+def readDatabaseMetaData(molecule_meta_data_from_database):
+    """
+    This function sorts the values of a molecule's row of the database file into known ones and blank or unknown ones
+    INPUT: molecule_meta_data_from_database ( row of the database file, as returned by getDataIfMoleculeExists )
+    OUTPUT: molecule_final_meta_data ( the 8 values of the row, '' where they are not known ) | molecule_final_meta_data_status ( False for each value that is not known )
+    """
+    molecule_final_meta_data = [''] * 8 # Indices will contain , 0: moleculeName, 1: ENumber, 2: MWeight, 3: JDXFileName , 4: knownMoleculesIonizationTypes, 5: knownIonizationFactorsRelativeToN2, 6: SourceOfFragmentationPatterns, 7: SourceOfIonizationData
+    molecule_final_meta_data_status = [False] * 8
+
+    #Now we will check if any of the values inside the database is blank or unknown
+    for datum in molecule_meta_data_from_database:
+        metadata_index = molecule_meta_data_from_database.index(datum)
+        if(datum == '' or datum == 'unknown'):
+            molecule_final_meta_data_status[metadata_index] = False
+        else:
+            molecule_final_meta_data[metadata_index] = datum
+            molecule_final_meta_data_status[metadata_index] = True
+    return molecule_final_meta_data, molecule_final_meta_data_status
+
+def isDatabaseMetaDataComplete(molecule_meta_data_from_database):
+    """
+    This function tells if completeDatabaseMetaData can complete a molecule's row of the database file without looking up the molecule online
+    """
+    return False not in readDatabaseMetaData(molecule_meta_data_from_database)[1]
+
+def completeDatabaseMetaData(molecule_meta_data_from_database, moleculeName, onlineMetaData=None):
+    """
+    This function fills in the blank or unknown values of a molecule's row of the database file. The electron number and the molecular weight are retrieved from online, the other values are set to 'unknown'
+    INPUT: molecule_meta_data_from_database ( row of the database file, as returned by getDataIfMoleculeExists ) | moleculeName | onlineMetaData ( optional, what getMetaDataForMoleculeFromOnline returns for the molecule, if it was already looked up )
+    OUTPUT: ENumber | MWeight | knownMoleculeIonizationType | knownIonizationFactorRelativeToN2 | SourceOfIonizationDatum
+    """
+    molecule_final_meta_data, molecule_final_meta_data_status = readDatabaseMetaData(molecule_meta_data_from_database)
+
+    #Now we will check if the Unknown values are retrievable from online or not
+    if False in molecule_final_meta_data_status:
+        #We will only try to retrieve the data from online only if they are retrievable from online. Such data exist inside the first 3 indices.
+        #We will consider the data after index three is not retrievable from online.
+        if onlineMetaData is None:
+            onlineMetaData = getMetaDataForMoleculeFromOnline(moleculeName)
+        molecular_formula_online , Mass_online, Electrons_online = onlineMetaData
+        for index in range(1,8): #looping over the indices of the data/metadata, index 0 is skipped because that is the molecule name
+            if((index == 1) and (molecule_final_meta_data_status[index] == False)):
+                molecule_final_meta_data[index] = Electrons_online
+            elif(index == 2 and (molecule_final_meta_data_status[index] == False)):
+                molecule_final_meta_data[index] = Mass_online
+            elif(molecule_final_meta_data_status[index] == False):
+                molecule_final_meta_data[index] = 'unknown'
+
+    #This block will populate the necessary variables with the metadata from the database CSV file
+    #The electron number and the molecular weight are 0 if they could not be found online either
+    ENumber = int(molecule_final_meta_data[1]) if molecule_final_meta_data[1] != 'unknown' else 0
+    MWeight = float(molecule_final_meta_data[2]) if molecule_final_meta_data[2] != 'unknown' else 0
+    knownMoleculeIonizationType = molecule_final_meta_data[4]
+    knownIonizationFactorRelativeToN2 = molecule_final_meta_data[5]
+    SourceOfIonizationDatum = molecule_final_meta_data[7]
+    return ENumber, MWeight, knownMoleculeIonizationType, knownIonizationFactorRelativeToN2, SourceOfIonizationDatum
+
+def convertMolecules(MoleculeNames, DataBase_data_holder, JDXFilesLocation='JDXFiles//', outputFileDirectoryPath='OutputFiles', outputFormats=('csv', 'txt', 'tab'), max_workers=None, incremental=False, maximumAtomicUnit=None, indexFileName=None):
+    """
+    This function converts the molecules and writes the output files without asking anything. It is what startCommandLineInterface does once it has its answers, and what the convert command of main runs
+    INPUT: MoleculeNames ( list of molecule names ) | DataBase_data_holder ( MoleculeDatabase or list of rows of the database file ) | JDXFilesLocation ( local JDX directory ) | outputFileDirectoryPath ( directory of the output files ) | outputFormats ( any of the keys of OutputFormats ) | max_workers ( number of processes converting local JDX files, the number of CPUs if not given ) | incremental ( see startCommandLineInterface ) | maximumAtomicUnit ( largest m/z kept, MaximumAtomicUnit if not given. With 'auto' the m/z range is taken from the spectra, so heavier molecules are not truncated ) | indexFileName ( JSON file keeping the JDXDirectoryIndex of JDXFilesLocation, JDXDirectoryIndexFileName in outputFileDirectoryPath if not given )
+    OUTPUT: outputFileNames ( dictionary from output format to the name of the file written in outputFileDirectoryPath. Example: {'csv': 'ConvertedSpectra1.csv'} )
+    """
+    import os
+    import time
+    import Instrumentation
+    import StreamingConversion
+
+    #Initialized some variable variable
+    JDXfilename=''
+    listOfJDXFileNames=list()
+    if maximumAtomicUnit is None:
+        maximumAtomicUnit = MaximumAtomicUnit
+    AllSpectra=SparseSpectraMatrix(maximumAtomicUnit=maximumAtomicUnit) #Holds the peaks and the metadata columns of every converted molecule, expanded to the m/z rows of the table only at export
+    individual_spectrum=[]
+
+    #Converting every local JDX file that will be needed in one parallel batch, before going through the molecules one by one
+    #The JDX directory is listed once, and only the headers of files changed since the last run are read
+    with Instrumentation.stage('directory index'):
+        JDXDirectory = getJDXDirectoryIndex(JDXFilesLocation, outputFileDirectoryPath, indexFileName)
+    moleculeJDXFiles = {} #molecule name -> local JDX file of the molecule, or None
+    for moleculeName in MoleculeNames:
+        moleculeJDXFiles[moleculeName] = None
+        molecule_meta_data_from_database = getDataIfMoleculeExists(DataBase_data_holder , moleculeName)
         if (len(molecule_meta_data_from_database) != 0):
-            #Molecule FOUND inside the DATABASE FILE
-            #TODO: Populating these variables can be a function itself
-            
-            #Now we will check if there's a jdx filename specified inside the database CSV file for the molecule
             filenameFromDatabase = molecule_meta_data_from_database[3].strip()
-            if(filenameFromDatabase != ''):
-                if(filenameFromDatabase in os.listdir(JDXFilesLocation)):
-                    JDXfilename = JDXFilesLocation + filenameFromDatabase
-                    individual_spectrum = getSpectrumDataFromLocalJDX([JDXfilename])
-                    SourceOfFragmentationPattern = molecule_meta_data_from_database[6]
-                else:
-                    #This line will get all the data from online along with the individual spectrum data for the molecule. However we will only use the Spectrum data in this case
-                    spectrum_data, SourceOfFragmentationPatternOnline = getSpectrumForMoleculeFromOnline(moleculeName)
-                    individual_spectrum = spectrum_data
-                    SourceOfFragmentationPattern = SourceOfFragmentationPatternOnline
-
-            #Now we will check if any of the values inside the database is blank or unknown
-            for datum in molecule_meta_data_from_database:
-                metadata_index = molecule_meta_data_from_database.index(datum)
-                if(datum == '' or datum == 'unknown'):
-                    molecule_final_meta_data_status[metadata_index] = False
-                else:
-                    molecule_final_meta_data[metadata_index] = datum
-                    molecule_final_meta_data_status[metadata_index] = True
-
-            #Now we will check if the Unknown values are retrievable from online or not
-            if False in molecule_final_meta_data_status:
-                #We will only try to retrieve the data from online only if they are retrievable from online. Such data exist inside the first 3 indices.
-                #We will consider the data after index three is not retrievable from online.
-                molecular_formula_online , Mass_online, Electrons_online = getMetaDataForMoleculeFromOnline(moleculeName)
-                for index in range(1,8): #looping over the indices of the data/metadata, index 0 is skipped because that is the molecule name
-                    if((index == 1) and (molecule_final_meta_data_status[index] == False)):
-                        molecule_final_meta_data[index] = Electrons_online
-                    elif(index == 2 and (molecule_final_meta_data_status[index] == False)):
-                        molecule_final_meta_data[index] = Mass_online
-                    elif(molecule_final_meta_data_status[index] == False):
-                        molecule_final_meta_data[index] = 'unknown'
-
-            #This block will populate the necessary variables with the metadata from the database CSV file
-            ENumber = int(molecule_final_meta_data[1])
-            MWeight = float(molecule_final_meta_data[2])
-            knownMoleculeIonizationType = molecule_final_meta_data[4]
-            knownIonizationFactorRelativeToN2 = molecule_final_meta_data[5]
-            SourceOfIonizationDatum = molecule_final_meta_data[7]
-
-        #Now we will check if the corresponding JDX file for the molecule exists in the local directory or not
-        elif(checkInLocalJDXDirectory(JDXFilesLocation, JDXfilename)):
-            #Now we will retrieve the spectrum information from the local JDX file
-            JDXFilePathWithName = JDXFilesLocation + JDXfilename
-            individual_spectrum = getSpectrumDataFromLocalJDX([JDXFilePathWithName])
-            
-            #As the metadata for the molecule is not present inside the database csv file, we will now retrieve them from online
-            molecular_formula,molecular_weight,electron_number = getMetaDataForMoleculeFromOnline(moleculeName)
-            ENumber = int(electron_number)
-            MWeight = float(molecular_weight)
-            knownMoleculeIonizationType = 'unknown'
-            knownIonizationFactorRelativeToN2 = 'unknown'
-            SourceOfFragmentationPattern = SourceOfFragmentationPatternOnline
-            SourceOfIonizationDatum = 'unknown'
-
-        #Otherwise we will get all the metadata + spectrum data from online
-        else:
-            molecular_formula,molecular_weight,electron_number = getMetaDataForMoleculeFromOnline(moleculeName)
-            spectrum_data, SourceOfFragmentationPatternOnline = getSpectrumForMoleculeFromOnline(moleculeName)
-            
-            if electron_number is not 'unknown':
-                ENumber = int(electron_number)
-            else:
-                ENumber = 0
-            
-            if molecular_weight is not 'unknown':
-                MWeight = float(molecular_weight)
-            else:
-                MWeight = 0
+            if(filenameFromDatabase != '' and filenameFromDatabase in JDXDirectory):
+                moleculeJDXFiles[moleculeName] = os.path.join(JDXFilesLocation, filenameFromDatabase)
+        elif(JDXDirectory.find(moleculeName) is not None):
+            moleculeJDXFiles[moleculeName] = JDXDirectory.find(moleculeName)
+
+    #In incremental mode, a molecule converted by the last run with the same database row, the same JDX file content and the same settings keeps its stored row
+    libraryDirectory = os.path.join(outputFileDirectoryPath, 'ConvertedSpectraLibrary')
+    conversionSettings = {'rounding': 'nearest', 'duplicatePolicy': 'sum', 'maximumAtomicUnit': maximumAtomicUnit}
+    moleculeEntries = {}
+    unchangedMolecules = set()
+    if incremental:
+        previousSpectra, previousMolecules = loadConvertedLibrary(libraryDirectory, conversionSettings)
+        for moleculeName in MoleculeNames:
+            previousEntry = previousMolecules.get(moleculeName)
+            JDXFileVersion = None
+            if moleculeJDXFiles[moleculeName] is not None:
+                previousVersion = previousEntry['JDXFileVersion'] if previousEntry is not None and previousEntry['JDXFile'] == moleculeJDXFiles[moleculeName] else None
+                JDXFileVersion = getJDXFileVersion(moleculeJDXFiles[moleculeName], previousVersion)
+            moleculeEntries[moleculeName] = {'databaseRow': list(getDataIfMoleculeExists(DataBase_data_holder , moleculeName)), 'JDXFile': moleculeJDXFiles[moleculeName], 'JDXFileVersion': JDXFileVersion, 'stale': False}
+            #JDX files are compared by content hash, so a file that was only touched is still unchanged. A molecule whose online lookup failed is looked up again
+            if previousEntry is not None and not previousEntry.get('stale', False) and previousEntry['databaseRow'] == moleculeEntries[moleculeName]['databaseRow'] and previousEntry['JDXFile'] == moleculeEntries[moleculeName]['JDXFile'] \
+               and (previousEntry['JDXFileVersion'] or [None]*3)[2] == (JDXFileVersion or [None]*3)[2]:
+                unchangedMolecules.add(moleculeName)
+        print(f"Incremental rebuild: {len(unchangedMolecules)} of {len(MoleculeNames)} molecules are unchanged since the last run.")
+
+    localJDXFilesList = [moleculeJDXFiles[moleculeName] for moleculeName in MoleculeNames if moleculeJDXFiles[moleculeName] is not None and moleculeName not in unchangedMolecules]
+    localJDXFilesList = list(dict.fromkeys(localJDXFilesList)) #Each file is converted once, even if asked for several times
+    with Instrumentation.stage('local conversion'):
+        localSpectra, localFailures = getSpectrumDataFromLocalJDXInParallel(localJDXFilesList, max_workers=max_workers, maximumAtomicUnit=maximumAtomicUnit, sparse=True)
+    localSpectrumRows = {filename: rowIndex for rowIndex, filename in enumerate(localJDXFilesList)}
+    failedJDXFiles = dict(localFailures)
+    for filename, error in localFailures:
+        print(f"Could not convert {filename} ({error}). Its spectrum will be taken from online instead.")
 
-            knownMoleculeIonizationType = 'unknown'
-            knownIonizationFactorRelativeToN2 = 'unknown'
-            SourceOfFragmentationPattern = SourceOfFragmentationPatternOnline
-            SourceOfIonizationDatum = 'unknown'
+    for moleculeName in MoleculeNames:    
+        moleculeStartTime = time.perf_counter() #Time taken by each molecule, including its online lookups
+        if moleculeName in unchangedMolecules:
+            #The stored row and metadata of the last run are used as they are
+            previousRow = previousMolecules[moleculeName]['row']
+            listOfJDXFileNames.append(moleculeJDXFiles[moleculeName] or moleculeName)
+            AllSpectra.append(previousSpectra.row(previousRow), **{columnName: previousSpectra.metadata[columnName][previousRow] for columnName in SpectraMetadataColumns})
+            Instrumentation.record('molecule', time.perf_counter() - moleculeStartTime)
+            continue
 
-            individual_spectrum = spectrum_data
-        
-        #Now we will add all the spectrum data and metadata into list like variables which will be passed into the exportToCSV function
-        #These variables are the implied returns of this functions and we will keep populating them as long as the user keeps giving molecule names. 
-        #These variables will hold all the metadata and spectrum data all together for all the molecules and pass them into the exportTOCSV function
-        ENumbers.append(ENumber)
-        MWeights.append(MWeight)
+        JDXfilename = moleculeName #Default value for JDXFilename will be the molecule name, if the molecule has a local JDX file, we will replace it later.
+        #Getting the Data list if the Molecule name exists inside the database CSV file
+        molecule = {'MoleculeName': moleculeName, 'databaseRow': list(getDataIfMoleculeExists(DataBase_data_holder , moleculeName)), 'JDXFile': moleculeJDXFiles[moleculeName]}
+        if molecule['JDXFile'] in failedJDXFiles:
+            molecule['JDXFile'] = None
+
+        #The metadata are completed as the streaming and asyncio conversions do, looking up online what the database does not give
+        onlineMetaData = getMetaDataForMoleculeFromOnline(moleculeName) if StreamingConversion.needsOnlineMetaData(molecule) else None
+        metadata = StreamingConversion.getMoleculeMetadata(molecule, onlineMetaData)
+        #Set if the NIST Webbook did not give the spectrum, or an electron number or molecular weight that the database does not give either. A failed lookup for a row that only lacks values that are not looked up online changes nothing
+        onlineLookupFailed = onlineMetaData is not None and 0 in (metadata['ENumbers'], metadata['MWeights'])
+
+        if molecule['JDXFile'] is not None:
+            #The spectrum is taken from the local JDX file, already converted in the batch above
+            JDXfilename = molecule['JDXFile']
+            individual_spectrum = localSpectra.peakList(localSpectrumRows[JDXfilename])
+        else:
+            #Otherwise we will get the spectrum data from online
+            individual_spectrum, metadata['SourceOfFragmentationPatterns'] = getSpectrumForMoleculeFromOnline(moleculeName, maximumAtomicUnit=maximumAtomicUnit)
+            onlineLookupFailed = onlineLookupFailed or metadata['SourceOfFragmentationPatterns'] == 'unknown'
+
+        #Now we will add the spectrum data and metadata as a new row of AllSpectra, which will be passed into the exportToCSV function
+        #AllSpectra is the implied return of this function and we will keep populating it as long as the user keeps giving molecule names.
         listOfJDXFileNames.append(JDXfilename)
-        knownMoleculeIonizationTypes.append(knownMoleculeIonizationType)
-        knownIonizationFactorsRelativeToN2.append(knownIonizationFactorRelativeToN2)
-        SourcesOfFragmentationPattern.append(SourceOfFragmentationPattern)
-        SourceOfIonizationData.append(SourceOfIonizationDatum)
+        if incremental:
+            moleculeEntries[moleculeName]['stale'] = onlineLookupFailed
+        AllSpectra.append(individual_spectrum, **metadata)
+        Instrumentation.record('molecule', time.perf_counter() - moleculeStartTime)
 
-        AllSpectra = combineArray(AllSpectra,individual_spectrum)
+    outputFileNames = exportToOutputFormats(outputFileDirectoryPath, AllSpectra, outputFormats)
 
-    #mkaing the directory for exported files, if it isn't already there
-    if not os.path.exists(outputFileDirectoryPath):
-        os.makedirs(outputFileDirectoryPath)
-   
-    #Now we will get the appropriate file name for the output. The OutputFiles will have a number at the end which is 1 or higher and the lowest number will be used.
-    outputFileNameCSV = getOutputFileName(outputFileDirectoryPath)
-    outputFileNameTXT = getOutputFileName(outputFileDirectoryPath, expectedFileName='ConvertedSpectraTable.txt', fileExtension='.txt')
-    outputFileNameTAB = getOutputFileName(outputFileDirectoryPath, expectedFileName='ConvertedSpectraTable.tab', fileExtension='.tab')
+    if incremental:
+        #Each molecule adds one row to AllSpectra, in the order of MoleculeNames
+        for rowIndex, moleculeName in enumerate(MoleculeNames):
+            moleculeEntries[moleculeName]['row'] = rowIndex
+        saveConvertedLibrary(libraryDirectory, AllSpectra, moleculeEntries, conversionSettings)
 
-    #Now we have all the implied returns of this function and now we will call the exportToCSV function to write all the metadata and spectrum data to the csv file
-    OutputfilePathAndName = f"{outputFileDirectoryPath}\\{outputFileNameCSV}"
-    exportToCSV(OutputfilePathAndName , AllSpectra, MoleculeNames , ENumbers , MWeights , knownMoleculeIonizationTypes , knownIonizationFactorsRelativeToN2 , SourcesOfFragmentationPattern , SourceOfIonizationData, delimeter=';')
+    return outputFileNames
 
-    OutputfilePathAndName = f"{outputFileDirectoryPath}\\{outputFileNameTXT}"
-    exportToCSV(OutputfilePathAndName , AllSpectra, MoleculeNames , ENumbers , MWeights , knownMoleculeIonizationTypes , knownIonizationFactorsRelativeToN2 , SourcesOfFragmentationPattern , SourceOfIonizationData, delimeter='\t')
+def buildArgumentParser():
+    """
+    This function returns the argparse parser of the command line options of main
+    """
+    import argparse
+
+    #Options shared by every command that may use the NIST Webbook
+    webbookOptions = argparse.ArgumentParser(add_help=False)
+    webbookOptions.add_argument('--cache', default=None, help='SQLite file caching the NIST Webbook pages (default: WebbookCache.sqlite)')
+    webbookOptions.add_argument('--no-cache', action='store_true', help='do not cache NIST Webbook pages')
+    webbookOptions.add_argument('--offline', action='store_true', help='only use NIST Webbook pages that are already cached')
+    webbookOptions.add_argument('--domain', default=None, help='NIST Webbook server, e.g. a local stand-in such as http://127.0.0.1:8000')
+
+    #Options shared by every command that can report its Instrumentation measurements
+    metricsOptions = argparse.ArgumentParser(add_help=False)
+    metricsOptions.add_argument('--metrics', default=None, help="record the time of each stage and the bytes and cache counters, and write them to this file: Prometheus text format for .prom files, JSON otherwise, or '-' to print a summary on standard error")
+
+    parser = argparse.ArgumentParser(prog='JDXConverter.py', description='Converts JDX spectra into reference pattern files. Without a command, the interactive prompts are used.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+
+    convert = subparsers.add_parser('convert', parents=[webbookOptions, metricsOptions], help='convert molecules of a database file into output files')
+    convert.add_argument('--database', default='MoleculesInfo.csv', help='molecule database file (default: MoleculesInfo.csv)')
+    convert.add_argument('--database-delimeter', default=None, help="delimeter of the database file (default: ';' for .csv files, tab otherwise)")
+    convert.add_argument('--jdx-dir', default='JDXFiles//', help='local JDX directory (default: JDXFiles//)')
+    convert.add_argument('--index-file', default=None, help=f'JSON file keeping the index of the JDX directory (default: {JDXDirectoryIndexFileName} in the output directory)')
+    convert.add_argument('--molecules', nargs='+', default=None, help='molecules to convert (default: every molecule of the database)')
+    convert.add_argument('--output-dir', default='OutputFiles', help='directory of the output files (default: OutputFiles)')
+    convert.add_argument('--formats', nargs='+', choices=sorted(OutputFormats), default=['csv', 'txt', 'tab'], help='output formats (default: csv txt tab)')
+    convert.add_argument('--workers', type=int, default=None, help='processes converting local JDX files (default: number of CPUs)')
+    convert.add_argument('--incremental', action='store_true', help='only convert the molecules changed since the last incremental run')
+    convert.add_argument('--max-mz', type=lambda value: value if value == 'auto' else int(value), default=MaximumAtomicUnit, help=f"largest m/z kept, or 'auto' to take the m/z range from the spectra (default: {MaximumAtomicUnit})")
+    convert.add_argument('--stream', action='store_true', help='convert as a stream, saving the molecules chunk by chunk with a checkpoint: memory does not grow with the number of molecules, and an interrupted run started again resumes where it stopped')
+    convert.add_argument('--chunk-size', type=int, default=256, help='molecules saved at a time with --stream (default: 256)')
+
+    fetch = subparsers.add_parser('fetch', parents=[webbookOptions, metricsOptions], help='get metadata and JDX files of molecules from the NIST Webbook')
+    fetch.add_argument('--molecules', nargs='+', default=None, help='molecules to fetch')
+    fetch.add_argument('--workers', type=int, default=8, help='molecules fetched concurrently (default: 8)')
+    fetch.add_argument('--no-metadata', action='store_true', help='do not get formula, weight and electron number')
+    fetch.add_argument('--no-spectrum', action='store_true', help='do not get the JDX file')
+
+    index = subparsers.add_parser('index', parents=[metricsOptions], help='index a JDX directory and find molecules in it')
+    index.add_argument('--jdx-dir', default='JDXFiles//', help='local JDX directory (default: JDXFiles//)')
+    index.add_argument('--index-file', default=None, help=f'JSON file keeping the index (default: {JDXDirectoryIndexFileName} in --output-dir, where convert keeps it)')
+    index.add_argument('--output-dir', default='OutputFiles', help='output directory of the conversions using the index (default: OutputFiles)')
+    index.add_argument('--find', nargs='+', default=None, help='names, titles or CAS numbers to look up')
+
+    bench = subparsers.add_parser('bench', parents=[metricsOptions], help='time the conversion of every file of a JDX directory')
+    bench.add_argument('--jdx-dir', default='JDXFiles//', help='local JDX directory (default: JDXFiles//)')
+    bench.add_argument('--workers', type=int, default=None, help='processes converting JDX files (default: number of CPUs)')
+    bench.add_argument('--repeat', type=int, default=3, help='number of timed runs, the fastest is reported (default: 3)')
+
+    search = subparsers.add_parser('search', parents=[metricsOptions], help='identify unknown spectra by searching a library of converted spectra')
+    search.add_argument('--library', required=True, help='library to search: a directory written by the binary output format, or a JDX directory')
+    search.add_argument('--queries', nargs='+', required=True, help='JDX files of the unknown spectra')
+    search.add_argument('--top', type=int, default=5, help='hits reported per query (default: 5)')
+    search.add_argument('--method', choices=['matchFactor', 'cosine'], default='matchFactor', help='score: NIST weighted match factor (0 to 999) or cosine (0 to 1) (default: matchFactor)')
+    search.add_argument('--prefilter', action='store_true', help='only score library spectra sharing main peaks with the query, faster on large libraries')
+    search.add_argument('--workers', type=int, default=None, help='processes converting a JDX directory library (default: number of CPUs)')
+
+    resample = subparsers.add_parser('resample', parents=[metricsOptions], help='resample the IR or UV spectra of a JDX directory onto a common grid')
+    resample.add_argument('--jdx-dir', required=True, help='directory of the IR or UV JDX files')
+    resample.add_argument('--grid', nargs=3, type=float, required=True, metavar=('START', 'STOP', 'STEP'), help='common grid, in the units of --abscissa')
+    resample.add_argument('--abscissa', choices=['wavenumbers', 'wavelengths'], default='wavenumbers', help='abscissa of the grid: wavenumbers in 1/cm or wavelengths in micrometers (default: wavenumbers)')
+    resample.add_argument('--values', choices=['xsec', 'absorbance'], default='xsec', help='values resampled: cross-sections in m^2 per molecule or absorbances (default: xsec)')
+    resample.add_argument('--fill-nonquant', action='store_true', help='use 0.1 m and 150 mmHg for spectra without path length or partial pressure instead of skipping them')
+    resample.add_argument('--output-dir', default='OutputFiles', help='directory of the output files (default: OutputFiles)')
+    resample.add_argument('--formats', nargs='+', choices=sorted(OutputFormats), default=['csv'], help='output formats (default: csv)')
+    resample.add_argument('--workers', type=int, default=None, help='processes reading JDX files (default: number of CPUs)')
+
+    jobs = subparsers.add_parser('jobs', help='run the jobs of a JSON job spec')
+    jobs.add_argument('jobsFile', nargs='?', default='-', help="JSON file with one job or a list of jobs, '-' for standard input (default). A job is an object with a 'command' and the options of that command, e.g. {\"command\": \"convert\", \"molecules\": [\"ethanol\"], \"formats\": [\"csv\"]}")
+    return parser
+
+def useWebbookOptions(arguments):
+    """
+    This function makes the default NISTWebbook session follow the --cache, --no-cache, --offline and --domain options
+    INPUT: arguments ( argparse namespace of a command with the Webbook options )
+    OUTPUT: session ( the new default NISTWebbook.WebbookSession )
+    """
+    import NISTWebbook
+
+    if arguments.no_cache and arguments.offline:
+        raise ValueError('--offline needs the cache, it cannot be used with --no-cache')
+    cache = None
+    if not arguments.no_cache:
+        cache = NISTWebbook.WebbookCache(arguments.cache or NISTWebbook.defaultCacheLocation, offline=arguments.offline)
+    session = NISTWebbook.WebbookSession(domain=arguments.domain or NISTWebbook.NISTWebbookDomain, cache=cache, maxConnections=max(8, getattr(arguments, 'workers', None) or 8))
+    NISTWebbook.setDefaultSession(session)
+    return session
+
+def runCommand(arguments):
+    """
+    This function runs one command of main
+    INPUT: arguments ( argparse namespace with a command )
+    OUTPUT: result ( dictionary describing what was done, printed as JSON by main )
+    """
+    import os
+    import time
+    import Instrumentation
+    import NISTWebbook
+
+    if arguments.command == 'convert':
+        delimeter = arguments.database_delimeter
+        if delimeter is None:
+            delimeter = ';' if arguments.database.endswith('.csv') else '\t'
+        with Instrumentation.stage('database load'):
+            database = loadMoleculeDatabase(arguments.database, delimeter=delimeter)
+        MoleculeNames = arguments.molecules if arguments.molecules else database.moleculeNames()
+        if arguments.stream and arguments.incremental:
+            raise ValueError('--stream and --incremental cannot be used together')
+        session = useWebbookOptions(arguments)
+        try:
+            if arguments.stream:
+                import StreamingConversion
+
+                outputFileNames = StreamingConversion.convertMoleculesStreaming(MoleculeNames, database, JDXFilesLocation=arguments.jdx_dir, outputFileDirectoryPath=arguments.output_dir,
+                                                                                outputFormats=arguments.formats, max_workers=arguments.workers, maximumAtomicUnit=arguments.max_mz,
+                                                                                moleculesPerChunk=arguments.chunk_size, indexFileName=arguments.index_file)
+            else:
+                outputFileNames = convertMolecules(MoleculeNames, database, JDXFilesLocation=arguments.jdx_dir, outputFileDirectoryPath=arguments.output_dir,
+                                                   outputFormats=arguments.formats, max_workers=arguments.workers, incremental=arguments.incremental, maximumAtomicUnit=arguments.max_mz,
+                                                   indexFileName=arguments.index_file)
+        finally:
+            NISTWebbook.setDefaultSession(None)
+            session.close()
+        return {'command': 'convert', 'molecules': len(MoleculeNames), 'outputFiles': {outputFormat: os.path.join(arguments.output_dir, fileName) for outputFormat, fileName in outputFileNames.items()}}
+
+    if arguments.command == 'fetch':
+        if not arguments.molecules:
+            raise ValueError('fetch needs --molecules')
+        session = useWebbookOptions(arguments)
+        try:
+            results = getDataForMoleculesFromOnline(arguments.molecules, max_workers=arguments.workers, session=session,
+                                                    fetchMetaData=not arguments.no_metadata, fetchSpectrum=not arguments.no_spectrum)
+        finally:
+            NISTWebbook.setDefaultSession(None)
+            session.close()
+        for result in results:
+            result.pop('spectrum_data', None) #The spectra are in the JDX files, they are not printed
+        return {'command': 'fetch', 'molecules': dict(zip(arguments.molecules, results))}
+
+    if arguments.command == 'index':
+        indexFileName = arguments.index_file or os.path.join(arguments.output_dir, JDXDirectoryIndexFileName)
+        with Instrumentation.stage('directory index'):
+            JDXDirectory = JDXDirectoryIndex(arguments.jdx_dir, indexFileName=indexFileName)
+        result = {'command': 'index', 'indexFile': indexFileName, 'JDXFiles': len(JDXDirectory.files), 'headersRead': JDXDirectory.headersRead}
+        if arguments.find:
+            result['found'] = {molecule_name: JDXDirectory.find(molecule_name) for molecule_name in arguments.find}
+        return result
+
+    if arguments.command == 'bench':
+        JDXFilesList = sorted(os.path.join(arguments.jdx_dir, fileName) for fileName in os.listdir(arguments.jdx_dir) if fileName.lower().endswith('.jdx'))
+        times = []
+        for run in range(max(1, arguments.repeat)):
+            startTime = time.perf_counter()
+            AllSpectraData, failures = getSpectrumDataFromLocalJDXInParallel(JDXFilesList, max_workers=arguments.workers)
+            times.append(time.perf_counter() - startTime)
+        return {'command': 'bench', 'JDXFiles': len(JDXFilesList), 'failures': len(failures), 'workers': arguments.workers or os.cpu_count(),
+                'seconds': min(times), 'filesPerSecond': len(JDXFilesList) / min(times) if min(times) > 0 else None}
+
+    if arguments.command == 'search':
+        import JCampSG
+        import SpectraSearch
+
+        failures = []
+        if os.path.exists(os.path.join(arguments.library, 'metadata.json')):
+            library = loadFromBinary(arguments.library)
+        else:
+            JDXFilesList = sorted(os.path.join(arguments.library, fileName) for fileName in os.listdir(arguments.library) if fileName.lower().endswith('.jdx'))
+            library, failures = getSpectrumDataFromLocalJDXInParallel(JDXFilesList, max_workers=arguments.workers)
+            library.metadata['MoleculeNames'] = [os.path.splitext(os.path.basename(fileName))[0] for fileName in JDXFilesList]
+        index = SpectraSearch.SpectraSearchIndex(library)
+        queries = [createPeakList(JCampSG.JCAMP_reader(fileName), maximumAtomicUnit=index.maximumAtomicUnit) for fileName in arguments.queries]
+        hits = index.search(queries, topHits=arguments.top, method=arguments.method, prefilter=arguments.prefilter)
+        #The rows of the library files that failed are all zeros, so they never match, the failures are reported as for resample
+        return {'command': 'search', 'librarySpectra': len(index), 'method': arguments.method, 'failures': [[fileName, error] for fileName, error in failures],
+                'hits': {fileName: [[MoleculeName, score] for MoleculeName, score, rowIndex in queryHits] for fileName, queryHits in zip(arguments.queries, hits)}}
+
+    if arguments.command == 'resample':
+        import SpectraResampling
+
+        JDXFilesList = sorted(os.path.join(arguments.jdx_dir, fileName) for fileName in os.listdir(arguments.jdx_dir) if fileName.lower().endswith('.jdx'))
+        grid = SpectraResampling.makeGrid(*arguments.grid)
+        AllSpectraData, failures = SpectraResampling.resampleJDXFiles(JDXFilesList, grid, abscissa=arguments.abscissa, values=arguments.values,
+                                                                      skip_nonquant=not arguments.fill_nonquant, max_workers=arguments.workers)
+        outputFileNames = exportToOutputFormats(arguments.output_dir, AllSpectraData, arguments.formats)
+        return {'command': 'resample', 'JDXFiles': len(JDXFilesList), 'gridPoints': len(grid), 'failures': [[fileName, error] for fileName, error in failures],
+                'outputFiles': {outputFormat: os.path.join(arguments.output_dir, fileName) for outputFormat, fileName in outputFileNames.items()}}
+
+    raise ValueError(f'Unknown command {arguments.command}')
+
+def getJobArgv(jobSpec):
+    """
+    This function turns a job of a JSON job spec into the command line arguments of its command, so the job is parsed, converted and checked like the same command typed on the command line
+    INPUT: jobSpec ( dictionary with a 'command' and the options of that command. Options are named as on the command line, with or without the leading '--' and with '_' or '-'. true gives a flag, false or null leaves the option out, and a list gives several values )
+    OUTPUT: argv ( list of command line arguments, starting with the command )
+    """
+    jobSpec = dict(jobSpec)
+    argv = [str(jobSpec.pop('command', None))]
+    for option, value in jobSpec.items():
+        optionName = '--' + option.lstrip('-').replace('_', '-')
+        if value is None or value is False:
+            continue
+        if value is True:
+            argv.append(optionName)
+        elif isinstance(value, list):
+            argv.extend([optionName] + [str(item) for item in value])
+        else:
+            argv.extend([optionName, str(value)])
+    return argv
 
-    OutputfilePathAndName = f"{outputFileDirectoryPath}\\{outputFileNameTAB}"
-    exportToCSV(OutputfilePathAndName , AllSpectra, MoleculeNames , ENumbers , MWeights , knownMoleculeIonizationTypes , knownIonizationFactorsRelativeToN2 , SourcesOfFragmentationPattern , SourceOfIonizationData, delimeter='\t')
+def readJobs(parser, jobsFile):
+    """
+    This function reads a JSON job spec and returns one argparse namespace per job, parsed by parser from getJobArgv, so the options of a job get the types, choices and defaults of its command
+    INPUT: parser ( parser of buildArgumentParser ) | jobsFile ( file name, or '-' for standard input )
+    OUTPUT: jobs ( list of argparse namespaces )
+    """
+    import json
+    import sys
 
-    #Now this function will terminate showing the user where the output has been written
-    print(f"Conversion complete: outputs written in ./{outputFileDirectoryPath}/{outputFileNameCSV}, ./{outputFileDirectoryPath}/{outputFileNameTXT}, and /{outputFileDirectoryPath}/{outputFileNameTAB}")
+    if jobsFile == '-':
+        jobSpecs = json.load(sys.stdin)
+    else:
+        with open(jobsFile, 'r') as jobSpecFile:
+            jobSpecs = json.load(jobSpecFile)
+    if isinstance(jobSpecs, dict):
+        jobSpecs = [jobSpecs]
+
+    jobs = []
+    for jobSpec in jobSpecs:
+        if not isinstance(jobSpec, dict):
+            raise ValueError(f'A job must be an object, not {jobSpec!r}')
+        if jobSpec.get('command') == 'jobs':
+            raise ValueError(f'A job cannot run other jobs: {jobSpec}')
+        #An unknown command or option, or a bad value, is reported by the parser as for the command line
+        jobs.append(parser.parse_args(getJobArgv(jobSpec)))
+    return jobs
+
+def main(argv=None):
+    """
+    This function is the command line entry point. Without arguments it starts the interactive startCommandLineInterface, otherwise it runs the given command, or the jobs of a JSON job spec, and prints one JSON result line per command
+    INPUT: argv ( list of command line arguments, sys.argv[1:] if not given )
+    OUTPUT: exitCode ( 0 if every command succeeded, 1 otherwise )
+    """
+    import json
+    import sys
+    import Instrumentation
+
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        startCommandLineInterface()
+        return 0
+
+    parser = buildArgumentParser()
+    arguments = parser.parse_args(argv)
+    if arguments.command is None:
+        parser.error('a command is needed')
+    jobs = [arguments]
+    if arguments.command == 'jobs':
+        try:
+            jobs = readJobs(parser, arguments.jobsFile)
+        except ValueError as error:
+            parser.error(f'bad job spec: {error}')
+
+    exitCode = 0
+    for job in jobs:
+        metricsFileName = getattr(job, 'metrics', None)
+        wasEnabled = Instrumentation.enabled
+        if metricsFileName is not None:
+            #Each job reports only its own measurements
+            Instrumentation.reset()
+            Instrumentation.enable()
+        try:
+            result = runCommand(job)
+        except Exception as error:
+            #A failed job is reported and the next jobs still run
+            result = {'command': job.command, 'error': f'{type(error).__name__}: {error}'}
+            exitCode = 1
+        if metricsFileName is not None:
+            if not wasEnabled:
+                Instrumentation.disable()
+            if metricsFileName == '-':
+                print(Instrumentation.summary(), file=sys.stderr)
+            else:
+                Instrumentation.writeReport(metricsFileName)
+                result['metrics'] = metricsFileName
+        print(json.dumps(result))
+        sys.stdout.flush()
+    return exitCode
 
 if __name__ == "__main__":
     # getMultipleSpectrumFromNIST()
@@ -819,4 +1888,5 @@ if __name__ == "__main__":
     # checkInLocalJDXDirectory('JDXFiles//','Ethanol')
     # print(takeMoleculeNamesInputFromUser())
     # print(getOutputFileName('OutputFiles//'))
-    startCommandLineInterface()
\ No newline at end of file
+    import sys
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,514 @@
+
+'''
+NISTWebbook.py holds the HTTP layer JDXConverter uses to talk to the NIST WebBook. All requests go through a
+WebbookSession, which keeps one pool of keep-alive connections, spaces out requests to the same host and retries
+transient failures with exponential backoff. The domain is configurable so the whole fetch chain can be run
+against a local HTTP server that serves recorded WebBook pages.
+Downloaded pages and JDX files are kept in a WebbookCache, a SQLite file keyed by URL, so repeat conversions are
+served from disk. Stale entries are revalidated with ETag/Last-Modified, the file is capped in size with least
+recently used eviction, and an offline cache never touches the network.
+Molecule pages are read once by MoleculePageParser, which streams the HTML through the standard library's
+incremental parser and keeps only the few fields the converter needs instead of building a full DOM.
+AsyncWebbookSession is the same handle for asyncio programs: one aiohttp client shared by every coroutine, with the
+same cache, rate limiting and retries, so that many molecules can be looked up at once without a thread each.
+'''
+
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from html.parser import HTMLParser
+from urllib.parse import quote, urldefrag, urlsplit
+
+import Instrumentation
+
+#The default server for all WebBook requests
+NISTWebbookDomain = 'https://webbook.nist.gov'
+
+#Where the shared default session keeps its cache. Set to None before the first request to disable caching.
+defaultCacheLocation = 'WebbookCache.sqlite'
+
+class HostRateLimiter:
+    """
+    This class spaces out requests so that no host receives more than requestsPerSecond requests. It is shared by all threads of a WebbookSession, or all coroutines of an AsyncWebbookSession.
+    """
+
+    def __init__(self, requestsPerSecond=5.0):
+        self.minimumInterval = 1.0 / requestsPerSecond if requestsPerSecond else 0.0
+        self.nextAllowedTime = {} #host -> earliest time.monotonic() at which the next request may start
+        self.lock = threading.Lock()
+
+    def reserve(self, URL):
+        """
+        This function books the next slot for a request to URL's host
+        INPUT: URL ( the URL that is about to be requested )
+        OUTPUT: delay ( seconds to wait before sending the request, 0 if it may be sent now )
+        """
+        if self.minimumInterval <= 0:
+            return 0.0
+        host = urlsplit(URL).netloc
+        with self.lock:
+            now = time.monotonic()
+            startTime = max(now, self.nextAllowedTime.get(host, now))
+            self.nextAllowedTime[host] = startTime + self.minimumInterval
+        return startTime - now
+
+    def wait(self, URL):
+        """
+        This function blocks until a request to URL's host is allowed, and books the slot after it for the next caller
+        """
+        delay = self.reserve(URL)
+        if delay > 0:
+            time.sleep(delay)
+
+class CachedResponse:
+    """
+    This class is a page served from a WebbookCache. It has the attributes of requests.Response that this project uses (url, status_code, headers, content).
+    """
+
+    def __init__(self, url, content, etag, lastModified, fetchedAt):
+        self.url = url
+        self.status_code = 200
+        self.content = content
+        self.headers = {}
+        if etag: self.headers['ETag'] = etag
+        if lastModified: self.headers['Last-Modified'] = lastModified
+        self.fetchedAt = fetchedAt
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+class AsyncResponse(CachedResponse):
+    """
+    This class is a page downloaded by an AsyncWebbookSession, read in full before its connection is given back to the pool. It has the same attributes as CachedResponse.
+    """
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers #Case-insensitive, as those of requests.Response
+        self.fetchedAt = time.time()
+
+class WebbookCache:
+    """
+    This class is a persistent cache of WebBook responses stored in one SQLite file and keyed by URL (without the '#...' fragment, which never reaches the server).
+    INPUT: location ( SQLite file path, ':memory:' keeps the cache for this process only ) | timeToLive ( seconds an entry is used without asking the server, None never expires ) | maxBytes ( size cap of the stored content, least recently used entries are evicted beyond it, None for no cap ) | offline ( if True the network is never used and a miss raises LookupError )
+    """
+
+    def __init__(self, location=None, timeToLive=7*24*3600, maxBytes=512*1024*1024, offline=False):
+        if location is None:
+            location = defaultCacheLocation
+        self.location = location
+        self.timeToLive = timeToLive
+        self.maxBytes = maxBytes
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(location, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, content BLOB, etag TEXT, lastModified TEXT, fetchedAt REAL, lastAccess REAL, size INTEGER)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS pagesByLastAccess ON pages (lastAccess)')
+
+    def lookup(self, URL):
+        """
+        This function returns the cached response for URL, or None if there is none. The entry is marked as recently used.
+        """
+        URL = urldefrag(URL)[0]
+        with self.lock, self.connection:
+            row = self.connection.execute('SELECT content, etag, lastModified, fetchedAt FROM pages WHERE url = ?', (URL,)).fetchone()
+            if row is None:
+                self.misses = self.misses + 1
+                Instrumentation.count('cache misses')
+                return None
+            self.hits = self.hits + 1
+            Instrumentation.count('cache hits')
+            self.connection.execute('UPDATE pages SET lastAccess = ? WHERE url = ?', (time.time(), URL))
+        content, etag, lastModified, fetchedAt = row
+        return CachedResponse(URL, bytes(content), etag, lastModified, fetchedAt)
+
+    def isFresh(self, cachedResponse):
+        if self.timeToLive is None:
+            return True
+        return time.time() - cachedResponse.fetchedAt < self.timeToLive
+
+    def store(self, URL, response):
+        """
+        This function saves a successful response and evicts least recently used entries if the size cap is exceeded
+        INPUT: URL ( requested URL ) | response ( requests.Response with status 200 )
+        """
+        URL = urldefrag(URL)[0]
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (URL, response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(response.content)))
+            self.evict()
+
+    def markRevalidated(self, URL):
+        """
+        This function restarts the time to live of an entry after the server answered 304 Not Modified
+        """
+        URL = urldefrag(URL)[0]
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE pages SET fetchedAt = ? WHERE url = ?', (time.time(), URL))
+
+    def evict(self):
+        #Must be called with the lock held, inside a transaction
+        if self.maxBytes is None:
+            return
+        totalBytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if totalBytes <= self.maxBytes:
+            return
+        for URL, size in self.connection.execute('SELECT url, size FROM pages ORDER BY lastAccess').fetchall():
+            self.connection.execute('DELETE FROM pages WHERE url = ?', (URL,))
+            totalBytes = totalBytes - size
+            if totalBytes <= self.maxBytes:
+                break
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class MoleculePageParser(HTMLParser):
+    """
+    This class extracts the molecule record from a WebBook page in a single streaming pass. Feed it the page (in one piece or in chunks) and read .record:
+    'formula' ( e.g. 'C2H6O' ) | 'molecularWeight' ( float ) | 'casNumber' ( e.g. '64-17-5' ) | 'massSpectrumURL' ( first link containing '#Mass-Spec' ) | 'jcampURL' ( first link containing 'JCAMP' ).
+    Fields that are not on the page are None and links are returned as they appear on the page (usually relative).
+    """
+
+    formulaTitle = 'IUPAC definition of empirical formula'
+    molecularWeightTitle = 'IUPAC definition of relative molecular mass (molecular weight)'
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.record = {'formula': None, 'molecularWeight': None, 'casNumber': None, 'massSpectrumURL': None, 'jcampURL': None}
+        #The fields of interest are list items such as <li><strong><a title="...">Formula</a>:</strong> C<sub>2</sub>H<sub>6</sub>O</li>
+        self.inListItem = False
+        self.inStrong = False
+        self.listItemTitles = []
+        self.labelText = []
+        self.valueText = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'li':
+            self.inListItem = True
+            self.inStrong = False
+            self.listItemTitles = []
+            self.labelText = []
+            self.valueText = []
+        elif tag == 'strong':
+            self.inStrong = True
+        elif tag == 'a':
+            attributes = dict(attrs)
+            if self.inListItem and attributes.get('title'):
+                self.listItemTitles.append(attributes['title'])
+            href = attributes.get('href') or ''
+            if self.record['massSpectrumURL'] is None and href.find('#Mass-Spec') > 0:
+                self.record['massSpectrumURL'] = href
+            if self.record['jcampURL'] is None and href.find('JCAMP') > 0:
+                self.record['jcampURL'] = href
+
+    def handle_endtag(self, tag):
+        if tag == 'strong':
+            self.inStrong = False
+        elif tag == 'li' and self.inListItem:
+            self.inListItem = False
+            value = ''.join(self.valueText).strip()
+            if self.formulaTitle in self.listItemTitles and self.record['formula'] is None:
+                self.record['formula'] = value
+            elif self.molecularWeightTitle in self.listItemTitles and self.record['molecularWeight'] is None:
+                try:
+                    self.record['molecularWeight'] = float(value)
+                except ValueError:
+                    pass
+            elif 'CAS Registry Number' in ''.join(self.labelText) and self.record['casNumber'] is None:
+                self.record['casNumber'] = value
+
+    def handle_data(self, data):
+        if not self.inListItem:
+            return
+        if self.inStrong:
+            self.labelText.append(data)
+        else:
+            self.valueText.append(data)
+
+def parseMoleculePage(content):
+    """
+    This function returns the record of MoleculePageParser for a WebBook page
+    INPUT: content ( page as bytes or str )
+    OUTPUT: record ( dictionary with 'formula', 'molecularWeight', 'casNumber', 'massSpectrumURL' and 'jcampURL' )
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    parser = MoleculePageParser()
+    parser.feed(content)
+    parser.close()
+    return parser.record
+
+class WebbookSession:
+    """
+    This class is a thread-safe handle on the NIST WebBook: one requests.Session with a pool of keep-alive connections, per-host rate limiting and retries with backoff.
+    INPUT: domain ( server to talk to, e.g. 'http://127.0.0.1:8000' for a local stand-in ) | cache ( optional WebbookCache shared by every request of the session ) | maxConnections ( size of the connection pool, should be at least the number of fetching threads ) | requestsPerSecond ( per-host request rate, 0 or None disables the limit ) | maxRetries ( retries for connection errors and 429/5xx responses ) | backoffFactor ( retry n waits backoffFactor * 2**(n-1) seconds ) | timeout ( seconds to wait for the server )
+    """
+
+    def __init__(self, domain=NISTWebbookDomain, cache=None, maxConnections=8, requestsPerSecond=5.0, maxRetries=3, backoffFactor=0.5, timeout=30):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.domain = domain.rstrip('/')
+        self.cache = cache
+        self.timeout = timeout
+        self.rateLimiter = HostRateLimiter(requestsPerSecond)
+        self.parsedPages = OrderedDict() #URL -> record of parseMoleculePage, for the most recently parsed pages
+        self.parsedPagesLock = threading.Lock()
+
+        retries = Retry(total=maxRetries, backoff_factor=backoffFactor, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=('GET',))
+        adapter = HTTPAdapter(pool_connections=maxConnections, pool_maxsize=maxConnections, max_retries=retries)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, URL):
+        """
+        This function downloads URL through the shared connection pool, or serves it from the session's cache
+        INPUT: URL ( absolute URL, or a path such as '/cgi/cbook.cgi?...' relative to the session's domain )
+        OUTPUT: response ( requests.Response or CachedResponse, an exception is raised for HTTP errors that remain after the retries )
+        """
+        URL = self.absoluteURL(URL)
+        if self.cache is None:
+            return self.fetch(URL)
+
+        cachedResponse = self.cache.lookup(URL)
+        if cachedResponse is not None and (self.cache.offline or self.cache.isFresh(cachedResponse)):
+            return cachedResponse
+        if self.cache.offline:
+            raise LookupError(f'{URL} is not in the cache {self.cache.location} and the cache is offline')
+
+        #A stale entry is revalidated: the server answers 304 without a body if it has not changed
+        revalidationHeaders = {}
+        if cachedResponse is not None:
+            if 'ETag' in cachedResponse.headers: revalidationHeaders['If-None-Match'] = cachedResponse.headers['ETag']
+            if 'Last-Modified' in cachedResponse.headers: revalidationHeaders['If-Modified-Since'] = cachedResponse.headers['Last-Modified']
+        response = self.fetch(URL, revalidationHeaders)
+        if response.status_code == 304 and cachedResponse is not None:
+            self.cache.markRevalidated(URL)
+            return cachedResponse
+        self.cache.store(URL, response)
+        return response
+
+    def fetch(self, URL, headers=None):
+        """
+        This function sends one rate limited GET request for URL, bypassing the cache
+        """
+        self.rateLimiter.wait(URL)
+        with Instrumentation.stage('network fetch'):
+            response = self.session.get(URL, headers=headers, timeout=self.timeout)
+        Instrumentation.count('bytes fetched', len(response.content))
+        response.raise_for_status()
+        return response
+
+    def getMoleculePage(self, URL, maxParsedPages=1024):
+        """
+        This function downloads (or takes from the cache) a WebBook page and parses it once. The record is kept in memory, so the formula, weight and spectrum lookups of one molecule share a single parse.
+        INPUT: URL ( molecule or mass spectrum page URL ) | maxParsedPages ( number of records kept in memory )
+        OUTPUT: record ( see parseMoleculePage, with the links made absolute. Do not modify it, it is shared )
+        """
+        URL = self.absoluteURL(URL)
+        with self.parsedPagesLock:
+            if URL in self.parsedPages:
+                self.parsedPages.move_to_end(URL)
+                return self.parsedPages[URL]
+
+        record = parseMoleculePage(self.get(URL).content)
+        for linkField in ('massSpectrumURL', 'jcampURL'):
+            if record[linkField] is not None:
+                record[linkField] = self.absoluteURL(record[linkField])
+
+        with self.parsedPagesLock:
+            self.parsedPages[URL] = record
+            while len(self.parsedPages) > maxParsedPages:
+                self.parsedPages.popitem(last=False)
+        return record
+
+    def absoluteURL(self, URL):
+        """
+        This function turns a link found on a WebBook page (e.g. '/cgi/cbook.cgi?ID=C64175&Mask=200#Mass-Spec') into an absolute URL on the session's domain
+        """
+        if URL.startswith('/'):
+            return self.domain + URL
+        return URL
+
+    def moleculeURL(self, molecule_name):
+        """
+        This function returns the WebBook page URL of a molecule. Example: https://webbook.nist.gov/cgi/cbook.cgi?Name=Methanol&Units=SI
+        """
+        return f'{self.domain}/cgi/cbook.cgi?Name={quote(molecule_name)}&Units=SI'
+
+    def close(self):
+        self.session.close()
+
+class AsyncWebbookSession:
+    """
+    This class is the asyncio counterpart of WebbookSession: one aiohttp client with a pool of keep-alive connections, shared by every coroutine using the session, with per-host rate limiting and retries with backoff.
+    The client is opened by the first request, and must be closed with close(), or by using the session as an async context manager ( async with AsyncWebbookSession() as session: ... ).
+    INPUT: as for WebbookSession. aiohttp must be installed
+    """
+    #Responses that are retried, as those of WebbookSession
+    retriedStatuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, domain=NISTWebbookDomain, cache=None, maxConnections=8, requestsPerSecond=5.0, maxRetries=3, backoffFactor=0.5, timeout=30):
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError('AsyncWebbookSession needs aiohttp, install it with: pip install aiohttp')
+
+        self.domain = domain.rstrip('/')
+        self.cache = cache
+        self.timeout = timeout
+        self.maxConnections = maxConnections
+        self.maxRetries = maxRetries
+        self.backoffFactor = backoffFactor
+        self.rateLimiter = HostRateLimiter(requestsPerSecond)
+        self.parsedPages = OrderedDict() #URL -> record of parseMoleculePage, for the most recently parsed pages
+        self.pendingPages = {} #URL -> task downloading and parsing the page, while it runs
+        self.transientErrors = (aiohttp.ClientError, asyncio.TimeoutError)
+        self.client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exceptionType, exception, traceback):
+        await self.close()
+        return False
+
+    def getClient(self):
+        """
+        This function returns the aiohttp client of the session, creating it on first use. It has to be called from a coroutine, as the client belongs to the running event loop
+        """
+        import aiohttp
+
+        if self.client is None:
+            connector = aiohttp.TCPConnector(limit=self.maxConnections, limit_per_host=self.maxConnections)
+            self.client = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.client
+
+    async def get(self, URL):
+        """
+        This function downloads URL through the shared client, or serves it from the session's cache. The cache is read and written in a thread, so the event loop does not wait on the disk
+        INPUT: URL ( absolute URL, or a path such as '/cgi/cbook.cgi?...' relative to the session's domain )
+        OUTPUT: response ( AsyncResponse or CachedResponse, an exception is raised for HTTP errors that remain after the retries )
+        """
+        URL = self.absoluteURL(URL)
+        if self.cache is None:
+            return await self.fetch(URL)
+
+        cachedResponse = await asyncio.to_thread(self.cache.lookup, URL)
+        if cachedResponse is not None and (self.cache.offline or self.cache.isFresh(cachedResponse)):
+            return cachedResponse
+        if self.cache.offline:
+            raise LookupError(f'{URL} is not in the cache {self.cache.location} and the cache is offline')
+
+        #A stale entry is revalidated: the server answers 304 without a body if it has not changed
+        revalidationHeaders = {}
+        if cachedResponse is not None:
+            if 'ETag' in cachedResponse.headers: revalidationHeaders['If-None-Match'] = cachedResponse.headers['ETag']
+            if 'Last-Modified' in cachedResponse.headers: revalidationHeaders['If-Modified-Since'] = cachedResponse.headers['Last-Modified']
+        response = await self.fetch(URL, revalidationHeaders)
+        if response.status_code == 304 and cachedResponse is not None:
+            await asyncio.to_thread(self.cache.markRevalidated, URL)
+            return cachedResponse
+        await asyncio.to_thread(self.cache.store, URL, response)
+        return response
+
+    async def fetch(self, URL, headers=None):
+        """
+        This function sends one rate limited GET request for URL, bypassing the cache. Connection errors and 429/5xx responses are retried up to maxRetries times, retry n waiting backoffFactor * 2**(n-1) seconds, or what the server asks in Retry-After
+        """
+        import aiohttp
+
+        client = self.getClient()
+        for retry in range(self.maxRetries + 1):
+            await asyncio.sleep(self.rateLimiter.reserve(URL))
+            #Instrumentation.stage keeps its start times per thread, which coroutines share, so the time is taken here
+            startTime = time.perf_counter()
+            try:
+                async with client.get(URL, headers=headers) as response:
+                    content = await response.read()
+            except self.transientErrors:
+                if retry == self.maxRetries:
+                    raise
+                delay = self.backoffFactor * 2**retry
+            else:
+                Instrumentation.record('network fetch', time.perf_counter() - startTime)
+                if response.status not in self.retriedStatuses or retry == self.maxRetries:
+                    break
+                retryAfter = response.headers.get('Retry-After', '')
+                delay = float(retryAfter) if retryAfter.isdigit() else self.backoffFactor * 2**retry
+            await asyncio.sleep(delay)
+
+        Instrumentation.count('bytes fetched', len(content))
+        if response.status >= 400:
+            raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status, message=response.reason, headers=response.headers)
+        return AsyncResponse(str(response.url), response.status, response.headers.copy(), content)
+
+    async def getMoleculePage(self, URL, maxParsedPages=1024):
+        """
+        This function is WebbookSession.getMoleculePage for coroutines. Coroutines asking for the same page at the same time share a single download and parse
+        """
+        URL = self.absoluteURL(URL)
+        if URL in self.parsedPages:
+            self.parsedPages.move_to_end(URL)
+            return self.parsedPages[URL]
+
+        task = self.pendingPages.get(URL)
+        if task is None:
+            task = asyncio.ensure_future(self.parseMoleculePage(URL, maxParsedPages))
+            self.pendingPages[URL] = task
+            task.add_done_callback(lambda finishedTask: self.pendingPages.pop(URL, None))
+        #A coroutine that is cancelled while waiting does not cancel the download the others wait for
+        return await asyncio.shield(task)
+
+    async def parseMoleculePage(self, URL, maxParsedPages):
+        record = parseMoleculePage((await self.get(URL)).content)
+        for linkField in ('massSpectrumURL', 'jcampURL'):
+            if record[linkField] is not None:
+                record[linkField] = self.absoluteURL(record[linkField])
+
+        self.parsedPages[URL] = record
+        while len(self.parsedPages) > maxParsedPages:
+            self.parsedPages.popitem(last=False)
+        return record
+
+    absoluteURL = WebbookSession.absoluteURL
+    moleculeURL = WebbookSession.moleculeURL
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+defaultSession = None
+defaultSessionLock = threading.Lock()
+
+def getDefaultSession():
+    """
+    This function returns the WebbookSession shared by all callers that do not pass their own, creating it on first use with a cache at defaultCacheLocation
+    """
+    global defaultSession
+    with defaultSessionLock:
+        if defaultSession is None:
+            cache = WebbookCache(defaultCacheLocation) if defaultCacheLocation else None
+            defaultSession = WebbookSession(cache=cache)
+        return defaultSession
+
+def setDefaultSession(session):
+    """
+    This function replaces the shared WebbookSession, e.g. with one using another cache location, an offline cache or a local stand-in server
+    """
+    global defaultSession
+    with defaultSessionLock:
+        defaultSession = session
@@ -0,0 +1,498 @@
+'''
+SpectraContainers.py holds the containers of binned spectra used by JDXConverter and the modules built on it:
+    PeakList              one mass spectrum as its peaks only ( m/z values and intensities ).
+    SpectraMatrix         many spectra as one dense (molecules x m/z) numpy array, with their metadata columns.
+    SparseSpectraMatrix   many spectra in compressed sparse row form, with their metadata columns.
+JDXConverter imports them all, so JDXConverter.SpectraMatrix and SpectraContainers.SpectraMatrix are the same class,
+also when JDXConverter.py is run as a script and its functions are those of __main__.
+Example:
+    AllSpectra = SpectraContainers.SparseSpectraMatrix(maximumAtomicUnit='auto')
+    AllSpectra.append(SpectraContainers.PeakList([15, 31, 46], [20.0, 100.0, 16.0]), MoleculeNames='ethanol')
+'''
+
+#This variable determines the largest fragment size that the program can handle
+MaximumAtomicUnit = 300
+
+def combinePeaks(massToCharges, intensities, duplicatePolicy='sum'):
+    """
+    This function sorts peaks by m/z and merges the peaks that share an m/z, without going through a dense array
+    INPUT: massToCharges ( integer m/z values, in any order and possibly repeated ) | intensities ( intensity of each peak ) | duplicatePolicy ( what to do when several peaks have the same m/z: 'sum', 'max' or 'last', as for binSpectrum )
+    OUTPUT: massToCharges ( distinct m/z values in increasing order, int32 ) | intensities ( their intensities, float64. m/z values below 1, which have no place in the layout of createArray, and m/z values whose intensity is zero are left out )
+    """
+    import numpy
+
+    if duplicatePolicy not in ('sum', 'max', 'last'):
+        raise ValueError(f"Unknown duplicatePolicy '{duplicatePolicy}'. Expected one of ['last', 'max', 'sum']")
+    massToCharges = numpy.asarray(massToCharges, dtype=numpy.int64).ravel()
+    intensities = numpy.asarray(intensities, dtype=numpy.float64).ravel()
+    if massToCharges.shape != intensities.shape:
+        raise ValueError(f"massToCharges and intensities must have the same length, got {massToCharges.size} and {intensities.size}")
+    inRange = massToCharges >= 1
+    if not inRange.all():
+        massToCharges, intensities = massToCharges[inRange], intensities[inRange]
+
+    if duplicatePolicy == 'last':
+        #The first occurrence in the reversed arrays is the last one in the original order
+        uniqueMassToCharges, positionsInReversed = numpy.unique(massToCharges[::-1], return_index=True)
+        combinedIntensities = intensities[::-1][positionsInReversed]
+    else:
+        uniqueMassToCharges, inverse = numpy.unique(massToCharges, return_inverse=True)
+        if duplicatePolicy == 'sum':
+            combinedIntensities = numpy.bincount(inverse, weights=intensities, minlength=uniqueMassToCharges.size)
+        else:
+            combinedIntensities = numpy.full(uniqueMassToCharges.size, -numpy.inf)
+            numpy.maximum.at(combinedIntensities, inverse, intensities)
+
+    nonzero = combinedIntensities != 0
+    return uniqueMassToCharges[nonzero].astype(numpy.int32), combinedIntensities[nonzero]
+
+class PeakList:
+    """
+    This class holds one mass spectrum as its peaks only: massToCharges ( int32 m/z values in increasing order ) and intensities ( float64, none of them zero ).
+    A NIST mass spectrum has a few dozen peaks, so a PeakList takes a small fraction of the memory of the dense array of createArray, and merging, normalizing and comparing spectra only touch the peaks.
+    INPUT: massToCharges, intensities, duplicatePolicy ( as for combinePeaks )
+    """
+
+    def __init__(self, massToCharges=(), intensities=(), duplicatePolicy='sum'):
+        self.massToCharges, self.intensities = combinePeaks(massToCharges, intensities, duplicatePolicy)
+
+    def __len__(self):
+        return self.massToCharges.size
+
+    def __repr__(self):
+        return f"PeakList({self.massToCharges.tolist()}, {self.intensities.tolist()})"
+
+    @property
+    def nbytes(self):
+        return self.massToCharges.nbytes + self.intensities.nbytes
+
+    def toArray(self, maximumAtomicUnit='auto'):
+        """
+        This function expands the peaks to the dense layout of createArray
+        INPUT: maximumAtomicUnit ( length of the array, 'auto' for the largest m/z of the peaks, None for MaximumAtomicUnit. Peaks above it are dropped )
+        OUTPUT: spectrum ( numpy array, index i holds the intensity at m/z i+1 )
+        """
+        import numpy
+
+        if maximumAtomicUnit is None:
+            maximumAtomicUnit = MaximumAtomicUnit
+        if maximumAtomicUnit == 'auto':
+            maximumAtomicUnit = int(self.massToCharges[-1]) if len(self) else 0
+        inRange = self.massToCharges <= maximumAtomicUnit
+        spectrum = numpy.zeros(maximumAtomicUnit)
+        spectrum[self.massToCharges[inRange] - 1] = self.intensities[inRange]
+        return spectrum
+
+    def intensityAt(self, massToCharge):
+        """
+        This function returns the intensity at one m/z, 0.0 if there is no peak there
+        """
+        import numpy
+
+        position = numpy.searchsorted(self.massToCharges, massToCharge)
+        if position < len(self) and self.massToCharges[position] == massToCharge:
+            return float(self.intensities[position])
+        return 0.0
+
+    def merge(self, other, duplicatePolicy='sum'):
+        """
+        This function combines the peaks of two spectra, e.g. to add up the spectra of a mixture
+        INPUT: other ( PeakList ) | duplicatePolicy ( what to do with m/z values present in both: 'sum', 'max' or 'last' to keep other's intensity )
+        OUTPUT: merged ( new PeakList )
+        """
+        import numpy
+
+        return PeakList(numpy.concatenate((self.massToCharges, other.massToCharges)), numpy.concatenate((self.intensities, other.intensities)), duplicatePolicy)
+
+    def normalized(self, maximumIntensity=100.0):
+        """
+        This function returns the spectrum scaled so that its largest peak has the intensity maximumIntensity ( e.g. 100, or 999 as in NIST spectra )
+        """
+        scaled = PeakList()
+        scaled.massToCharges = self.massToCharges.copy()
+        scaled.intensities = self.intensities * (maximumIntensity / self.intensities.max()) if len(self) else self.intensities.copy()
+        return scaled
+
+    def dot(self, other):
+        """
+        This function returns the dot product of two spectra, summed over the m/z values present in both
+        """
+        import numpy
+
+        common, selfPositions, otherPositions = numpy.intersect1d(self.massToCharges, other.massToCharges, assume_unique=True, return_indices=True)
+        return float(numpy.dot(self.intensities[selfPositions], other.intensities[otherPositions]))
+
+    def cosineSimilarity(self, other):
+        """
+        This function compares two spectra: 1.0 for spectra with the same relative intensities, 0.0 for spectra with no m/z value in common ( or an empty spectrum )
+        """
+        import numpy
+
+        norms = numpy.linalg.norm(self.intensities) * numpy.linalg.norm(other.intensities)
+        if norms == 0:
+            return 0.0
+        return self.dot(other) / norms
+
+#Names of the metadata columns that SpectraMatrix keeps in parallel with the spectra, in the order exportToCSV expects them
+SpectraMetadataColumns = ('MoleculeNames', 'ENumbers', 'MWeights', 'knownMoleculeIonizationTypes', 'knownIonizationFactorsRelativeToN2', 'SourceOfFragmentationPatterns', 'SourceOfIonizationData')
+
+class SpectraMatrix:
+    """
+    This class holds many binned spectra as one numpy 2-D array of shape (molecules x m/z) along with the parallel metadata columns of those molecules.
+    Rows are stored in a preallocated buffer that doubles in size when full, so appending a molecule is amortized O(1).
+    Row i, column j holds the intensity of molecule i at m/z j+1 (the same layout as createArray).
+    Spectra resampled onto a common grid ( e.g. IR spectra by SpectraResampling ) are held with that grid: column j then holds the value at grid[j], in gridUnits ( e.g. 'wavenumbers (1/cm)' ), and the exporters write the grid values instead of m/z.
+    """
+
+    def __init__(self, maximumAtomicUnit=None, initialCapacity=64, grid=None, gridUnits=None):
+        import numpy
+
+        if grid is not None:
+            grid = numpy.asarray(grid, dtype=numpy.float64)
+            maximumAtomicUnit = len(grid)
+        if maximumAtomicUnit is None:
+            maximumAtomicUnit = MaximumAtomicUnit
+        self.maximumAtomicUnit = maximumAtomicUnit
+        self.grid = grid
+        self.gridUnits = gridUnits
+        self.numberOfSpectra = 0
+        self.buffer = numpy.zeros((max(1, initialCapacity), maximumAtomicUnit))
+        self.metadata = {columnName: [] for columnName in SpectraMetadataColumns}
+
+    def __len__(self):
+        return self.numberOfSpectra
+
+    @property
+    def spectra(self):
+        """
+        The filled part of the buffer as a (molecules x m/z) numpy view. It is invalidated by the next append that grows the buffer.
+        """
+        return self.buffer[:self.numberOfSpectra]
+
+    def growTo(self, requiredCapacity):
+        """
+        This function makes sure the buffer can hold requiredCapacity rows, doubling its size as many times as needed
+        INPUT: requiredCapacity ( number of rows the buffer must be able to hold )
+        """
+        import numpy
+
+        capacity = self.buffer.shape[0]
+        if requiredCapacity <= capacity:
+            return
+        capacity = max(1, capacity) #A buffer loaded by loadFromBinary can have no rows
+        while capacity < requiredCapacity:
+            capacity = capacity * 2
+        newBuffer = numpy.zeros((capacity, self.maximumAtomicUnit))
+        newBuffer[:self.numberOfSpectra] = self.spectra
+        self.buffer = newBuffer
+
+    def append(self, spectrum, **metadata):
+        """
+        This function adds one spectrum with its metadata as a new row
+        INPUT: spectrum ( binned spectrum, index i holds m/z i+1, or PeakList. Longer spectra are truncated and shorter ones are zero padded ) | metadata ( keyword arguments named after SpectraMetadataColumns, missing ones are stored as '' )
+        OUTPUT: rowIndex ( index of the new row )
+        """
+        import numpy
+
+        unknownColumns = set(metadata) - set(SpectraMetadataColumns)
+        if unknownColumns:
+            raise KeyError(f"Unknown metadata columns {sorted(unknownColumns)}. Expected any of {SpectraMetadataColumns}")
+
+        self.growTo(self.numberOfSpectra + 1)
+        if isinstance(spectrum, PeakList):
+            spectrum = spectrum.toArray(self.maximumAtomicUnit)
+        spectrum = numpy.asarray(spectrum, dtype=numpy.float64)[:self.maximumAtomicUnit]
+        rowIndex = self.numberOfSpectra
+        self.buffer[rowIndex, :spectrum.size] = spectrum
+        self.buffer[rowIndex, spectrum.size:] = 0
+        for columnName in SpectraMetadataColumns:
+            self.metadata[columnName].append(metadata.get(columnName, ''))
+        self.numberOfSpectra = rowIndex + 1
+        return rowIndex
+
+    def extend(self, other):
+        """
+        This function appends every row (and metadata) of another SpectraMatrix, or every row of a 2-D array
+        INPUT: other ( SpectraMatrix or 2-D array-like of binned spectra )
+        """
+        import numpy
+
+        if isinstance(other, SpectraMatrix):
+            rows = other.spectra
+            otherMetadata = other.metadata
+        else:
+            rows = numpy.atleast_2d(numpy.asarray(other, dtype=numpy.float64))
+            otherMetadata = {columnName: [''] * len(rows) for columnName in SpectraMetadataColumns}
+
+        width = min(rows.shape[1], self.maximumAtomicUnit)
+        start = self.numberOfSpectra
+        self.growTo(start + len(rows))
+        self.buffer[start:start + len(rows)] = 0
+        self.buffer[start:start + len(rows), :width] = rows[:, :width]
+        for columnName in SpectraMetadataColumns:
+            self.metadata[columnName].extend(otherMetadata[columnName])
+        self.numberOfSpectra = start + len(rows)
+
+    def row(self, index):
+        """
+        This function returns the spectrum of one molecule as a numpy view
+        INPUT: index ( row index of the molecule )
+        OUTPUT: spectrum ( 1-D array, index i holds m/z i+1 )
+        """
+        if not -self.numberOfSpectra <= index < self.numberOfSpectra:
+            raise IndexError(f"Row {index} out of range for {self.numberOfSpectra} spectra")
+        return self.spectra[index]
+
+    def column(self, massToCharge):
+        """
+        This function returns the intensities of every molecule at one m/z as a numpy view
+        INPUT: massToCharge ( integer m/z value, from 1 to maximumAtomicUnit )
+        OUTPUT: intensities ( 1-D array with one entry per molecule )
+        """
+        if not 1 <= massToCharge <= self.maximumAtomicUnit:
+            raise IndexError(f"m/z {massToCharge} out of range 1..{self.maximumAtomicUnit}")
+        return self.spectra[:, massToCharge - 1]
+
+class SparseSpectraMatrix:
+    """
+    This class holds many binned spectra in compressed sparse row form: only the nonzero bins are kept, as one array of m/z values and one array of intensities, with rowStarts[i] the position of the first peak of molecule i. The metadata columns are kept as in SpectraMatrix.
+    Memory grows with the number of peaks rather than with molecules x m/z, and the m/z range can be detected from the data instead of being fixed. Spectra are only expanded to the dense (molecules x m/z) layout of SpectraMatrix when asked for, e.g. by exportToBinary.
+    """
+
+    def __init__(self, maximumAtomicUnit=None, initialCapacity=64, initialPeakCapacity=None):
+        """
+        INPUT: maximumAtomicUnit ( largest m/z kept, defaults to MaximumAtomicUnit. With 'auto' no peak is dropped and maximumAtomicUnit follows the largest m/z appended ) | initialCapacity ( rows preallocated ) | initialPeakCapacity ( peaks preallocated, 32 per row if not given )
+        """
+        import numpy
+
+        if maximumAtomicUnit is None:
+            maximumAtomicUnit = MaximumAtomicUnit
+        self.massToChargeLimit = None if maximumAtomicUnit == 'auto' else maximumAtomicUnit #None when the range is detected from the data
+        self.maximumAtomicUnit = 0 if maximumAtomicUnit == 'auto' else maximumAtomicUnit
+        if initialPeakCapacity is None:
+            initialPeakCapacity = 32 * max(1, initialCapacity)
+        self.numberOfSpectra = 0
+        self.numberOfPeaks = 0
+        self.rowStarts = numpy.zeros(max(1, initialCapacity) + 1, dtype=numpy.int64)
+        self.massToCharges = numpy.zeros(max(1, initialPeakCapacity), dtype=numpy.int32)
+        self.intensities = numpy.zeros(max(1, initialPeakCapacity))
+        self.metadata = {columnName: [] for columnName in SpectraMetadataColumns}
+
+    def __len__(self):
+        return self.numberOfSpectra
+
+    def growTo(self, requiredCapacity, requiredPeakCapacity):
+        """
+        This function makes sure the buffers can hold requiredCapacity rows and requiredPeakCapacity peaks, doubling their sizes as many times as needed
+        """
+        import numpy
+
+        def grown(buffer, requiredSize, usedSize):
+            size = max(1, buffer.size)
+            if requiredSize <= size:
+                return buffer
+            while size < requiredSize:
+                size = size * 2
+            newBuffer = numpy.zeros(size, dtype=buffer.dtype)
+            newBuffer[:usedSize] = buffer[:usedSize]
+            return newBuffer
+
+        self.rowStarts = grown(self.rowStarts, requiredCapacity + 1, self.numberOfSpectra + 1)
+        self.massToCharges = grown(self.massToCharges, requiredPeakCapacity, self.numberOfPeaks)
+        self.intensities = grown(self.intensities, requiredPeakCapacity, self.numberOfPeaks)
+
+    def appendPeaks(self, massToCharges, intensities, **metadata):
+        """
+        This function adds one spectrum given as its peaks, with its metadata, as a new row
+        INPUT: massToCharges ( distinct integer m/z values, in any order ) | intensities ( intensity of each m/z. Zero intensities are not stored ) | metadata ( as for SpectraMatrix.append )
+        OUTPUT: rowIndex ( index of the new row )
+        """
+        import numpy
+
+        unknownColumns = set(metadata) - set(SpectraMetadataColumns)
+        if unknownColumns:
+            raise KeyError(f"Unknown metadata columns {sorted(unknownColumns)}. Expected any of {SpectraMetadataColumns}")
+
+        massToCharges = numpy.asarray(massToCharges, dtype=numpy.int32).ravel()
+        intensities = numpy.asarray(intensities, dtype=numpy.float64).ravel()
+        if massToCharges.shape != intensities.shape:
+            raise ValueError(f"massToCharges and intensities must have the same length, got {massToCharges.size} and {intensities.size}")
+        keep = (intensities != 0) & (massToCharges >= 1)
+        if self.massToChargeLimit is not None:
+            keep &= (massToCharges <= self.massToChargeLimit)
+        massToCharges = massToCharges[keep]
+        intensities = intensities[keep]
+        if massToCharges.size > 1 and (massToCharges[1:] <= massToCharges[:-1]).any():
+            order = numpy.argsort(massToCharges, kind='stable')
+            massToCharges = massToCharges[order]
+            intensities = intensities[order]
+
+        rowIndex = self.numberOfSpectra
+        start = self.numberOfPeaks
+        self.growTo(rowIndex + 1, start + massToCharges.size)
+        self.massToCharges[start:start + massToCharges.size] = massToCharges
+        self.intensities[start:start + massToCharges.size] = intensities
+        self.numberOfPeaks = start + massToCharges.size
+        self.rowStarts[rowIndex + 1] = self.numberOfPeaks
+        if self.massToChargeLimit is None and massToCharges.size:
+            self.maximumAtomicUnit = max(self.maximumAtomicUnit, int(massToCharges[-1]))
+        for columnName in SpectraMetadataColumns:
+            self.metadata[columnName].append(metadata.get(columnName, ''))
+        self.numberOfSpectra = rowIndex + 1
+        return rowIndex
+
+    def append(self, spectrum, **metadata):
+        """
+        This function adds one binned spectrum with its metadata as a new row
+        INPUT: spectrum ( binned spectrum, index i holds m/z i+1, of any length, or PeakList ) | metadata ( as for SpectraMatrix.append )
+        OUTPUT: rowIndex ( index of the new row )
+        """
+        import numpy
+
+        if isinstance(spectrum, PeakList):
+            return self.appendPeaks(spectrum.massToCharges, spectrum.intensities, **metadata)
+        spectrum = numpy.asarray(spectrum, dtype=numpy.float64).ravel()
+        if self.massToChargeLimit is not None:
+            spectrum = spectrum[:self.massToChargeLimit]
+        massIndices = numpy.flatnonzero(spectrum)
+        return self.appendPeaks(massIndices + 1, spectrum[massIndices], **metadata)
+
+    def extend(self, other):
+        """
+        This function appends every row (and metadata) of another SparseSpectraMatrix or SpectraMatrix, or every row of a 2-D array
+        INPUT: other ( SparseSpectraMatrix, SpectraMatrix or 2-D array-like of binned spectra )
+        """
+        import numpy
+
+        if isinstance(other, SparseSpectraMatrix):
+            otherMetadata = other.metadata
+            rowStarts = other.rowStarts[:other.numberOfSpectra + 1]
+            massToCharges = other.massToCharges[:other.numberOfPeaks]
+            intensities = other.intensities[:other.numberOfPeaks]
+        else:
+            if isinstance(other, SpectraMatrix):
+                rows = other.spectra
+                otherMetadata = other.metadata
+            else:
+                rows = numpy.atleast_2d(numpy.asarray(other, dtype=numpy.float64))
+                otherMetadata = {columnName: [''] * len(rows) for columnName in SpectraMetadataColumns}
+            rowIndices, massIndices = numpy.nonzero(rows) #In row order, and by m/z within a row
+            rowStarts = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(rowIndices, minlength=len(rows)), out=rowStarts[1:])
+            massToCharges = (massIndices + 1).astype(numpy.int32)
+            intensities = rows[rowIndices, massIndices]
+
+        if self.massToChargeLimit is not None and massToCharges.size and massToCharges.max() > self.massToChargeLimit:
+            #Drop the peaks above the range, and move the row starts down by the number of peaks dropped before them
+            keep = massToCharges <= self.massToChargeLimit
+            droppedBefore = numpy.concatenate(([0], numpy.cumsum(~keep)))
+            rowStarts = rowStarts - droppedBefore[rowStarts - rowStarts[0]]
+            massToCharges = massToCharges[keep]
+            intensities = intensities[keep]
+
+        numberOfRows = len(rowStarts) - 1
+        start = self.numberOfSpectra
+        peakStart = self.numberOfPeaks
+        self.growTo(start + numberOfRows, peakStart + massToCharges.size)
+        self.massToCharges[peakStart:peakStart + massToCharges.size] = massToCharges
+        self.intensities[peakStart:peakStart + massToCharges.size] = intensities
+        self.rowStarts[start + 1:start + numberOfRows + 1] = rowStarts[1:] - rowStarts[0] + peakStart
+        self.numberOfPeaks = peakStart + massToCharges.size
+        if self.massToChargeLimit is None and massToCharges.size:
+            self.maximumAtomicUnit = max(self.maximumAtomicUnit, int(massToCharges.max()))
+        for columnName in SpectraMetadataColumns:
+            self.metadata[columnName].extend(otherMetadata[columnName])
+        self.numberOfSpectra = start + numberOfRows
+
+    def peaks(self, index):
+        """
+        This function returns the peaks of one molecule as numpy views
+        INPUT: index ( row index of the molecule )
+        OUTPUT: massToCharges ( m/z values of the nonzero bins, in increasing order ) | intensities ( intensity at each of those m/z values )
+        """
+        if not -self.numberOfSpectra <= index < self.numberOfSpectra:
+            raise IndexError(f"Row {index} out of range for {self.numberOfSpectra} spectra")
+        if index < 0:
+            index = index + self.numberOfSpectra
+        start, end = self.rowStarts[index], self.rowStarts[index + 1]
+        return self.massToCharges[start:end], self.intensities[start:end]
+
+    def peakList(self, index):
+        """
+        This function returns a copy of the peaks of one molecule as a PeakList
+        """
+        massToCharges, intensities = self.peaks(index)
+        peakList = PeakList()
+        peakList.massToCharges, peakList.intensities = massToCharges.copy(), intensities.copy()
+        return peakList
+
+    def normalize(self, maximumIntensity=100.0):
+        """
+        This function scales every spectrum in place so that its largest peak has the intensity maximumIntensity, as PeakList.normalized does, working on the stored peaks only
+        """
+        import numpy
+
+        intensities = self.intensities[:self.numberOfPeaks]
+        nonempty = numpy.flatnonzero(numpy.diff(self.rowStarts[:self.numberOfSpectra + 1]) > 0)
+        if nonempty.size == 0:
+            return
+        largest = numpy.maximum.reduceat(intensities, self.rowStarts[nonempty])
+        scale = numpy.zeros(self.numberOfSpectra)
+        scale[nonempty] = maximumIntensity / largest
+        intensities *= scale[self.rowIndices()]
+
+    def row(self, index):
+        """
+        This function returns the spectrum of one molecule in dense form, as SpectraMatrix.row does
+        INPUT: index ( row index of the molecule )
+        OUTPUT: spectrum ( 1-D array of length maximumAtomicUnit, index i holds m/z i+1 )
+        """
+        import numpy
+
+        massToCharges, intensities = self.peaks(index)
+        spectrum = numpy.zeros(self.maximumAtomicUnit)
+        spectrum[massToCharges - 1] = intensities
+        return spectrum
+
+    def rowIndices(self):
+        """
+        This function returns the row index of every stored peak, in storage order
+        """
+        import numpy
+
+        return numpy.repeat(numpy.arange(self.numberOfSpectra), numpy.diff(self.rowStarts[:self.numberOfSpectra + 1]))
+
+    def column(self, massToCharge):
+        """
+        This function returns the intensities of every molecule at one m/z
+        INPUT: massToCharge ( integer m/z value, from 1 to maximumAtomicUnit )
+        OUTPUT: intensities ( 1-D array with one entry per molecule )
+        """
+        import numpy
+
+        if not 1 <= massToCharge <= self.maximumAtomicUnit:
+            raise IndexError(f"m/z {massToCharge} out of range 1..{self.maximumAtomicUnit}")
+        atMassToCharge = self.massToCharges[:self.numberOfPeaks] == massToCharge
+        intensities = numpy.zeros(self.numberOfSpectra)
+        intensities[self.rowIndices()[atMassToCharge]] = self.intensities[:self.numberOfPeaks][atMassToCharge]
+        return intensities
+
+    @property
+    def spectra(self):
+        """
+        The spectra expanded to a new dense (molecules x maximumAtomicUnit) numpy array, as held by SpectraMatrix
+        """
+        import numpy
+
+        spectraArray = numpy.zeros((self.numberOfSpectra, self.maximumAtomicUnit))
+        spectraArray[self.rowIndices(), self.massToCharges[:self.numberOfPeaks] - 1] = self.intensities[:self.numberOfPeaks]
+        return spectraArray
+
+    def toSpectraMatrix(self):
+        """
+        This function returns the spectra and metadata as a dense SpectraMatrix
+        """
+        AllSpectraData = SpectraMatrix(maximumAtomicUnit=max(1, self.maximumAtomicUnit), initialCapacity=self.numberOfSpectra)
+        AllSpectraData.extend(self.spectra)
+        AllSpectraData.metadata = {columnName: list(column) for columnName, column in self.metadata.items()}
+        return AllSpectraData
@@ -0,0 +1,233 @@
+'''
+SpectraResampling.py puts IR and UV spectra onto one common grid, so that a library of them can be held, searched and
+exported as one (molecules x grid points) matrix like the binned mass spectra. Each JDX file has its own grid of
+wavenumbers or wavelengths. JCampSG.JCAMP_calc_xsec_batch converts the spectra to cross-sections (or absorbances)
+and a SpectraResampler linearly interpolates them onto the common grid.
+The interpolation plan of a source grid ( the positions of the common grid points between the source points, and
+their weights ) is computed once and reused for every spectrum on an identical grid, which is common as spectra from
+the same instrument share their settings. The spectra of one source grid are then resampled together, a batch at a
+time, with a few numpy operations over the whole batch.
+Example:
+    grid = SpectraResampling.makeGrid(500.0, 4000.0, 1.0)
+    AllSpectra, failures = SpectraResampling.resampleJDXFiles(JDXFilesList, grid)
+    JDXConverter.exportToCSV('OutputFiles\\ConvertedIRSpectra.csv', AllSpectra)
+'''
+
+import concurrent.futures
+import multiprocessing
+import os
+
+import numpy
+
+import Instrumentation
+import JCampSG
+import SpectraContainers
+
+#Abscissa of the common grid -> ( row of JCAMP_calc_xsec_batch, units written by the exporters )
+Abscissae = {'wavelengths': (0, 'wavelengths (um)'), 'wavenumbers': (1, 'wavenumbers (1/cm)')}
+#Values resampled -> row of JCAMP_calc_xsec_batch
+ResampledValues = {'absorbance': 2, 'xsec': 3}
+
+def makeGrid(start, stop, step):
+    """
+    This function returns an evenly spaced grid from start to stop, stop included if it falls on a step
+    INPUT: start | stop | step ( all in the units of the abscissa. Example: makeGrid(500.0, 4000.0, 0.5) for wavenumbers )
+    OUTPUT: grid ( 1-D float64 array )
+    """
+    if step <= 0 or stop < start:
+        raise ValueError(f'A grid needs start <= stop and a positive step, not {start}, {stop}, {step}')
+    numberOfPoints = int(numpy.floor((stop - start) / step + 1e-9)) + 1
+    return start + step * numpy.arange(numberOfPoints)
+
+def getInterpolationPlan(sourceGrid, grid):
+    """
+    This function works out how to interpolate linearly from the points of sourceGrid to those of grid, whatever the values
+    INPUT: sourceGrid ( abscissa of a spectrum, in any order ) | grid ( common grid )
+    OUTPUT: plan ( tuple of: order ( None if sourceGrid is increasing, a reversing slice if it is decreasing, otherwise the indices sorting it ) | left, right ( for each grid point, the indices in the sorted source of the points around it ) | weights ( weight of the right point ) | outside ( True for the grid points out of the source range ) )
+    """
+    numberOfPoints = len(sourceGrid)
+    order = None
+    if numberOfPoints > 1 and sourceGrid[0] > sourceGrid[-1] and numpy.all(sourceGrid[1:] <= sourceGrid[:-1]):
+        order = slice(None, None, -1)
+    elif numberOfPoints > 1 and not numpy.all(sourceGrid[1:] >= sourceGrid[:-1]):
+        order = numpy.argsort(sourceGrid, kind='stable')
+    sortedGrid = sourceGrid if order is None else sourceGrid[order]
+
+    if numberOfPoints == 0:
+        zeros = numpy.zeros(len(grid), dtype=numpy.intp)
+        return order, zeros, zeros, numpy.zeros(len(grid)), numpy.ones(len(grid), dtype=bool)
+    right = numpy.clip(numpy.searchsorted(sortedGrid, grid, side='right'), 1, max(1, numberOfPoints - 1))
+    left = right - 1
+    if numberOfPoints == 1:
+        right = left
+    spacing = sortedGrid[right] - sortedGrid[left]
+    hasSpacing = spacing > 0
+    weights = numpy.where(hasSpacing, (grid - sortedGrid[left]) / numpy.where(hasSpacing, spacing, 1.0), 0.0)
+    outside = ~((grid >= sortedGrid[0]) & (grid <= sortedGrid[-1]))
+    return order, left, right, weights, outside
+
+class SpectraResampler:
+    """
+    This class resamples spectra onto one common grid by linear interpolation. The interpolation plans of the source grids it has seen are kept, so spectra sharing a source grid only pay for the interpolation itself
+    INPUT: grid ( common grid, e.g. from makeGrid ) | fillValue ( value of the grid points outside the range of a spectrum ) | elementsPerBatch ( bound on the number of values, spectra x points, interpolated at a time )
+    """
+
+    def __init__(self, grid, fillValue=0.0, elementsPerBatch=2**18):
+        self.grid = numpy.asarray(grid, dtype=numpy.float64)
+        self.fillValue = fillValue
+        self.elementsPerBatch = elementsPerBatch
+        self.plans = [] #plans of getInterpolationPlan, in the order they were made
+        self.sourceGrids = {} #(number of points, first point, last point) -> list of (source grid, position of its plan in self.plans)
+
+    def getPlan(self, sourceGrid):
+        """
+        This function returns the interpolation plan of a source grid, from the plans kept if an identical grid was seen before
+        INPUT: sourceGrid ( abscissa of a spectrum )
+        OUTPUT: planIndex ( position of the plan in self.plans ) | plan ( as for getInterpolationPlan )
+        """
+        sourceGrid = numpy.asarray(sourceGrid, dtype=numpy.float64)
+        #Grids are told apart by their ends first, so a full comparison is only made with grids that may be identical
+        gridKey = (len(sourceGrid), sourceGrid[0], sourceGrid[-1]) if len(sourceGrid) else (0,)
+        candidates = self.sourceGrids.setdefault(gridKey, [])
+        for knownGrid, planIndex in candidates:
+            if knownGrid is sourceGrid or numpy.array_equal(knownGrid, sourceGrid):
+                Instrumentation.count('interpolation plans reused')
+                return planIndex, self.plans[planIndex]
+        plan = getInterpolationPlan(sourceGrid, self.grid)
+        self.plans.append(plan)
+        candidates.append((sourceGrid.copy(), len(self.plans) - 1))
+        Instrumentation.count('interpolation plans')
+        return len(self.plans) - 1, plan
+
+    def resample(self, sourceGrids, values, out=None, rows=None):
+        """
+        This function resamples spectra onto the common grid. The spectra are grouped by source grid, and each group is interpolated a batch of spectra at a time
+        INPUT: sourceGrids ( list of the abscissae of the spectra ) | values ( list of the values of the spectra, each as long as its abscissa ) | out ( 2-D float64 array of grid width to write the spectra into, a new one if not given ) | rows ( row of out of each spectrum, 0, 1, 2... if not given )
+        OUTPUT: out ( (spectra x grid points) array, row rows[i] holds spectrum i on the common grid )
+        """
+        if out is None:
+            out = numpy.empty((len(values), len(self.grid)))
+        if rows is None:
+            rows = range(len(values))
+
+        groups = {} #position of the plan in self.plans -> (plan, positions of the spectra in values)
+        for position, sourceGrid in enumerate(sourceGrids):
+            if len(sourceGrid) != len(values[position]):
+                raise ValueError(f'Spectrum {position} has {len(values[position])} values for {len(sourceGrid)} abscissa points')
+            planIndex, plan = self.getPlan(sourceGrid)
+            groups.setdefault(planIndex, (plan, []))[1].append(position)
+
+        with Instrumentation.stage('resampling'):
+            for plan, positions in groups.values():
+                order, left, right, weights, outside = plan
+                if len(values[positions[0]]) == 0:
+                    out[[rows[position] for position in positions]] = self.fillValue
+                    continue
+                spectraPerBatch = max(1, self.elementsPerBatch // max(len(values[positions[0]]), len(self.grid)))
+                for batchStart in range(0, len(positions), spectraPerBatch):
+                    batchPositions = positions[batchStart:batchStart + spectraPerBatch]
+                    sourceValues = numpy.stack([numpy.asarray(values[position], dtype=numpy.float64) for position in batchPositions])
+                    if order is not None:
+                        sourceValues = sourceValues[:, order]
+                    #left + weights * (right - left), computed in the arrays of the right and left values
+                    rightValues = sourceValues[:, right]
+                    leftValues = sourceValues[:, left]
+                    numpy.subtract(rightValues, leftValues, out=rightValues)
+                    numpy.multiply(rightValues, weights, out=rightValues)
+                    numpy.add(rightValues, leftValues, out=rightValues)
+                    rightValues[:, outside] = self.fillValue
+                    out[[rows[position] for position in batchPositions]] = rightValues
+        return out
+
+    def resampleJCAMP(self, jcampDicts, abscissa='wavenumbers', values='xsec', skip_nonquant=True, out=None, rows=None):
+        """
+        This function converts parsed IR or UV spectra with JCampSG.JCAMP_calc_xsec_batch and resamples them onto the common grid
+        INPUT: jcampDicts ( list of dictionaries of JCampSG.JCAMP_reader ) | abscissa ( any of the keys of Abscissae, the abscissa of the common grid ) | values ( 'xsec' for cross-sections in m^2 per molecule, 'absorbance' ) | skip_nonquant ( as for JCAMP_calc_xsec_batch. Only used for cross-sections, absorbances need no path length or partial pressure ) | out, rows ( as for resample, one row per dictionary )
+        OUTPUT: out ( as for resample. The rows of skipped spectra are not written ) | slices ( as for JCAMP_calc_xsec_batch, None for the skipped spectra )
+        """
+        abscissaRow = Abscissae[abscissa][0]
+        valuesRow = ResampledValues[values]
+        if out is None:
+            out = numpy.full((len(jcampDicts), len(self.grid)), float(self.fillValue))
+        if rows is None:
+            rows = range(len(jcampDicts))
+        with Instrumentation.stage('cross section'):
+            stacked, slices = JCampSG.JCAMP_calc_xsec_batch(jcampDicts, skip_nonquant=skip_nonquant and values == 'xsec')
+        converted = [position for position, span in enumerate(slices) if span is not None]
+        self.resample([stacked[abscissaRow, slices[position]] for position in converted], [stacked[valuesRow, slices[position]] for position in converted],
+                      out=out, rows=[rows[position] for position in converted])
+        return out, slices
+
+def readJDXFile(filename):
+    """
+    This function reads one JDX file in a process of resampleJDXFiles. IR and UV files can be large, so it is memory-mapped ( JCampSG.JCAMP_mmap_reader )
+    OUTPUT: jcampDict ( dictionary of JCampSG.JCAMP_reader, None if the file could not be read ) | error ( None, or the description of the error )
+    """
+    try:
+        return JCampSG.JCAMP_mmap_reader(filename), None
+    except Exception as error:
+        return None, f'{type(error).__name__}: {error}'
+
+def resampleJDXFiles(JDXFilesList, grid, abscissa='wavenumbers', values='xsec', fillValue=0.0, skip_nonquant=True, max_workers=None, spectraPerBatch=256):
+    """
+    This function builds a library of IR or UV spectra on a common grid from JDX files. The files are read on a pool of processes, and converted and resampled spectraPerBatch files at a time
+    INPUT: JDXFilesList ( list of path+filename ) | grid ( common grid, e.g. from makeGrid ) | abscissa, values, skip_nonquant ( as for SpectraResampler.resampleJCAMP ) | fillValue ( as for SpectraResampler ) | max_workers ( number of processes reading files, the number of CPUs if not given. With 1 the files are read in this process ) | spectraPerBatch ( files converted at a time )
+    OUTPUT: AllSpectraData ( SpectraMatrix with the grid, one row per JDX file in the order of JDXFilesList, the titles of the files as MoleculeNames and the file names as SourceOfFragmentationPatterns. The rows of files that failed are all fillValue ) | failures ( list of (filename, error) pairs for the files that could not be used, in the order of JDXFilesList )
+    With max_workers above 1 the reading processes are started with spawn, which imports the main module of the program again in each of them. A script calling this function must then do so under if __name__ == '__main__':, otherwise the pool fails with concurrent.futures.process.BrokenProcessPool
+    """
+    resampler = SpectraResampler(grid, fillValue=fillValue)
+    AllSpectraData = SpectraContainers.SpectraMatrix(initialCapacity=len(JDXFilesList), grid=resampler.grid, gridUnits=Abscissae[abscissa][1])
+    AllSpectraData.buffer[:] = fillValue
+    AllSpectraData.numberOfSpectra = len(JDXFilesList)
+    #The JDX files carry no electron numbers, masses or ionization data, so they are written as for molecules found online
+    for columnName in ('knownMoleculeIonizationTypes', 'knownIonizationFactorsRelativeToN2', 'SourceOfIonizationData'):
+        AllSpectraData.metadata[columnName] = ['unknown'] * len(JDXFilesList)
+    AllSpectraData.metadata['ENumbers'] = [0] * len(JDXFilesList)
+    AllSpectraData.metadata['MWeights'] = [0] * len(JDXFilesList)
+    AllSpectraData.metadata['MoleculeNames'] = [''] * len(JDXFilesList)
+    AllSpectraData.metadata['SourceOfFragmentationPatterns'] = [os.path.basename(filename) for filename in JDXFilesList]
+    failures = {}
+
+    def resampleBatch(batch):
+        #batch is a list of (row, jcampDict) pairs
+        jcampDicts = [jcampDict for row, jcampDict in batch]
+        try:
+            unused, slices = resampler.resampleJCAMP(jcampDicts, abscissa=abscissa, values=values, skip_nonquant=skip_nonquant,
+                                                     out=AllSpectraData.buffer, rows=[row for row, jcampDict in batch])
+        except (ValueError, KeyError) as error:
+            #One spectrum with unknown units, or with fewer y than x values, spoils the batch, so the spectra are converted one at a time to find it
+            if len(batch) > 1:
+                for pair in batch:
+                    resampleBatch([pair])
+            else:
+                failures[batch[0][0]] = f'{type(error).__name__}: {error}'
+            return
+        for (row, jcampDict), span in zip(batch, slices):
+            AllSpectraData.metadata['MoleculeNames'][row] = jcampDict.get('title', '')
+            if span is None:
+                failures[row] = 'no path length or partial pressure to compute cross-sections'
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(JDXFilesList)))
+    def collectResults(results):
+        #executor.map returns the files in the order of JDXFilesList, so a batch is resampled as soon as its files are read
+        batch = []
+        for row, (jcampDict, error) in enumerate(results):
+            if error is not None:
+                failures[row] = error
+                continue
+            batch.append((row, jcampDict))
+            if len(batch) == spectraPerBatch:
+                resampleBatch(batch)
+                batch = []
+        if batch:
+            resampleBatch(batch)
+
+    if max_workers == 1:
+        collectResults(map(readJDXFile, JDXFilesList))
+    else:
+        #The reading processes are started with spawn, as StreamingConversion and AsyncConversion do, since forking a process whose threads hold locks is not safe
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            collectResults(executor.map(readJDXFile, JDXFilesList, chunksize=max(1, min(spectraPerBatch, len(JDXFilesList) // (max_workers * 4)))))
+    return AllSpectraData, [(JDXFilesList[row], failures[row]) for row in sorted(failures)]
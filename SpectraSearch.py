@@ -0,0 +1,223 @@
+'''
+SpectraSearch.py identifies unknown mass spectra by comparing them with a library of converted spectra, e.g. the
+SpectraMatrix of getSpectrumDataFromLocalJDXInParallel or a library written by exportToBinary.
+A SpectraSearchIndex keeps the library as dense float32 matrices of unit length rows, one per scoring method, so
+that scoring a batch of queries against the whole library is a single matrix product:
+    'cosine'       the cosine of the angle between the two spectra, from 0.0 to 1.0.
+    'matchFactor'  the NIST dot-product match factor, from 0 to 999: the squared cosine of the spectra weighted by
+                   (m/z)**3 * intensity**0.6, which favours the heavier, more specific peaks.
+With the prefilter, only the library spectra that have one of the query's main peaks among their own main peaks are
+scored. The main peaks are the largest peaks of the match factor weighted spectrum, so heavy, specific peaks are
+preferred over the small fragments most spectra share. The prefilter index maps each m/z to the library spectra
+having it among their main peaks, so the number of spectra scored depends on how common the query's main peaks are
+rather than on the size of the library. Without the prefilter every library spectrum is scored, and the results are
+exact.
+Example:
+    index = SpectraSearch.SpectraSearchIndex(JDXConverter.loadFromBinary('OutputFiles\\ConvertedSpectraBinary1.spectra'))
+    for MoleculeName, score, rowIndex in index.search(unknownSpectrum, topHits=5):
+        print(MoleculeName, score)
+'''
+
+import numpy
+
+import Instrumentation
+import JDXConverter
+import SpectraContainers
+
+#The exponents of the NIST match factor weights (m/z)**massWeightExponent * intensity**intensityWeightExponent
+massWeightExponent = 3.0
+intensityWeightExponent = 0.6
+
+SearchMethods = ('cosine', 'matchFactor')
+
+
+def getSpectraRows(spectra, width):
+    """
+    This function turns any of the spectra collections of JDXConverter into a (spectra x m/z) float64 array of the given width
+    INPUT: spectra ( SpectraMatrix, SparseSpectraMatrix, PeakList, list of PeakLists, 1-D binned spectrum or 2-D array of binned spectra ) | width ( number of m/z columns, longer spectra are truncated and shorter ones zero padded )
+    OUTPUT: spectraArray ( 2-D numpy array, column i holds m/z i+1 ) | single ( True if spectra was one spectrum )
+    """
+    if isinstance(spectra, SpectraContainers.PeakList):
+        return spectra.toArray(width)[numpy.newaxis], True
+    if isinstance(spectra, (list, tuple)) and spectra and isinstance(spectra[0], SpectraContainers.PeakList):
+        return numpy.array([peakList.toArray(width) for peakList in spectra]), False
+    spectraArray = JDXConverter.getSpectraArray(spectra) if isinstance(spectra, (SpectraContainers.SpectraMatrix, SpectraContainers.SparseSpectraMatrix)) else numpy.asarray(spectra, dtype=numpy.float64)
+    single = spectraArray.ndim == 1
+    spectraArray = numpy.atleast_2d(spectraArray)
+    if spectraArray.shape[1] >= width:
+        return spectraArray[:, :width], single
+    padded = numpy.zeros((spectraArray.shape[0], width))
+    padded[:, :spectraArray.shape[1]] = spectraArray
+    return padded, single
+
+def getWeightedSpectra(spectraArray, method):
+    """
+    This function applies the weights of a scoring method and scales every spectrum to unit length, so that the dot product of two rows is their cosine
+    INPUT: spectraArray ( (spectra x m/z) array, column i holds m/z i+1 ) | method ( one of SearchMethods )
+    OUTPUT: weightedSpectra ( float32 array of the same shape. Empty spectra stay all zeros )
+    """
+    if method not in SearchMethods:
+        raise ValueError(f"Unknown method '{method}'. Expected one of {list(SearchMethods)}")
+    weightedSpectra = numpy.clip(spectraArray, 0, None).astype(numpy.float32)
+    if method == 'matchFactor':
+        weightedSpectra **= intensityWeightExponent
+        weightedSpectra *= (numpy.arange(1, weightedSpectra.shape[1] + 1, dtype=numpy.float32) ** massWeightExponent)
+    norms = numpy.linalg.norm(weightedSpectra, axis=1)
+    norms[norms == 0] = 1
+    weightedSpectra /= norms[:, numpy.newaxis]
+    return weightedSpectra
+
+def getTopPeaks(spectraArray, numberOfPeaks, rowsPerChunk=8192):
+    """
+    This function returns the m/z indices of the largest peaks of every spectrum
+    INPUT: spectraArray ( (spectra x m/z) array ) | numberOfPeaks ( peaks kept per spectrum ) | rowsPerChunk ( spectra sorted at a time, to bound the size of the temporaries )
+    OUTPUT: rowIndices, massIndices ( parallel arrays with one entry per kept peak. A spectrum with fewer nonzero peaks keeps all of them )
+    """
+    numberOfPeaks = min(numberOfPeaks, spectraArray.shape[1])
+    allRowIndices, allMassIndices = [numpy.zeros(0, dtype=numpy.intp)], [numpy.zeros(0, dtype=numpy.intp)]
+    if numberOfPeaks == 0:
+        return allRowIndices[0], allMassIndices[0]
+    for chunkStart in range(0, spectraArray.shape[0], rowsPerChunk):
+        chunk = spectraArray[chunkStart:chunkStart + rowsPerChunk]
+        massIndices = numpy.argpartition(-chunk, numberOfPeaks - 1, axis=1)[:, :numberOfPeaks].ravel()
+        rowIndices = numpy.repeat(numpy.arange(chunk.shape[0]), numberOfPeaks)
+        isPeak = chunk[rowIndices, massIndices] > 0
+        allRowIndices.append(rowIndices[isPeak] + chunkStart)
+        allMassIndices.append(massIndices[isPeak])
+    return numpy.concatenate(allRowIndices), numpy.concatenate(allMassIndices)
+
+class SpectraSearchIndex:
+    """
+    This class searches a library of binned mass spectra for the spectra most similar to unknown spectra
+    INPUT: library ( any of the spectra collections of getSpectraRows, e.g. a SpectraMatrix ) | MoleculeNames ( one name per library spectrum, taken from the MoleculeNames column of a SpectraMatrix or SparseSpectraMatrix if not given, the row numbers otherwise ) | prefilterPeaks ( number of main peaks, the largest peaks of the match factor weighted spectrum, of each library spectrum kept in the prefilter index )
+    """
+
+    def __init__(self, library, MoleculeNames=None, prefilterPeaks=8):
+        if isinstance(library, (SpectraContainers.SpectraMatrix, SpectraContainers.SparseSpectraMatrix)):
+            width = library.maximumAtomicUnit
+            if MoleculeNames is None:
+                MoleculeNames = library.metadata['MoleculeNames']
+        elif isinstance(library, (list, tuple)) and library and isinstance(library[0], SpectraContainers.PeakList):
+            width = max([int(peakList.massToCharges[-1]) for peakList in library if len(peakList)] + [1])
+        else:
+            width = numpy.atleast_2d(numpy.asarray(library)).shape[1]
+        self.libraryArray, unused = getSpectraRows(library, width)
+        self.maximumAtomicUnit = width
+        self.MoleculeNames = list(MoleculeNames) if MoleculeNames is not None else [str(rowIndex) for rowIndex in range(len(self.libraryArray))]
+        if len(self.MoleculeNames) != len(self.libraryArray):
+            raise ValueError(f"{len(self.MoleculeNames)} MoleculeNames given for {len(self.libraryArray)} library spectra")
+        self.weightedSpectra = {} #method -> weighted library, built on first use
+        self.prefilterPeaks = prefilterPeaks
+
+        #Prefilter index: for each m/z, the library rows having it among their prefilterPeaks main peaks, in compressed sparse form
+        rowIndices, massIndices = getTopPeaks(self.getWeightedLibrary('matchFactor'), prefilterPeaks)
+        order = numpy.argsort(massIndices, kind='stable')
+        self.postings = rowIndices[order].astype(numpy.int32)
+        self.postingStarts = numpy.zeros(width + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(massIndices, minlength=width), out=self.postingStarts[1:])
+
+    def __len__(self):
+        return len(self.libraryArray)
+
+    def getWeightedLibrary(self, method):
+        if method not in self.weightedSpectra:
+            self.weightedSpectra[method] = getWeightedSpectra(self.libraryArray, method)
+        return self.weightedSpectra[method]
+
+    def getCandidates(self, query, queryPeaks=None, minimumSharedPeaks=2, maximumCandidates=1000):
+        """
+        This function selects the library spectra worth scoring for one query with the prefilter index
+        INPUT: query ( 1-D query spectrum, weighted as by getWeightedSpectra with the 'matchFactor' method ) | queryPeaks ( number of main peaks of the query looked up, prefilterPeaks if not given ) | minimumSharedPeaks ( number of those peaks a candidate must have among its own main peaks ) | maximumCandidates ( the candidates sharing the most peaks are kept )
+        OUTPUT: candidates ( sorted array of library row indices )
+        """
+        if queryPeaks is None:
+            queryPeaks = self.prefilterPeaks
+        unused, massIndices = getTopPeaks(query[numpy.newaxis], queryPeaks)
+        if massIndices.size == 0:
+            return numpy.zeros(0, dtype=numpy.intp)
+        postings = numpy.concatenate([self.postings[self.postingStarts[massIndex]:self.postingStarts[massIndex + 1]] for massIndex in massIndices])
+        sharedPeaks = numpy.bincount(postings, minlength=len(self))
+        candidates = numpy.flatnonzero(sharedPeaks >= minimumSharedPeaks)
+        if candidates.size > maximumCandidates:
+            candidates = numpy.sort(candidates[numpy.argpartition(-sharedPeaks[candidates], maximumCandidates - 1)[:maximumCandidates]])
+        return candidates
+
+    def score(self, weightedQueries, weightedLibrary, method):
+        return self.getScores(weightedQueries @ weightedLibrary.T, method)
+
+    def getScores(self, cosines, method):
+        #The match factor is the squared cosine of the weighted spectra, on a 0 to 999 scale
+        if method == 'matchFactor':
+            return 999.0 * cosines * cosines
+        return cosines
+
+    def search(self, queries, topHits=10, method='matchFactor', prefilter=False, minimumSharedPeaks=2, maximumCandidates=1000, bruteForceFraction=0.04, queriesPerBatch=256):
+        """
+        This function finds the library spectra most similar to one or many unknown spectra
+        INPUT: queries ( one spectrum or many, in any of the forms of getSpectraRows ) | topHits ( number of hits returned per query ) | method ( one of SearchMethods ) | prefilter ( True to only score the candidates of getCandidates, which is faster on large libraries of distinct spectra but may miss hits that share few main peaks with the query. False to score the whole library ) | minimumSharedPeaks, maximumCandidates ( see getCandidates ) | bruteForceFraction ( a query with candidates in more than this fraction of the library is scored against the whole library, which a matrix product does faster than gathering the candidates ) | queriesPerBatch ( queries scored against the whole library by one matrix product )
+        OUTPUT: hits ( for one query, a list of (MoleculeName, score, rowIndex) tuples, best first. For many queries, one such list per query )
+        """
+        with Instrumentation.stage('search'):
+            queryArray, single = getSpectraRows(queries, self.maximumAtomicUnit)
+            weightedQueries = getWeightedSpectra(queryArray, method)
+            weightedLibrary = self.getWeightedLibrary(method)
+            Instrumentation.count('search queries', len(queryArray))
+
+            hits = [None] * len(queryArray)
+            bruteForceQueries = numpy.arange(len(queryArray))
+            if prefilter:
+                prefilterQueries = weightedQueries if method == 'matchFactor' else getWeightedSpectra(queryArray, 'matchFactor')
+                bruteForceBatches = []
+                for batchStart in range(0, len(queryArray), queriesPerBatch):
+                    batch = range(batchStart, min(batchStart + queriesPerBatch, len(queryArray)))
+                    (scoredQueries, candidateLists, cosineLists) = ([], [], [])
+                    for queryIndex in batch:
+                        candidates = self.getCandidates(prefilterQueries[queryIndex], minimumSharedPeaks=minimumSharedPeaks, maximumCandidates=maximumCandidates)
+                        if candidates.size > bruteForceFraction * len(self):
+                            bruteForceBatches.append([queryIndex])
+                            continue
+                        scoredQueries.append(queryIndex)
+                        candidateLists.append(candidates)
+                        cosineLists.append(weightedLibrary[candidates] @ weightedQueries[queryIndex])
+
+                    #The candidates of each query fill a row of a block, padded with cosines of zero which getBestHits leaves out
+                    numberOfCandidates = numpy.array([candidates.size for candidates in candidateLists], dtype=numpy.intp)
+                    cosineBlock = numpy.zeros((len(scoredQueries), numberOfCandidates.max(initial=0)), dtype=weightedLibrary.dtype)
+                    rowBlock = numpy.zeros(cosineBlock.shape, dtype=numpy.intp)
+                    isCandidate = numpy.arange(cosineBlock.shape[1]) < numberOfCandidates[:, numpy.newaxis]
+                    if scoredQueries:
+                        cosineBlock[isCandidate] = numpy.concatenate(cosineLists)
+                        rowBlock[isCandidate] = numpy.concatenate(candidateLists)
+                    for queryIndex, queryHits in zip(scoredQueries, self.getBestHits(rowBlock, cosineBlock, topHits, method)):
+                        hits[queryIndex] = queryHits
+                bruteForceQueries = numpy.concatenate(bruteForceBatches) if bruteForceBatches else bruteForceQueries[:0]
+
+            allRows = numpy.arange(len(self))
+            for batchStart in range(0, len(bruteForceQueries), queriesPerBatch):
+                batch = bruteForceQueries[batchStart:batchStart + queriesPerBatch]
+                cosines = weightedQueries[batch] @ weightedLibrary.T
+                for queryIndex, queryHits in zip(batch.tolist(), self.getBestHits(allRows, cosines, topHits, method)):
+                    hits[queryIndex] = queryHits
+        return hits[0] if single else hits
+
+    def getBestHits(self, rowIndices, cosines, topHits, method):
+        """
+        This function returns, for each row of a block of cosines of weighted spectra, the topHits best of the scored library rows as (MoleculeName, score, rowIndex) tuples, best first. Rows with a score of 0 are left out
+        Both scores grow with the cosine, so the whole block is ranked by cosine and only the cosines kept are turned into scores
+        INPUT: rowIndices ( library row of each column of cosines, or a 2-D array giving the library row of each cosine ) | cosines ( (queries x scored rows) array ) | topHits ( number of hits kept per query ) | method ( one of SearchMethods )
+        OUTPUT: hits ( one list of hits per row of cosines )
+        """
+        numberOfColumns = cosines.shape[1]
+        topHits = max(0, min(topHits, numberOfColumns))
+        if topHits < numberOfColumns:
+            best = numpy.argpartition(cosines, numberOfColumns - topHits, axis=1)[:, numberOfColumns - topHits:] if topHits > 0 else numpy.zeros((len(cosines), 0), dtype=numpy.intp)
+        else:
+            best = numpy.broadcast_to(numpy.arange(numberOfColumns), cosines.shape)
+        bestCosines = numpy.take_along_axis(cosines, best, axis=1)
+        bestRows = rowIndices[best] if rowIndices.ndim == 1 else numpy.take_along_axis(rowIndices, best, axis=1)
+        #Equal scores are ordered by library row
+        order = numpy.lexsort((bestRows, -bestCosines), axis=1)
+        bestRows = numpy.take_along_axis(bestRows, order, axis=1)
+        bestScores = self.getScores(numpy.take_along_axis(bestCosines, order, axis=1), method)
+        return [[(self.MoleculeNames[rowIndex], score, rowIndex) for rowIndex, score in zip(queryRows, queryScores) if score > 0]
+                for queryRows, queryScores in zip(bestRows.tolist(), bestScores.tolist())]
@@ -0,0 +1,521 @@
+'''
+StreamingConversion.py converts molecules as a stream, for databases too large to hold every spectrum in memory
+until the end of the run. The conversion is a chain of generator stages, each handing its molecules to the next:
+    resolve ( database row and local JDX file of each molecule )
+    -> load ( metadata completed from the NIST Webbook, JDX files of molecules without a local one downloaded )
+    -> parse ( JDX files read, on a pool of processes ) -> bin ( spectra binned by m/z ) -> emit ( written to disk )
+The stages run in threads of their own with a bounded queue between two stages, so network lookups, parsing and
+writing overlap while no more than a few queues of molecules are in memory at once.
+The emit stage writes the molecules in chunks of columns: each chunk of moleculesPerChunk molecules is saved in the
+stream directory with its peaks sorted by m/z, and a checkpoint records the chunks saved so far. An interrupted run
+started again with the same molecules and settings resumes after the last chunk saved. The long format is written
+as the molecules come; the wide table ( one column per molecule ) is written at the end by transposing the chunks
+on disk, a block of m/z rows at a time, and the binary format is filled chunk by chunk. The output files are the
+same as those of JDXConverter.convertMolecules.
+Example:
+    outputFileNames = StreamingConversion.convertMoleculesStreaming(database.moleculeNames(), database)
+'''
+
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
+
+import numpy
+
+import Instrumentation
+import JCampSG
+import JDXConverter
+import NISTWebbook
+
+#Molecules saved to disk at a time. An interrupted run resumes after the last chunk saved
+MoleculesPerChunk = 256
+#Molecules held in the queue between two stages
+QueueSize = 64
+#Directory of the output directory holding the chunks and the checkpoint of a streaming run
+StreamDirectoryName = 'ConvertedSpectraStream'
+#Cells of the wide table held in memory at a time when the chunks are transposed
+CellsPerBlock = 2**20
+
+def getSha256(value):
+    """
+    This function returns the sha256 of value written as JSON, so the checkpoint holds a fixed size digest of the molecules and settings of a run rather than the whole of them
+    """
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+def bufferedStage(items, queueSize=QueueSize):
+    """
+    This function runs a stage in a thread of its own, ahead of the stage consuming its items, with at most queueSize items waiting in between. The stage blocks while the queue is full, so a fast stage cannot pile up items in front of a slow one
+    INPUT: items ( iterable, typically the generator of a stage ) | queueSize
+    OUTPUT: items ( generator of the same items, in order. An exception raised by the stage is raised again here )
+    """
+    itemQueue = queue.Queue(maxsize=queueSize)
+    stopped = threading.Event()
+
+    def put(entry):
+        #Gives up when the consumer has stopped, so that the thread never waits on a queue nobody reads
+        while not stopped.is_set():
+            try:
+                itemQueue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except BaseException as error:
+            put((False, error))
+        finally:
+            if hasattr(items, 'close'):
+                items.close() #Stops the stages upstream as well
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            isItem, item = itemQueue.get()
+            if not isItem:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+def mapInOrder(function, items, executor=None, window=QueueSize):
+    """
+    This function is executor.map over a stream: at most window items are submitted ahead of the one being yielded, so that a long stream is not submitted all at once
+    INPUT: function ( called on each item ) | items ( iterable ) | executor ( concurrent.futures executor, None to call the function in this thread ) | window ( items submitted ahead )
+    OUTPUT: pairs ( generator of (item, function(item)) in the order of items )
+    """
+    if executor is None:
+        for item in items:
+            yield item, function(item)
+        return
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+def resolveMolecules(MoleculeNames, DataBase_data_holder, JDXFilesLocation, JDXDirectory, firstMolecule=0):
+    """
+    This function is the resolve stage: it finds the database row and the local JDX file of each molecule, as convertMolecules does
+    INPUT: MoleculeNames | DataBase_data_holder ( as for convertMolecules ) | JDXFilesLocation ( local JDX directory ) | JDXDirectory ( JDXConverter.JDXDirectoryIndex of that directory ) | firstMolecule ( index of the first molecule, those before it are skipped )
+    OUTPUT: molecules ( generator of dictionaries with 'index', 'MoleculeName', 'databaseRow' ( empty if the molecule is not in the database ) and 'JDXFile' ( local JDX file, None if the spectrum is taken from online ) )
+    """
+    for index in range(firstMolecule, len(MoleculeNames)):
+        with Instrumentation.stage('resolve'):
+            moleculeName = MoleculeNames[index]
+            databaseRow = list(JDXConverter.getDataIfMoleculeExists(DataBase_data_holder, moleculeName))
+            JDXFile = None
+            if len(databaseRow) != 0:
+                filenameFromDatabase = databaseRow[3].strip()
+                if filenameFromDatabase != '' and filenameFromDatabase in JDXDirectory:
+                    JDXFile = os.path.join(JDXFilesLocation, filenameFromDatabase)
+            else:
+                JDXFile = JDXDirectory.find(moleculeName)
+        yield {'index': index, 'MoleculeName': moleculeName, 'databaseRow': databaseRow, 'JDXFile': JDXFile}
+
+def fetchJDXFromOnline(moleculeName):
+    """
+    This function downloads the JDX file of a molecule's mass spectrum from the NIST Webbook, with the default session
+    OUTPUT: JDXFile ( path+filename of the downloaded file ) | error ( None, or the description of why it could not be downloaded, in which case JDXFile is None )
+    """
+    session = NISTWebbook.getDefaultSession()
+    try:
+        mass_spectrum_url = JDXConverter.getMassSpectrumURL(session.moleculeURL(moleculeName), session=session)
+        jdx_download_url = JDXConverter.getJDXDownloadURL(mass_spectrum_url, session=session)
+        return JDXConverter.getJDX(jdx_download_url, moleculeName, session=session), None
+    except Exception as error:
+        return None, f'{type(error).__name__}: {error}'
+
+def needsOnlineMetaData(molecule):
+    """
+    This function tells if getMoleculeMetadata has to look up a molecule of the resolve stage online: molecules that are not in the database, or whose row has blank or unknown values
+    """
+    return len(molecule['databaseRow']) == 0 or not JDXConverter.isDatabaseMetaDataComplete(molecule['databaseRow'])
+
+def getMoleculeMetadata(molecule, onlineMetaData=None):
+    """
+    This function completes the metadata of one molecule of the resolve stage, as convertMolecules does
+    INPUT: molecule ( dictionary of resolveMolecules ) | onlineMetaData ( optional, what getMetaDataForMoleculeFromOnline returns for the molecule. It is looked up if needed and not given )
+    OUTPUT: metadata ( keyword arguments of SparseSpectraMatrix.append. SourceOfFragmentationPatterns is 'NIST Webbook' if the molecule has no local JDX file )
+    """
+    moleculeName = molecule['MoleculeName']
+    databaseRow = molecule['databaseRow']
+    metadata = {'MoleculeNames': moleculeName, 'knownMoleculeIonizationTypes': 'unknown', 'knownIonizationFactorsRelativeToN2': 'unknown',
+                'SourceOfFragmentationPatterns': 'NIST Webbook', 'SourceOfIonizationData': 'unknown'}
+    if len(databaseRow) != 0:
+        metadata['ENumbers'], metadata['MWeights'], metadata['knownMoleculeIonizationTypes'], metadata['knownIonizationFactorsRelativeToN2'], metadata['SourceOfIonizationData'] = \
+            JDXConverter.completeDatabaseMetaData(databaseRow, moleculeName, onlineMetaData)
+        if molecule['JDXFile'] is not None:
+            metadata['SourceOfFragmentationPatterns'] = databaseRow[6]
+    else:
+        if onlineMetaData is None:
+            onlineMetaData = JDXConverter.getMetaDataForMoleculeFromOnline(moleculeName)
+        molecular_formula, molecular_weight, electron_number = onlineMetaData
+        metadata['ENumbers'] = int(electron_number) if electron_number != 'unknown' else 0
+        metadata['MWeights'] = float(molecular_weight) if molecular_weight != 'unknown' else 0
+        if molecule['JDXFile'] is not None:
+            metadata['SourceOfFragmentationPatterns'] = 'unknown' #A local JDX file without a database row tells nothing of its source
+    return metadata
+
+@Instrumentation.stage('load')
+def loadMolecule(molecule):
+    """
+    This function completes the metadata of one molecule of the resolve stage, looking up online what the database does not give, and downloads its JDX file if it has no local one
+    INPUT: molecule ( dictionary of resolveMolecules )
+    OUTPUT: molecule ( the same dictionary, with 'metadata' ( see getMoleculeMetadata ), 'online' ( True if the spectrum is taken from online ) and 'error' ( None, or why the JDX file could not be downloaded ) )
+    """
+    molecule['metadata'] = getMoleculeMetadata(molecule)
+    molecule['online'] = molecule['JDXFile'] is None
+    molecule['error'] = None
+    if molecule['online']:
+        molecule['JDXFile'], molecule['error'] = fetchJDXFromOnline(molecule['MoleculeName'])
+    return molecule
+
+def loadMolecules(molecules, executor=None, window=QueueSize):
+    """
+    This function is the load stage: loadMolecule on each molecule, several molecules at a time on executor ( a thread pool, as the work is network lookups )
+    """
+    for unused, molecule in mapInOrder(loadMolecule, molecules, executor, window):
+        yield molecule
+
+def parseMolecule(molecule):
+    """
+    This function reads the JDX file of one molecule. It is the work done on each process of the parse stage
+    INPUT: molecule ( dictionary of loadMolecule )
+    OUTPUT: jcampDict ( dictionary of JCampSG.JCAMP_reader, None if the file could not be read ) | error ( None, or the description of the error )
+    """
+    if molecule['JDXFile'] is None:
+        return None, molecule['error']
+    filename = molecule['JDXFile'].strip()
+    if('.jdx' not in filename):
+        filename = filename+'.jdx'
+    try:
+        return JCampSG.JCAMP_reader(filename), None
+    except Exception as error:
+        return None, f'{type(error).__name__}: {error}'
+
+def parseMolecules(molecules, executor=None, window=QueueSize):
+    """
+    This function is the parse stage: parseMolecule on each molecule, on executor ( a process pool ) if given. A local JDX file that cannot be read is replaced by the molecule's file from online, as convertMolecules does
+    OUTPUT: molecules ( generator of the dictionaries of loadMolecule, with 'jcampDict' ( None if no JDX file could be read ) )
+    """
+    for molecule, (jcampDict, error) in mapInOrder(parseMolecule, molecules, executor, window):
+        if error is not None and not molecule['online']:
+            print(f"Could not convert {molecule['JDXFile']} ({error}). Its spectrum will be taken from online instead.")
+            molecule['online'] = True
+            molecule['metadata']['SourceOfFragmentationPatterns'] = 'NIST Webbook'
+            molecule['JDXFile'], molecule['error'] = fetchJDXFromOnline(molecule['MoleculeName'])
+            jcampDict, error = parseMolecule(molecule)
+        if error is not None:
+            molecule['metadata']['SourceOfFragmentationPatterns'] = 'unknown'
+            print(f"Spectrum data for {molecule['MoleculeName']} NOT FOUND in NIST Webbook. It is set to a blank list and SourceOfFragmentationPattern is set to unknown")
+        molecule['jcampDict'] = jcampDict
+        yield molecule
+
+def binMolecules(molecules, rounding='nearest', duplicatePolicy='sum', maximumAtomicUnit=None):
+    """
+    This function is the bin stage: the spectrum of each molecule binned by m/z, an empty spectrum for the molecules without one
+    OUTPUT: molecules ( generator of the dictionaries of parseMolecules, with 'spectrum' ( binned spectrum as returned by createArray ) in place of 'jcampDict' )
+    """
+    for molecule in molecules:
+        with Instrumentation.stage('bin'):
+            jcampDict = molecule.pop('jcampDict')
+            if jcampDict is None:
+                molecule['spectrum'] = []
+            else:
+                try:
+                    molecule['spectrum'] = JDXConverter.createArray(jcampDict, rounding, duplicatePolicy, maximumAtomicUnit)
+                except Exception as error:
+                    print(f"Could not bin the spectrum of {molecule['MoleculeName']} ({type(error).__name__}: {error}). It is set to a blank list.")
+                    molecule['spectrum'] = []
+        yield molecule
+
+class StreamWriter:
+    """
+    This class is the emit stage: it writes the binned molecules to the output files of outputFormats, saving them in chunks of moleculesPerChunk molecules with a checkpoint in the stream directory.
+    If the stream directory holds the checkpoint of an earlier run of the same molecules, settings and output formats, that run is resumed: firstMolecule is the index of the first molecule still to write.
+    """
+
+    def __init__(self, outputFileDirectoryPath, MoleculeNames, outputFormats=('csv', 'txt', 'tab'), conversionSettings=None, moleculesPerChunk=MoleculesPerChunk, resume=True):
+        """
+        INPUT: outputFileDirectoryPath ( directory of the output files, created if needed ) | MoleculeNames ( every molecule of the run, in order ) | outputFormats ( any of the keys of JDXConverter.OutputFormats ) | conversionSettings ( dictionary of the settings the spectra depend on, an earlier run is only resumed with the same ) | moleculesPerChunk | resume ( False to start again even if there is a checkpoint )
+        """
+        self.outputFileDirectoryPath = outputFileDirectoryPath
+        self.MoleculeNames = list(MoleculeNames)
+        self.outputFormats = list(outputFormats)
+        self.conversionSettings = dict(conversionSettings or {})
+        self.moleculesPerChunk = moleculesPerChunk
+        self.streamDirectory = os.path.join(outputFileDirectoryPath, StreamDirectoryName)
+        self.checkpointFileName = os.path.join(self.streamDirectory, 'checkpoint.json')
+        self.massToChargeLimit = self.conversionSettings.get('maximumAtomicUnit', JDXConverter.MaximumAtomicUnit)
+        self.moleculeNamesHash = getSha256(self.MoleculeNames)
+        self.settingsHash = getSha256({'conversionSettings': self.conversionSettings, 'outputFormats': self.outputFormats})
+
+        checkpoint = self.readCheckpoint() if resume else None
+        if checkpoint is None:
+            if os.path.isdir(self.streamDirectory):
+                shutil.rmtree(self.streamDirectory)
+            os.makedirs(self.streamDirectory)
+            #The output file names are chosen once, so a resumed run writes to the same files
+            self.outputFileNames = {}
+            for outputFormat in self.outputFormats:
+                expectedFileName, fileExtension, delimeter = JDXConverter.OutputFormats[outputFormat]
+                self.outputFileNames[outputFormat] = JDXConverter.getOutputFileName(outputFileDirectoryPath, expectedFileName=expectedFileName, fileExtension=fileExtension)
+            self.chunks = []
+            self.firstMolecule = 0
+            self.maximumAtomicUnit = 0 if self.massToChargeLimit == 'auto' else self.massToChargeLimit
+            self.longFileSize = 0
+        else:
+            self.outputFileNames = checkpoint['outputFileNames']
+            self.chunks = checkpoint['chunks']
+            self.firstMolecule = checkpoint['moleculesDone']
+            self.maximumAtomicUnit = checkpoint['maximumAtomicUnit']
+            self.longFileSize = checkpoint['longFileSize']
+            print(f"Resuming the conversion after {self.firstMolecule} of {len(self.MoleculeNames)} molecules, from the checkpoint in {self.streamDirectory}.")
+
+        self.longFile = None
+        if 'long' in self.outputFormats:
+            #The long format is written as the molecules come. Lines written after the last checkpoint are dropped on resume, as their molecules are converted again
+            self.longFileName = os.path.join(outputFileDirectoryPath, self.outputFileNames['long'])
+            self.longDelimeter = JDXConverter.OutputFormats['long'][2]
+            if checkpoint is None:
+                self.longFile = open(self.longFileName, 'w', buffering=1024*1024)
+                self.longFile.write(self.longDelimeter.join(['Molecule', 'm/z', 'Intensity']) + '\n')
+            else:
+                os.truncate(self.longFileName, self.longFileSize)
+                self.longFile = open(self.longFileName, 'a', buffering=1024*1024)
+        self.chunk = self.newChunk()
+        self.moleculesDone = self.firstMolecule
+
+    def newChunk(self):
+        return JDXConverter.SparseSpectraMatrix(maximumAtomicUnit=self.massToChargeLimit, initialCapacity=self.moleculesPerChunk)
+
+    def readCheckpoint(self):
+        """
+        This function returns the checkpoint of an earlier run of the same molecules, settings and output formats, or None if there is none
+        """
+        try:
+            with open(self.checkpointFileName, 'r') as checkpointFile:
+                checkpoint = json.load(checkpointFile)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get('formatVersion') != 2 or checkpoint['moleculeNamesHash'] != self.moleculeNamesHash or checkpoint['settingsHash'] != self.settingsHash:
+            return None
+        return checkpoint
+
+    def writeCheckpoint(self):
+        #The molecules and settings are only stored as their sha256, as the checkpoint is written again after every chunk
+        checkpoint = {'formatVersion': 2, 'moleculeNamesHash': self.moleculeNamesHash, 'settingsHash': self.settingsHash,
+                      'outputFileNames': self.outputFileNames, 'moleculesDone': self.moleculesDone, 'maximumAtomicUnit': self.maximumAtomicUnit,
+                      'longFileSize': self.longFileSize, 'chunks': self.chunks}
+        #Written to a temporary file first, so an interruption never leaves a half written checkpoint
+        with open(self.checkpointFileName + '.tmp', 'w') as checkpointFile:
+            json.dump(checkpoint, checkpointFile)
+        os.replace(self.checkpointFileName + '.tmp', self.checkpointFileName)
+
+    @Instrumentation.stage('emit')
+    def write(self, molecule):
+        """
+        This function adds one molecule of the bin stage, saving the chunk when it is full
+        """
+        rowIndex = self.chunk.append(molecule['spectrum'], **molecule['metadata'])
+        if self.longFile is not None:
+            massToCharges, intensities = self.chunk.peaks(rowIndex)
+            JDXConverter.writeLongFormatPeaks(self.longFile, molecule['MoleculeName'], massToCharges, intensities, self.longDelimeter)
+        if len(self.chunk) == self.moleculesPerChunk:
+            self.saveChunk()
+
+    def saveChunk(self):
+        """
+        This function saves the molecules of the current chunk in the stream directory, with their peaks sorted by m/z for the transpose, and writes the checkpoint
+        """
+        if len(self.chunk) == 0:
+            return
+        chunk = self.chunk
+        massToCharges = chunk.massToCharges[:chunk.numberOfPeaks]
+        order = numpy.argsort(massToCharges, kind='stable')
+        chunkName = f'chunk{len(self.chunks):06d}'
+        #The number of peaks at each m/z places the chunk's peaks in the transposed table without reading them first
+        numpy.savez(os.path.join(self.streamDirectory, chunkName + '.npz'), massToCharges=massToCharges[order], rowIndices=chunk.rowIndices()[order],
+                    intensities=chunk.intensities[:chunk.numberOfPeaks][order], massToChargeCounts=numpy.bincount(massToCharges))
+        #numpy scalars are stored as the python numbers they hold
+        metadata = {columnName: [datum.item() if isinstance(datum, numpy.generic) else datum for datum in column] for columnName, column in chunk.metadata.items()}
+        with open(os.path.join(self.streamDirectory, chunkName + '.json'), 'w') as metadataFile:
+            json.dump(metadata, metadataFile)
+
+        if self.longFile is not None:
+            self.longFile.flush()
+            self.longFileSize = os.path.getsize(self.longFileName)
+        self.chunks.append({'name': chunkName, 'firstRow': self.moleculesDone, 'numberOfSpectra': len(chunk)})
+        self.moleculesDone = self.moleculesDone + len(chunk)
+        self.maximumAtomicUnit = max(self.maximumAtomicUnit, chunk.maximumAtomicUnit)
+        self.writeCheckpoint()
+        self.chunk = self.newChunk()
+
+    def loadChunkPeaks(self, chunk):
+        """
+        This function returns the peaks of a saved chunk: m/z, row within the chunk and intensity, sorted by m/z
+        """
+        with numpy.load(os.path.join(self.streamDirectory, chunk['name'] + '.npz')) as peaks:
+            return peaks['massToCharges'], peaks['rowIndices'], peaks['intensities']
+
+    def loadChunkMetadata(self, chunk):
+        """
+        This function returns the metadata columns of a saved chunk
+        """
+        with open(os.path.join(self.streamDirectory, chunk['name'] + '.json'), 'r') as metadataFile:
+            return json.load(metadataFile)
+
+    def transposeChunks(self):
+        """
+        This function sorts the peaks of every saved chunk by m/z into one pair of files in the stream directory, reading each chunk once: the peaks of an m/z are then contiguous, molecule after molecule
+        OUTPUT: massToChargeOffsets ( the peaks of m/z i are at massToChargeOffsets[i]:massToChargeOffsets[i+1] ) | columns ( memory mapped column of each peak in the wide table ) | intensities ( memory mapped )
+        """
+        massToChargeCounts = numpy.zeros(self.maximumAtomicUnit + 1, dtype=numpy.int64)
+        for chunk in self.chunks:
+            with numpy.load(os.path.join(self.streamDirectory, chunk['name'] + '.npz')) as peaks:
+                chunkCounts = peaks['massToChargeCounts']
+            massToChargeCounts[:len(chunkCounts)] += chunkCounts
+        massToChargeOffsets = numpy.concatenate([[0], numpy.cumsum(massToChargeCounts)])
+        numberOfPeaks = int(massToChargeOffsets[-1])
+        columns = numpy.lib.format.open_memmap(os.path.join(self.streamDirectory, 'transposedColumns.npy'), mode='w+', dtype=numpy.int64, shape=(numberOfPeaks,))
+        intensities = numpy.lib.format.open_memmap(os.path.join(self.streamDirectory, 'transposedIntensities.npy'), mode='w+', dtype=numpy.float64, shape=(numberOfPeaks,))
+        #Counting sort: the next free place of each m/z, filled chunk after chunk so the molecules of an m/z stay in order
+        nextPeak = massToChargeOffsets[:-1].copy()
+        for chunk in self.chunks:
+            with numpy.load(os.path.join(self.streamDirectory, chunk['name'] + '.npz')) as peaks:
+                chunkCounts = numpy.zeros(len(massToChargeCounts), dtype=numpy.int64)
+                chunkCounts[:len(peaks['massToChargeCounts'])] = peaks['massToChargeCounts']
+                chunkOffsets = numpy.cumsum(chunkCounts) - chunkCounts
+                #The chunk's peaks are sorted by m/z, so peak i of m/z j goes to nextPeak[j] + i - chunkOffsets[j]
+                places = numpy.repeat(nextPeak - chunkOffsets, chunkCounts) + numpy.arange(int(chunkCounts.sum()))
+                columns[places] = chunk['firstRow'] + peaks['rowIndices']
+                intensities[places] = peaks['intensities']
+            nextPeak += chunkCounts
+        return massToChargeOffsets, columns, intensities
+
+    def getTableRows(self, massRowsPerChunk=256):
+        """
+        This function generates the rows of the table of exportToCSV from the saved chunks: the metadata rows, then the m/z rows, a block of m/z rows at a time with only that block of the table in memory
+        The peaks are first transposed by transposeChunks, so each block reads only its own peaks rather than every chunk again
+        """
+        numberOfSpectra = self.moleculesDone
+        metadata = {columnName: [] for columnName in JDXConverter.SpectraMetadataColumns}
+        for chunk in self.chunks:
+            chunkMetadata = self.loadChunkMetadata(chunk)
+            for columnName in JDXConverter.SpectraMetadataColumns:
+                metadata[columnName].extend(chunkMetadata[columnName])
+        yield from JDXConverter.getExportHeaderRows(metadata['MoleculeNames'], metadata['ENumbers'], metadata['MWeights'], metadata['knownMoleculeIonizationTypes'],
+                                                    metadata['knownIonizationFactorsRelativeToN2'], metadata['SourceOfFragmentationPatterns'], metadata['SourceOfIonizationData'])
+        del metadata
+
+        massToChargeOffsets, columns, intensities = self.transposeChunks()
+        massToChargeCounts = numpy.diff(massToChargeOffsets)
+        #Only the m/z values with an intensity for at least one molecule are written
+        distinctMassToCharges = numpy.flatnonzero(massToChargeCounts)
+        massRowsPerBlock = max(1, min(massRowsPerChunk, CellsPerBlock // max(1, numberOfSpectra)))
+        for blockStart in range(0, len(distinctMassToCharges), massRowsPerBlock):
+            blockMassToCharges = distinctMassToCharges[blockStart:blockStart + massRowsPerBlock]
+            block = numpy.zeros((len(blockMassToCharges), numberOfSpectra))
+            first, last = massToChargeOffsets[blockMassToCharges[0]], massToChargeOffsets[blockMassToCharges[-1] + 1]
+            block[numpy.repeat(numpy.arange(len(blockMassToCharges)), massToChargeCounts[blockMassToCharges]), columns[first:last]] = intensities[first:last]
+            #int() truncates towards zero, and so does the conversion of the whole block to integers
+            for massToCharge, massRow in zip(blockMassToCharges.tolist(), block.astype(numpy.int64).tolist()):
+                yield ['%d'%(massToCharge)] + [str(intensity) for intensity in massRow]
+        #The memory maps are closed before finish removes the stream directory
+        del columns, intensities
+
+    def writeBinary(self, directoryName):
+        """
+        This function writes the saved chunks in the binary form of exportToBinary, filling the spectra one chunk at a time
+        """
+        metadata = {columnName: [] for columnName in JDXConverter.SpectraMetadataColumns}
+        os.makedirs(directoryName, exist_ok=True)
+        spectra = numpy.lib.format.open_memmap(os.path.join(directoryName, 'spectra.npy'), mode='w+', dtype=numpy.float64, shape=(self.moleculesDone, self.maximumAtomicUnit))
+        for chunk in self.chunks:
+            massToCharges, rowIndices, intensities = self.loadChunkPeaks(chunk)
+            spectra[chunk['firstRow'] + rowIndices, massToCharges - 1] = intensities
+            chunkMetadata = self.loadChunkMetadata(chunk)
+            for columnName in JDXConverter.SpectraMetadataColumns:
+                metadata[columnName].extend(chunkMetadata[columnName])
+        spectra.flush()
+        del spectra
+        description = {'formatVersion': 1, 'numberOfSpectra': self.moleculesDone, 'maximumAtomicUnit': self.maximumAtomicUnit, 'metadata': metadata}
+        with open(os.path.join(directoryName, 'metadata.json'), 'w') as metadataFile:
+            json.dump(description, metadataFile)
+
+    def close(self):
+        if self.longFile is not None:
+            self.longFile.close()
+            self.longFile = None
+
+    def finish(self):
+        """
+        This function saves the last chunk, writes the wide table and binary outputs from the chunks and removes the stream directory
+        OUTPUT: outputFileNames ( dictionary format -> name of the file written in outputFileDirectoryPath, as returned by convertMolecules )
+        """
+        self.saveChunk()
+        self.close()
+        with Instrumentation.stage('export'):
+            textOutputs = [(os.path.join(self.outputFileDirectoryPath, self.outputFileNames[outputFormat]), JDXConverter.OutputFormats[outputFormat][2]) for outputFormat in self.outputFormats
+                           if JDXConverter.OutputFormats[outputFormat][2] is not None and outputFormat != 'long']
+            if textOutputs:
+                JDXConverter.writeTableRows(textOutputs, self.getTableRows())
+            if 'binary' in self.outputFormats:
+                self.writeBinary(os.path.join(self.outputFileDirectoryPath, self.outputFileNames['binary']))
+        shutil.rmtree(self.streamDirectory)
+        return self.outputFileNames
+
+def convertMoleculesStreaming(MoleculeNames, DataBase_data_holder, JDXFilesLocation='JDXFiles//', outputFileDirectoryPath='OutputFiles', outputFormats=('csv', 'txt', 'tab'),
+                              max_workers=None, maximumAtomicUnit=None, moleculesPerChunk=MoleculesPerChunk, queueSize=QueueSize, fetchWorkers=8, resume=True, indexFileName=None):
+    """
+    This function is JDXConverter.convertMolecules as a stream: the molecules go through the resolve, load, parse, bin and emit stages one after the other, and the output is saved chunk by chunk with a checkpoint, so memory does not grow with the number of molecules and an interrupted run resumes where it stopped
+    INPUT: MoleculeNames, DataBase_data_holder, JDXFilesLocation, outputFileDirectoryPath, outputFormats, maximumAtomicUnit, indexFileName ( as for convertMolecules ) | max_workers ( number of processes parsing JDX files, the number of CPUs if not given. With 1 the files are parsed in a thread of this process ) | moleculesPerChunk ( molecules saved at a time ) | queueSize ( molecules waiting between two stages ) | fetchWorkers ( molecules loaded from online concurrently ) | resume ( False to start again even if an earlier run was interrupted )
+    OUTPUT: outputFileNames ( as for convertMolecules )
+    With max_workers above 1 the parsing processes are started with spawn, which imports the main module of the program again in each of them. A script calling this function must then do so under if __name__ == '__main__':, otherwise the pool fails with concurrent.futures.process.BrokenProcessPool
+    """
+    if maximumAtomicUnit is None:
+        maximumAtomicUnit = JDXConverter.MaximumAtomicUnit
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    conversionSettings = {'rounding': 'nearest', 'duplicatePolicy': 'sum', 'maximumAtomicUnit': maximumAtomicUnit}
+
+    os.makedirs(outputFileDirectoryPath, exist_ok=True)
+    with Instrumentation.stage('directory index'):
+        JDXDirectory = JDXConverter.getJDXDirectoryIndex(JDXFilesLocation, outputFileDirectoryPath, indexFileName)
+    writer = StreamWriter(outputFileDirectoryPath, MoleculeNames, outputFormats, conversionSettings, moleculesPerChunk=moleculesPerChunk, resume=resume)
+    try:
+        #The parsing processes are started with spawn, as forking a process whose stage threads hold locks is not safe
+        with concurrent.futures.ThreadPoolExecutor(max_workers=fetchWorkers) as fetchExecutor, \
+             (concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) if max_workers > 1 else contextlib.nullcontext()) as parseExecutor:
+            molecules = bufferedStage(resolveMolecules(MoleculeNames, DataBase_data_holder, JDXFilesLocation, JDXDirectory, writer.firstMolecule), queueSize)
+            molecules = bufferedStage(loadMolecules(molecules, fetchExecutor, queueSize), queueSize)
+            molecules = bufferedStage(parseMolecules(molecules, parseExecutor, queueSize), queueSize)
+            try:
+                for molecule in binMolecules(molecules, conversionSettings['rounding'], conversionSettings['duplicatePolicy'], maximumAtomicUnit):
+                    writer.write(molecule)
+            finally:
+                molecules.close() #Stops every stage, if the run stopped early
+        return writer.finish()
+    finally:
+        writer.close()
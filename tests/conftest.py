@@ -0,0 +1,7 @@
+'''
+Shared setup of the tests: the modules of the repository are imported from its top directory, as when the scripts are run from there
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+'''
+Tests of the command line interface of JDXConverter.py, which run it as a script so that the modules it imports are used the way they are from the command line
+Example:
+    python -m pytest tests
+'''
+import json
+import os
+import subprocess
+import sys
+
+#The repository, which holds JDXConverter.py and the JDXFiles directory
+RepositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runJDXConverter(*arguments):
+    """
+    This function runs JDXConverter.py as a script from the repository directory
+    INPUT: arguments ( command line arguments )
+    OUTPUT: result ( the JSON printed by the command )
+    """
+    completed = subprocess.run([sys.executable, '-W', 'ignore', 'JDXConverter.py'] + list(arguments), cwd=RepositoryDirectory, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout)
+
+
+def test_search_finds_the_query_in_a_JDX_directory_library():
+    query = os.path.join('JDXFiles', '1butanol.jdx')
+    result = runJDXConverter('search', '--library', 'JDXFiles', '--queries', query, '--top', '3')
+    assert result['failures'] == []
+    assert result['librarySpectra'] == len([fileName for fileName in os.listdir(os.path.join(RepositoryDirectory, 'JDXFiles')) if fileName.lower().endswith('.jdx')])
+    (bestName, bestScore) = result['hits'][query][0]
+    assert bestName == '1butanol'
+    assert abs(bestScore - 999.0) < 1e-3
+    assert len(result['hits'][query]) == 3
+
+
+def test_resample_reports_the_mass_spectra_as_failures(tmp_path):
+    #The JDXFiles directory holds mass spectra, which have no cross-sections, so every file is a failure but the command still writes its output
+    result = runJDXConverter('resample', '--jdx-dir', 'JDXFiles', '--grid', '500', '4000', '10', '--output-dir', str(tmp_path), '--workers', '1')
+    assert result['gridPoints'] == 351
+    assert len(result['failures']) == result['JDXFiles']
+    assert os.path.exists(result['outputFiles']['csv'])
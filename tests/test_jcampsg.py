@@ -0,0 +1,158 @@
+'''
+Tests of the JCAMP-DX readers of JCampSG.py, on the bundled JDXFiles and on small files written by the tests
+Example:
+    python -m pytest tests/test_jcampsg.py
+'''
+import os
+
+import numpy
+import pytest
+
+import JCampSG
+import JDXBenchmarks
+
+#The repository, which holds the JDXFiles directory
+RepositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BundledJDXDirectory = os.path.join(RepositoryDirectory, 'JDXFiles')
+BundledJDXFileNames = sorted(fileName for fileName in os.listdir(BundledJDXDirectory) if fileName.lower().endswith('.jdx'))
+
+
+def writeJDX(filename, lines):
+    with open(filename, 'w') as JDXFile:
+        JDXFile.write('\n'.join(lines) + '\n')
+    return str(filename)
+
+
+def assertSameDicts(jcampDict, expectedDict):
+    """
+    This function checks that two dictionaries of JCAMP_reader have the same keys in the same order, values of the same types, and x and y vectors of the same dtype and bytes
+    """
+    assert list(jcampDict) == list(expectedDict)
+    for key, expected in expectedDict.items():
+        if isinstance(expected, numpy.ndarray):
+            assert jcampDict[key].dtype == expected.dtype and jcampDict[key].tobytes() == expected.tobytes(), key
+        else:
+            assert type(jcampDict[key]) == type(expected) and jcampDict[key] == expected, key
+
+
+def readOneLineAtATime(filename, monkeypatch):
+    """
+    This function reads filename with the bulk parsers of the data blocks replaced by the line by line parsers they fall back to
+    """
+    def parseXYYOneLineAtATime(lines):
+        xstart, xnum, y = JCampSG.parse_xyy_lines(lines)
+        return xstart, xnum, y, numpy.zeros(y.size, dtype=bool)
+
+    def parseXYOneLineAtATime(lines, separator=','):
+        if separator == ',':
+            return JCampSG.parse_xy_lines([line.split(',') for line in lines])
+        return JCampSG.parse_xy_lines([[value for value in line.replace(',', ' ').split(' ') if value] for line in lines])
+
+    with monkeypatch.context() as patch:
+        patch.setattr(JCampSG, 'parse_xyy_block', parseXYYOneLineAtATime)
+        patch.setattr(JCampSG, 'parse_xy_block', parseXYOneLineAtATime)
+        return JCampSG.JCAMP_reader(filename)
+
+
+@pytest.mark.parametrize('JDXFileName', BundledJDXFileNames)
+def test_bulk_reader_gives_the_line_by_line_dict_on_the_bundled_files(JDXFileName, monkeypatch):
+    filename = os.path.join(BundledJDXDirectory, JDXFileName)
+    expectedDict = readOneLineAtATime(filename, monkeypatch)
+    assertSameDicts(JCampSG.JCAMP_reader(filename), expectedDict)
+    assertSameDicts(JCampSG.JCAMP_mmap_reader(filename), expectedDict)
+
+
+def test_bulk_reader_gives_the_line_by_line_dict_on_xyy_files(tmp_path, monkeypatch):
+    IRFileName = str(tmp_path / 'synthetic_ir.jdx')
+    JDXBenchmarks.generateIRFile(IRFileName, numberOfPoints=5003, valuesPerLine=7)
+    #Negative values may stand right after the previous value, with no space in between
+    signedFileName = writeJDX(tmp_path / 'signed.jdx', ['##TITLE=signed', '##JCAMP-DX=4.24', '##XUNITS=1/CM', '##YUNITS=ABSORBANCE', '##XFACTOR=0.5', '##YFACTOR=0.001',
+                                                        '##FIRSTX=1000', '##LASTX=1022', '##NPOINTS=12', '##XYDATA=(X++(Y..Y))',
+                                                        '2000 10-20 30.5 -40', '2008+50-60 70 80', '2016 -90 100 110.25 120', '##END='])
+    for filename in (IRFileName, signedFileName):
+        expectedDict = readOneLineAtATime(filename, monkeypatch)
+        assertSameDicts(JCampSG.JCAMP_reader(filename), expectedDict)
+        assertSameDicts(JCampSG.JCAMP_mmap_reader(filename), expectedDict)
+    assert JCampSG.JCAMP_reader(signedFileName)['y'].tolist() == pytest.approx([0.01, -0.02, 0.0305, -0.04, 0.05, -0.06, 0.07, 0.08, -0.09, 0.1, 0.11025, 0.12])
+
+
+def writeXYYFile(filename, dataLines, firstX=100, lastX=105, numberOfPoints=6):
+    return writeJDX(filename, ['##TITLE=asdf', '##JCAMP-DX=5.01', '##XUNITS=1/CM', '##YUNITS=ABSORBANCE', '##XFACTOR=1', '##YFACTOR=1',
+                               f'##FIRSTX={firstX}', f'##LASTX={lastX}', f'##NPOINTS={numberOfPoints}', '##XYDATA=(X++(Y..Y))'] + dataLines + ['##END='])
+
+
+def test_asdf_dif_and_dup_data_decode_to_the_affn_values(tmp_path):
+    AFFNFileName = writeXYYFile(tmp_path / 'affn.jdx', ['100 1000 1010 1020 1020 1020', '105 1015'])
+    #SQZ A000 is 1000, DIF J0 is +10, DIF % is 0 and DUP T repeats it twice. The second line starts with the Y-check value A020, the last ordinate of the first line, then DIF n is -5
+    ASDFFileName = writeXYYFile(tmp_path / 'asdf.jdx', ['100A000J0J0%T', '104A020n'])
+    expectedDict = JCampSG.JCAMP_reader(AFFNFileName)
+    jcampDict = JCampSG.JCAMP_reader(ASDFFileName)
+    assert jcampDict['y'].tolist() == [1000.0, 1010.0, 1020.0, 1020.0, 1020.0, 1015.0]
+    assert jcampDict['y'].tobytes() == expectedDict['y'].tobytes()
+    #The Y-check value places the x values of the second line and is then dropped
+    assert jcampDict['x'].tolist() == [100.0, 101.0, 102.0, 103.0, 104.0, 105.0]
+    assertSameDicts(JCampSG.JCAMP_mmap_reader(ASDFFileName), jcampDict)
+
+
+def test_asdf_sqz_values_and_dup_of_an_absolute_value(tmp_path):
+    #SQZ a5 is -15 and @ is 0, DUP U repeats the value before it three times
+    expectedDict = JCampSG.JCAMP_reader(writeXYYFile(tmp_path / 'affn.jdx', ['100 -15 0 0 0', '104 11 22']))
+    jcampDict = JCampSG.JCAMP_reader(writeXYYFile(tmp_path / 'sqz.jdx', ['100a5@U', '104A1B2']))
+    assert jcampDict['y'].tolist() == [-15.0, 0.0, 0.0, 0.0, 11.0, 22.0]
+    assert jcampDict['x'].tobytes() == expectedDict['x'].tobytes()
+
+
+def test_asdf_y_check_mismatch_raises(tmp_path):
+    #The second line repeats 1021 but the first line ends in 1020
+    filename = writeXYYFile(tmp_path / 'badcheck.jdx', ['100A000J0J0%T', '104A021n'])
+    with pytest.raises(ValueError, match='Y-value check'):
+        JCampSG.JCAMP_reader(filename)
+
+
+def test_asdf_dup_without_an_ordinate_raises(tmp_path):
+    with pytest.raises(ValueError, match='DUP'):
+        JCampSG.JCAMP_reader(writeXYYFile(tmp_path / 'baddup.jdx', ['100TA000', '101A000']))
+
+
+def test_blocks_of_a_link_file_are_indexed_and_parsed_on_use(tmp_path):
+    firstBlock = ['##TITLE=ethanol', '##JCAMP-DX=4.24', '##DATA TYPE=MASS SPECTRUM', '##NPOINTS=3', '##PEAK TABLE=(XY..XY)', '15,20 31,100', '46,16', '##END=']
+    secondBlock = ['##TITLE=oxygen', '##JCAMP-DX=4.24', '##DATA TYPE=MASS SPECTRUM', '##NPOINTS=2', '##PEAK TABLE=(XY..XY)', '16,10 32,100', '##END=']
+    lastBlock = ['##TITLE=water', '##JCAMP-DX=4.24', '##DATA TYPE=MASS SPECTRUM', '##NPOINTS=2', '##PEAK TABLE=(XY..XY)', '17,21 18,100', '##END=']
+    filename = writeJDX(tmp_path / 'library.jdx', ['##TITLE=library', '##JCAMP-DX=4.24', '##DATA TYPE=LINK', '##BLOCKS=2'] + firstBlock + secondBlock + ['##END='] + lastBlock)
+
+    index = JCampSG.JCAMP_index_blocks(filename)
+    assert [(title, depth, parent) for (offset, length, headerLength, title, depth, parent) in index] == [('library', 0, None), ('ethanol', 1, 0), ('oxygen', 1, 0), ('water', 0, None)]
+    with open(filename, 'rb') as libraryFile:
+        content = libraryFile.read()
+    #Each block runs from its ##TITLE= line to the end of its ##END= line, and the LINK block's own lines stop at its first nested block
+    for (offset, length, headerLength, title, depth, parent) in index[1:]:
+        assert content[offset:offset + length].decode().startswith(f'##TITLE={title}\n') and content[offset:offset + length].endswith(b'##END=\n')
+    assert index[0][2] == index[1][0] - index[0][0]
+    assert index[0][0] + index[0][1] == index[3][0]
+
+    blocks = JCampSG.JCAMP_blocks(filename)
+    assert len(blocks) == 3 and blocks.titles() == ['ethanol', 'oxygen', 'water']
+    assert JCampSG.JCAMP_blocks(filename, include_links=True)[0].is_link
+    block = blocks[1]
+    assert block._jcamp_dict is None
+    assert block.x.tolist() == [16.0, 32.0] and block.y.tolist() == [10.0, 100.0]
+    assert block.jcamp_dict['title'] == 'oxygen' and block.jcamp_dict['npoints'] == 2
+    #A block parses as the same lines would in a file of their own
+    for blockLines, block in zip([firstBlock, secondBlock, lastBlock], blocks):
+        assertSameDicts(block.jcamp_dict, JCampSG.JCAMP_reader(writeJDX(tmp_path / 'single.jdx', blockLines)))
+    assert 'x' not in blocks[2].read_header() and blocks[2].read_header()['title'] == 'water'
+
+
+def test_file_without_a_title_is_one_block(tmp_path):
+    filename = writeJDX(tmp_path / 'untitled.jdx', ['##JCAMP-DX=4.24', '##PEAK TABLE=(XY..XY)', '1,2', '##END='])
+    assert JCampSG.JCAMP_index_blocks(filename) == [(0, os.path.getsize(filename), os.path.getsize(filename), '', 0, None)]
+    assert JCampSG.JCAMP_blocks(filename)[0].y.tolist() == [2.0]
+
+
+def test_linspace_lines_matches_linspace_line_by_line():
+    randomNumbers = numpy.random.default_rng(0)
+    xstart = numpy.cumsum(randomNumbers.uniform(0.5, 3.0, size=201))
+    xnum = randomNumbers.integers(1, 12, size=200)
+    expected = numpy.concatenate([numpy.linspace(xstart[n], xstart[n + 1], xnum[n]) for n in range(200)])
+    assert JCampSG.linspace_lines(xstart, xnum).tobytes() == expected.tobytes()
+    assert JCampSG.linspace_lines(xstart, xnum, chunk_points=17).tobytes() == expected.tobytes()
@@ -0,0 +1,210 @@
+'''
+Tests of the conversion functions of JDXConverter.py, on the bundled JDXFiles and MoleculesInfo.csv
+Example:
+    python -m pytest tests/test_jdxconverter.py
+'''
+import os
+
+import pytest
+
+import JCampSG
+import JDXConverter
+
+#The repository, which holds the JDXFiles directory and MoleculesInfo.csv
+RepositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BundledJDXDirectory = os.path.join(RepositoryDirectory, 'JDXFiles')
+BundledJDXFileNames = sorted(fileName for fileName in os.listdir(BundledJDXDirectory) if fileName.lower().endswith('.jdx'))
+
+
+def createArrayOneValueAtATime(jcampDict):
+    """
+    This function is createArray as it was before binSpectrum: zeros up to each m/z, then its intensity, padded to MaximumAtomicUnit. It only handles increasing integer m/z values, as the bundled files have
+    """
+    DataArray = []
+    for number, intensity in zip(jcampDict['x'], jcampDict['y']):
+        assert float(number) == int(number) and number > len(DataArray)
+        while len(DataArray) + 1 != float(number):
+            DataArray.append(0)
+        DataArray.append(intensity)
+    while len(DataArray) < JDXConverter.MaximumAtomicUnit:
+        DataArray.append(0)
+    return DataArray
+
+
+@pytest.mark.parametrize('JDXFileName', BundledJDXFileNames)
+def test_create_array_gives_the_same_spectrum_as_before_on_the_bundled_files(JDXFileName):
+    jcampDict = JCampSG.JCAMP_reader(os.path.join(BundledJDXDirectory, JDXFileName))
+    binnedSpectrum = JDXConverter.createArray(jcampDict)
+    assert len(binnedSpectrum) == JDXConverter.MaximumAtomicUnit
+    assert binnedSpectrum.tolist() == [float(intensity) for intensity in createArrayOneValueAtATime(jcampDict)[:JDXConverter.MaximumAtomicUnit]]
+
+
+def test_bin_spectrum_duplicate_policies_and_rounding():
+    x = [1.0, 2.4, 2.6, 2.6, 0.0, 301.0]
+    y = [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+    #m/z 0 is below the first bin and m/z 301 above the last, both are dropped
+    with pytest.warns(UserWarning):
+        assert JDXConverter.binSpectrum(x, y, duplicatePolicy='sum', maximumAtomicUnit=4).tolist() == [1.0, 2.0, 7.0, 0.0]
+    with pytest.warns(UserWarning):
+        assert JDXConverter.binSpectrum(x, y, duplicatePolicy='max', maximumAtomicUnit=4).tolist() == [1.0, 2.0, 4.0, 0.0]
+    with pytest.warns(UserWarning):
+        assert JDXConverter.binSpectrum(x, y, duplicatePolicy='last', maximumAtomicUnit=4).tolist() == [1.0, 2.0, 4.0, 0.0]
+    with pytest.warns(UserWarning):
+        assert JDXConverter.binSpectrum(x, y, rounding='floor', maximumAtomicUnit=4).tolist() == [1.0, 9.0, 0.0, 0.0]
+    assert len(JDXConverter.binSpectrum(x, y, maximumAtomicUnit='auto')) == 301
+    with pytest.raises(ValueError):
+        JDXConverter.binSpectrum(x, y, duplicatePolicy='first')
+
+
+def writeDatabase(filename, lines):
+    with open(filename, 'w') as databaseFile:
+        databaseFile.write('\n'.join(lines) + '\n')
+    return str(filename)
+
+
+def test_molecule_database_finds_the_rows_of_the_linear_scan():
+    databaseFileName = os.path.join(RepositoryDirectory, 'MoleculesInfo.csv')
+    rows = JDXConverter.readFromLocalDatabaseFile(databaseFileName)
+    database = JDXConverter.loadMoleculeDatabase(databaseFileName)
+    assert len(database) == len(rows) and list(database) == rows
+    assert database.moleculeNames() == [row[0] for row in rows[1:]]
+    for moleculeName in database.moleculeNames() + ['NotAMolecule']:
+        assert JDXConverter.getDataIfMoleculeExists(database, moleculeName) == JDXConverter.getDataIfMoleculeExists(rows, moleculeName)
+    assert database.column('Electrons') == [row[1] for row in rows[1:]]
+
+
+def test_molecule_database_finds_normalized_names_and_aliases(tmp_path):
+    databaseFileName = writeDatabase(tmp_path / 'molecules.csv', ['Molecule Name;Electrons;CAS Number;Synonyms',
+                                                                 'Ethyl Acetate;48;141-78-6;ethyl ethanoate|EtOAc',
+                                                                 'ethanol;26;64-17-5;"alcohol; ethyl"',
+                                                                 'EtOAc;0;;'])
+    database = JDXConverter.loadMoleculeDatabase(databaseFileName)
+    assert database.lookup('  ethyl   ACETATE ')[0] == 'Ethyl Acetate'
+    assert database.lookup('141-78-6')[0] == 'Ethyl Acetate'
+    assert database.lookup('Ethyl Ethanoate')[0] == 'Ethyl Acetate'
+    #A quoted field may hold the delimeter
+    assert database.lookup('alcohol; ethyl') == ['ethanol', '26', '64-17-5', 'alcohol; ethyl']
+    #An exact molecule name wins over the synonym of another molecule
+    assert database.lookup('EtOAc')[0] == 'EtOAc'
+    assert database.lookup('NotAMolecule') == [] and 'NotAMolecule' not in database
+    database.addAlias('grain alcohol', '64-17-5')
+    assert database.lookup('Grain Alcohol')[0] == 'ethanol'
+    with pytest.raises(KeyError):
+        database.addAlias('anything', 'NotAMolecule')
+
+
+def test_molecule_database_snapshot_is_used_until_the_file_changes(tmp_path):
+    databaseFileName = writeDatabase(tmp_path / 'molecules.csv', ['Molecule Name;Electrons', 'ethanol;26'])
+    snapshotFileName = str(tmp_path / 'molecules.snapshot')
+    JDXConverter.loadMoleculeDatabase(databaseFileName, snapshotFileName=snapshotFileName)
+    assert os.path.isfile(snapshotFileName)
+    assert JDXConverter.loadMoleculeDatabase(databaseFileName, snapshotFileName=snapshotFileName).lookup('ethanol') == ['ethanol', '26']
+    writeDatabase(databaseFileName, ['Molecule Name;Electrons', 'ethanol;26', 'oxygen;16'])
+    assert JDXConverter.loadMoleculeDatabase(databaseFileName, snapshotFileName=snapshotFileName).moleculeNames() == ['ethanol', 'oxygen']
+
+
+def writeMassSpectrum(filename, title, casNumber):
+    with open(filename, 'w') as JDXFile:
+        JDXFile.write(f'##TITLE={title}\n##CAS REGISTRY NO={casNumber}\n##PEAK TABLE=(XY..XY)\n15,20 31,100\n##END=\n')
+
+
+def test_jdx_directory_index_reads_only_new_and_changed_headers(tmp_path):
+    JDXDirectory = tmp_path / 'JDXFiles'
+    JDXDirectory.mkdir()
+    writeMassSpectrum(JDXDirectory / 'ethanol.jdx', 'Ethanol', '64-17-5')
+    writeMassSpectrum(JDXDirectory / 'ch3oh.jdx', 'Methanol', '67-56-1')
+    (JDXDirectory / 'notes.txt').write_text('not a spectrum')
+    indexFileName = str(tmp_path / 'JDXDirectoryIndex.json')
+
+    JDXFilesIndex = JDXConverter.JDXDirectoryIndex(str(JDXDirectory), indexFileName=indexFileName)
+    assert JDXFilesIndex.headersRead == 2
+    assert JDXFilesIndex.find('ETHANOL') == os.path.join(str(JDXDirectory), 'ethanol.jdx')
+    assert JDXFilesIndex.find(' methanol ') == os.path.join(str(JDXDirectory), 'ch3oh.jdx')
+    assert JDXFilesIndex.find('67-56-1') == os.path.join(str(JDXDirectory), 'ch3oh.jdx')
+    assert JDXFilesIndex.find('water') is None
+    assert 'notes.txt' in JDXFilesIndex and 'water.jdx' not in JDXFilesIndex
+
+    #A later run reads no header of the unchanged files
+    assert JDXConverter.JDXDirectoryIndex(str(JDXDirectory), indexFileName=indexFileName).headersRead == 0
+
+    writeMassSpectrum(JDXDirectory / 'ch3oh.jdx', 'Methyl alcohol', '67-56-1')
+    status = os.stat(JDXDirectory / 'ch3oh.jdx')
+    os.utime(JDXDirectory / 'ch3oh.jdx', ns=(status.st_atime_ns, status.st_mtime_ns + 10**9))
+    writeMassSpectrum(JDXDirectory / 'water.jdx', 'Water', '7732-18-5')
+    os.remove(JDXDirectory / 'ethanol.jdx')
+    JDXFilesIndex = JDXConverter.JDXDirectoryIndex(str(JDXDirectory), indexFileName=indexFileName)
+    assert JDXFilesIndex.headersRead == 2
+    assert JDXFilesIndex.find('methyl alcohol') == os.path.join(str(JDXDirectory), 'ch3oh.jdx')
+    assert JDXFilesIndex.find('methanol') is None
+    assert JDXFilesIndex.find('7732-18-5') == os.path.join(str(JDXDirectory), 'water.jdx')
+    assert JDXFilesIndex.find('ethanol') is None
+
+    #The index of another directory is not used
+    otherDirectory = tmp_path / 'OtherJDXFiles'
+    otherDirectory.mkdir()
+    writeMassSpectrum(otherDirectory / 'ch3oh.jdx', 'Methyl alcohol', '67-56-1')
+    status = os.stat(JDXDirectory / 'ch3oh.jdx')
+    os.utime(otherDirectory / 'ch3oh.jdx', ns=(status.st_atime_ns, status.st_mtime_ns))
+    assert JDXConverter.JDXDirectoryIndex(str(otherDirectory), indexFileName=indexFileName).headersRead == 1
+
+
+def test_incremental_conversion_reuses_unchanged_molecules(tmp_path, monkeypatch, capsys):
+    import json
+    import shutil
+    import JDXBenchmarks
+    import NISTWebbook
+
+    #The molecule missing from the database is looked up on a stand-in serving no molecule, so its lookup fails and it stays stale
+    emptyDirectory = tmp_path / 'empty'
+    emptyDirectory.mkdir()
+    standIn = JDXBenchmarks.WebbookStandIn(str(emptyDirectory))
+    monkeypatch.setattr(NISTWebbook, 'defaultSession', NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=None))
+    monkeypatch.chdir(tmp_path)
+
+    moleculeNames = ['1butanol', '1butene', '2butanone', 'NotAMolecule']
+    os.makedirs('JDXFiles')
+    with open(os.path.join(RepositoryDirectory, 'MoleculesInfo.csv')) as databaseFile:
+        databaseLines = [line.rstrip('\n') for line in databaseFile]
+    databaseLines = databaseLines[:1] + [line for line in databaseLines[1:] if line.split(';')[0] in moleculeNames]
+    for moleculeName in moleculeNames[:3]:
+        shutil.copy(os.path.join(BundledJDXDirectory, moleculeName + '.jdx'), 'JDXFiles')
+
+    def convert(databaseLines):
+        database = JDXConverter.MoleculeDatabase(databaseLines)
+        outputFileNames = JDXConverter.convertMolecules(moleculeNames, database, JDXFilesLocation='JDXFiles', outputFileDirectoryPath='OutputFiles', outputFormats=['csv'], max_workers=1, incremental=True)
+        with open(os.path.join('OutputFiles', outputFileNames['csv'])) as outputFile:
+            table = outputFile.read()
+        with open(os.path.join('OutputFiles', 'ConvertedSpectraLibrary', 'manifest.json')) as manifestFile:
+            manifest = json.load(manifestFile)
+        return table, manifest['molecules'], capsys.readouterr().out
+
+    try:
+        firstTable, firstMolecules, output = convert(databaseLines)
+        assert 'Incremental rebuild: 0 of 4 molecules are unchanged' in output
+        assert [firstMolecules[moleculeName]['stale'] for moleculeName in moleculeNames] == [False, False, False, True]
+
+        #Only the stale molecule is converted again, and the table is the same
+        secondTable, secondMolecules, output = convert(databaseLines)
+        assert 'Incremental rebuild: 3 of 4 molecules are unchanged' in output
+        assert 'NotAMolecule NOT FOUND' in output
+        assert secondTable == firstTable
+
+        #A file that is only touched keeps its content hash, a file whose content changed is converted again
+        status = os.stat(os.path.join('JDXFiles', '1butene.jdx'))
+        os.utime(os.path.join('JDXFiles', '1butene.jdx'), ns=(status.st_atime_ns, status.st_mtime_ns + 10**9))
+        with open(os.path.join('JDXFiles', '1butanol.jdx')) as JDXFile:
+            JDXContent = JDXFile.read()
+        with open(os.path.join('JDXFiles', '1butanol.jdx'), 'w') as JDXFile:
+            JDXFile.write(JDXContent.replace('##PEAK TABLE=(XY..XY)\n', '##PEAK TABLE=(XY..XY)\n1,999\n', 1))
+        thirdTable, thirdMolecules, output = convert(databaseLines)
+        assert 'Incremental rebuild: 2 of 4 molecules are unchanged' in output
+        assert thirdTable.split('\n')[8].split(';')[1] == '999'
+        assert thirdMolecules['1butanol']['JDXFileVersion'][2] != secondMolecules['1butanol']['JDXFileVersion'][2]
+
+        #A changed database row is converted again too
+        changedLines = [line.replace('2butanone;40;', '2butanone;41;') for line in databaseLines]
+        fourthTable, fourthMolecules, output = convert(changedLines)
+        assert 'Incremental rebuild: 2 of 4 molecules are unchanged' in output
+        assert fourthTable.split('\n')[2].split(';')[3] == '41.0'
+    finally:
+        standIn.close()
@@ -0,0 +1,32 @@
+'''
+Tests of the spectra containers of SpectraContainers.py
+Example:
+    python -m pytest tests/test_spectra_containers.py
+'''
+import numpy
+
+import SpectraContainers
+
+
+def test_peak_list_merges_duplicates_and_drops_zero_intensities():
+    peakList = SpectraContainers.PeakList([31, 15, 31, 46], [60.0, 20.0, 40.0, 0.0])
+    assert peakList.massToCharges.tolist() == [15, 31]
+    assert peakList.intensities.tolist() == [20.0, 100.0]
+
+
+def test_peak_list_drops_mass_to_charges_below_1():
+    #m/z 0 has no place in the dense layout, where index i holds m/z i+1, so it would wrap around to the last index
+    peakList = SpectraContainers.PeakList([0, 5, -3], [7.0, 3.0, 1.0])
+    assert peakList.massToCharges.tolist() == [5]
+    assert peakList.toArray(10).tolist() == [0.0, 0.0, 0.0, 0.0, 3.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+
+
+def test_sparse_matrix_rows_match_the_dense_layout():
+    AllSpectra = SpectraContainers.SparseSpectraMatrix(maximumAtomicUnit=50)
+    AllSpectra.append(SpectraContainers.PeakList([15, 31, 46], [20.0, 100.0, 16.0]), MoleculeNames='ethanol')
+    AllSpectra.append(SpectraContainers.PeakList([32], [100.0]), MoleculeNames='oxygen')
+    expected = numpy.zeros((2, 50))
+    expected[0, [14, 30, 45]] = [20.0, 100.0, 16.0]
+    expected[1, 31] = 100.0
+    assert numpy.array_equal(AllSpectra.spectra, expected)
+    assert AllSpectra.metadata['MoleculeNames'] == ['ethanol', 'oxygen']
@@ -0,0 +1,98 @@
+'''
+Tests of the streaming conversion of StreamingConversion.py, on bundled JDXFiles, with the online lookups sent to an empty JDXBenchmarks.WebbookStandIn
+Example:
+    python -m pytest tests/test_streaming_conversion.py
+'''
+import filecmp
+import json
+import os
+
+import pytest
+
+import JDXBenchmarks
+import JDXConverter
+import NISTWebbook
+import StreamingConversion
+
+#The repository, which holds the JDXFiles directory and MoleculesInfo.csv
+RepositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MoleculeNames = ['1butanal', '1butanol', '1butene', '1pentene', '2butanone', '2buteneE', '2buteneZ', '2pentanone', 'acetone', 'ethanol', 'methane', 'water']
+OutputFormats = ['csv', 'txt', 'tab', 'long', 'binary']
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def offlineConversion(tmp_path, monkeypatch):
+    #The database rows have values that are looked up online, which the empty stand-in answers at once with no molecule
+    emptyDirectory = tmp_path / 'empty'
+    emptyDirectory.mkdir()
+    standIn = JDXBenchmarks.WebbookStandIn(str(emptyDirectory))
+    monkeypatch.setattr(NISTWebbook, 'defaultSession', NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=None))
+    monkeypatch.chdir(tmp_path)
+    database = JDXConverter.loadMoleculeDatabase(os.path.join(RepositoryDirectory, 'MoleculesInfo.csv'))
+
+    def convert(outputFileDirectoryPath, moleculeNames=MoleculeNames, **options):
+        return StreamingConversion.convertMoleculesStreaming(moleculeNames, database, JDXFilesLocation=os.path.join(RepositoryDirectory, 'JDXFiles'), outputFileDirectoryPath=outputFileDirectoryPath,
+                                                             outputFormats=OutputFormats, max_workers=1, moleculesPerChunk=5, queueSize=2, fetchWorkers=2, **options)
+    yield convert
+    standIn.close()
+
+
+def assertSameOutputs(outputFileNames, directory, expectedDirectory):
+    for outputFormat in OutputFormats:
+        if outputFormat == 'binary':
+            for fileName in ('spectra.npy', 'metadata.json'):
+                assert filecmp.cmp(os.path.join(directory, outputFileNames['binary'], fileName), os.path.join(expectedDirectory, outputFileNames['binary'], fileName), shallow=False)
+        else:
+            assert filecmp.cmp(os.path.join(directory, outputFileNames[outputFormat]), os.path.join(expectedDirectory, outputFileNames[outputFormat]), shallow=False), outputFormat
+
+
+def interruptAfter(monkeypatch, numberOfMolecules):
+    """
+    This function makes the emit stage stop the run, as an interruption would, when it is handed molecule numberOfMolecules + 1
+    """
+    write = StreamingConversion.StreamWriter.write
+    moleculesWritten = [0]
+
+    def interruptedWrite(writer, molecule):
+        if moleculesWritten[0] == numberOfMolecules:
+            raise Interrupted()
+        moleculesWritten[0] = moleculesWritten[0] + 1
+        return write(writer, molecule)
+    monkeypatch.setattr(StreamingConversion.StreamWriter, 'write', interruptedWrite)
+
+
+def test_interrupted_run_resumes_from_the_checkpoint(offlineConversion, monkeypatch, capsys):
+    expectedFileNames = offlineConversion('expected')
+    capsys.readouterr()
+
+    with monkeypatch.context() as patch:
+        interruptAfter(patch, 7)
+        with pytest.raises(Interrupted):
+            offlineConversion('resumed')
+    #The first chunk of 5 molecules was saved, the 2 molecules after it were only written to the long format
+    with open(os.path.join('resumed', StreamingConversion.StreamDirectoryName, 'checkpoint.json')) as checkpointFile:
+        checkpoint = json.load(checkpointFile)
+    assert checkpoint['moleculesDone'] == 5 and len(checkpoint['chunks']) == 1
+    assert checkpoint['moleculeNamesHash'] == StreamingConversion.getSha256(MoleculeNames)
+    assert 'MoleculeNames' not in checkpoint
+
+    outputFileNames = offlineConversion('resumed')
+    assert 'Resuming the conversion after 5 of 12 molecules' in capsys.readouterr().out
+    assert outputFileNames == expectedFileNames
+    assertSameOutputs(outputFileNames, 'resumed', 'expected')
+    assert not os.path.exists(os.path.join('resumed', StreamingConversion.StreamDirectoryName))
+
+
+def test_checkpoint_of_other_molecules_or_settings_is_not_resumed(offlineConversion, monkeypatch, capsys):
+    for outputDirectory, options in (('otherMolecules', {'moleculeNames': MoleculeNames[::-1]}), ('otherSettings', {'maximumAtomicUnit': 'auto'}), ('noResume', {'resume': False})):
+        with monkeypatch.context() as patch:
+            interruptAfter(patch, 6)
+            with pytest.raises(Interrupted):
+                offlineConversion(outputDirectory)
+        capsys.readouterr()
+        offlineConversion(outputDirectory, **options)
+        assert 'Resuming' not in capsys.readouterr().out
@@ -0,0 +1,161 @@
+'''
+Tests of the NIST Webbook fetch chain of NISTWebbook.py and JDXConverter.getDataForMoleculesFromOnline, run against JDXBenchmarks.WebbookStandIn so that no request leaves the machine
+Example:
+    python -m pytest tests/test_webbook.py
+'''
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy
+import pytest
+import requests
+
+import JCampSG
+import JDXBenchmarks
+import JDXConverter
+import NISTWebbook
+
+
+@pytest.fixture(scope='module')
+def standIn():
+    standIn = JDXBenchmarks.WebbookStandIn()
+    yield standIn
+    standIn.close()
+
+
+class FailingHandler(BaseHTTPRequestHandler):
+    """
+    This class answers 503 to the first server.failuresLeft requests and 200 to the ones after
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requestCount = self.server.requestCount + 1
+            failing = self.server.failuresLeft > 0
+            if failing:
+                self.server.failuresLeft = self.server.failuresLeft - 1
+        content = b'busy' if failing else b'ok'
+        self.send_response(503 if failing else 200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def failingServer():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FailingHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requestCount = 0
+    server.failuresLeft = 0
+    server.domain = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_parses_each_molecule_page_once(standIn):
+    session = NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=None)
+    try:
+        URL = session.moleculeURL('1butanol')
+        requestCount = standIn.requestCount
+        record = session.getMoleculePage(URL)
+        assert record['formula'] == 'C4H10O'
+        assert record['molecularWeight'] == 74.0
+        assert record['casNumber'] == '71-36-3'
+        assert record['massSpectrumURL'].startswith(standIn.domain + '/cgi/cbook.cgi?ID=C71363')
+        #The second lookup of the page is served from the parsed records
+        assert session.getMoleculePage(URL) is record
+        assert standIn.requestCount == requestCount + 1
+    finally:
+        session.close()
+
+
+def test_batch_fetch_returns_the_served_spectra_in_order(standIn, tmp_path, monkeypatch):
+    #The downloaded JDX files are written to JDXFiles in the current directory
+    monkeypatch.chdir(tmp_path)
+    session = NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=None)
+    moleculeNames = ['1butanol', 'NotAMolecule', '2butanone', '1butene']
+    try:
+        results = JDXConverter.getDataForMoleculesFromOnline(moleculeNames, max_workers=4, session=session, fetchMetaData=False)
+    finally:
+        session.close()
+    assert [result['SourceOfFragmentationPattern'] for result in results] == ['NIST Webbook', 'unknown', 'NIST Webbook', 'NIST Webbook']
+    for moleculeName, result in zip(moleculeNames, results):
+        assert 'molecular_formula' not in result
+        if moleculeName == 'NotAMolecule':
+            assert not numpy.any(result['spectrum_data'])
+        else:
+            expected = JDXConverter.createArray(JCampSG.JCAMP_reader(standIn.molecules[moleculeName]['JDXFileName']))
+            assert numpy.array_equal(result['spectrum_data'], expected)
+            assert (tmp_path / 'JDXFiles' / (moleculeName + '.jdx')).is_file()
+
+
+def test_batch_fetch_returns_the_metadata_of_the_pages(standIn):
+    #The electron numbers are counted with pymatgen
+    pytest.importorskip('pymatgen')
+    session = NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=None)
+    try:
+        results = JDXConverter.getDataForMoleculesFromOnline(['1butanol', 'NotAMolecule'], max_workers=2, session=session, fetchSpectrum=False)
+    finally:
+        session.close()
+    assert (results[0]['molecular_formula'], results[0]['molecular_weight'], results[0]['electron_numbers']) == ('C4H10O', 74.0, 42)
+    assert (results[1]['molecular_formula'], results[1]['molecular_weight'], results[1]['electron_numbers']) == ('unknown', 'unknown', 'unknown')
+
+
+def test_session_retries_server_errors_with_backoff(failingServer):
+    failingServer.failuresLeft = 2
+    backoffFactor = 0.1
+    session = NISTWebbook.WebbookSession(domain=failingServer.domain, requestsPerSecond=None, maxRetries=3, backoffFactor=backoffFactor)
+    try:
+        startTime = time.monotonic()
+        response = session.get('/cgi/cbook.cgi?Name=ethanol')
+        elapsed = time.monotonic() - startTime
+    finally:
+        session.close()
+    assert response.status_code == 200
+    assert response.content == b'ok'
+    assert failingServer.requestCount == 3
+    #The first retry is sent at once, the second after backoffFactor * 2 seconds
+    assert elapsed >= backoffFactor * 2
+
+
+def test_session_raises_when_the_retries_run_out(failingServer):
+    failingServer.failuresLeft = 10
+    session = NISTWebbook.WebbookSession(domain=failingServer.domain, requestsPerSecond=None, maxRetries=2, backoffFactor=0)
+    try:
+        with pytest.raises(requests.exceptions.RequestException):
+            session.get('/cgi/cbook.cgi?Name=ethanol')
+    finally:
+        session.close()
+    assert failingServer.requestCount == 3
+
+
+def test_rate_limiter_spaces_out_requests_to_the_same_host():
+    rateLimiter = NISTWebbook.HostRateLimiter(requestsPerSecond=10.0)
+    delays = [rateLimiter.reserve('http://127.0.0.1:8000/page') for request in range(3)]
+    assert delays[0] == 0.0
+    assert delays[1] == pytest.approx(0.1, abs=0.02)
+    assert delays[2] == pytest.approx(0.2, abs=0.02)
+    #Another host has slots of its own
+    assert rateLimiter.reserve('http://127.0.0.2:8000/page') == 0.0
+    assert NISTWebbook.HostRateLimiter(requestsPerSecond=None).reserve('http://127.0.0.1:8000/page') == 0.0
+
+
+def test_session_keeps_to_its_request_rate(standIn):
+    session = NISTWebbook.WebbookSession(domain=standIn.domain, requestsPerSecond=20.0)
+    try:
+        startTime = time.monotonic()
+        for moleculeName in ['1butanol', '1butene', '2butanone', '1pentene', '13butadiene']:
+            session.get(session.moleculeURL(moleculeName))
+        elapsed = time.monotonic() - startTime
+    finally:
+        session.close()
+    #The first request goes at once and each of the four after it waits for its slot of 1/20 s
+    assert elapsed >= 4 / 20.0 - 0.01